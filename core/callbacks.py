@@ -1,17 +1,20 @@
+import asyncio
 from typing import List
 
 from core.bot_commands import Command
-from nio import JoinError, MatrixRoom, UnknownEvent, InviteEvent, RoomMessageText
+from nio import JoinError, MatrixRoom, UnknownEvent, InviteEvent, RoomMessageText, SyncResponse, SyncError
 
 import logging
 
 from core.pluginloader import PluginLoader
+from core.dispatcher import EventDispatcher
+from core.errors import SyncTokenRejectedError
 
 logger = logging.getLogger(__name__)
 
 
 class Callbacks(object):
-    def __init__(self, client, store, config, plugin_loader):
+    def __init__(self, client, store, config, plugin_loader, dispatcher):
         """
         Args:
             client (nio.AsyncClient): nio client used to interact with matrix
@@ -19,15 +22,25 @@ class Callbacks(object):
             store (Storage): Bot storage
 
             config (Config): Bot configuration parameters
+
+            plugin_loader (PluginLoader): Loader of all plugins
+
+            dispatcher (EventDispatcher): Queue for events to be handled outside of the sync loop
         """
         self.client = client
         self.store = store
         self.config = config
         self.command_prefix = config.command_prefix
         self.plugin_loader: PluginLoader = plugin_loader
+        self.dispatcher: EventDispatcher = dispatcher
+        self.sync_token: str or None = None
+        """The sync token the current sync has been resumed from, until it has been accepted by the homeserver"""
+        self.__dispatched: List[asyncio.Future] = []
+        """Events of the current sync response queued to be handled by the dispatcher"""
+        self.__token_saved: asyncio.Task or None = None
 
     async def message(self, room: MatrixRoom, event: RoomMessageText):
-        """Callback for when a message event is received
+        """Callback for when a message event is received, queues the message to be handled by the dispatcher
 
         Args:
             room (nio.rooms.MatrixRoom): The room the event came from
@@ -35,13 +48,25 @@ class Callbacks(object):
             event (nio.events.room_events.RoomMessageText): The event defining the message
 
         """
-        # Extract the message text
-        msg: str = event.body
 
         # Ignore messages from ourselves
         if event.sender == self.client.user:
             return
 
+        self.__dispatched.append(await self.dispatcher.dispatch(room.room_id, self._handle_message, room, event))
+
+    async def _handle_message(self, room: MatrixRoom, event: RoomMessageText):
+        """Run commands or hooks for a received message
+
+        Args:
+            room (nio.rooms.MatrixRoom): The room the event came from
+
+            event (nio.events.room_events.RoomMessageText): The event defining the message
+
+        """
+        # Extract the message text
+        msg: str = event.body
+
         logger.debug(f"Bot message received for room {room.display_name} | " f"{room.user_name(event.sender)}: {msg}")
 
         # check if the whole message contains a line with a command
@@ -82,7 +107,7 @@ class Callbacks(object):
             return
 
         if event.type == "m.reaction":
-            await self.plugin_loader.run_hooks(self.client, event.type, room, event)
+            self.__dispatched.append(await self.dispatcher.dispatch(room.room_id, self.plugin_loader.run_hooks, self.client, event.type, room, event))
 
     async def invite(self, room: MatrixRoom, event: InviteEvent):
         """Callback for when an invite is received. Join the room specified in the invite"""
@@ -107,3 +132,43 @@ class Callbacks(object):
         else:
             logger.warning(f"Rejecting invite to {room.display_name} ({room.room_id}) due to unauthorised invite.")
             await self.client.room_leave(room.room_id)
+
+    async def sync(self, response: SyncResponse):
+        """Callback for successful syncs, stores the sync token to allow resuming from it after restarts and reconnects.
+        The token is stored once all events of the response have been handled, so events still queued are synced again after a restart
+        """
+
+        self.sync_token = None
+        dispatched: List[asyncio.Future] = self.__dispatched
+        self.__dispatched = []
+        self.__token_saved = asyncio.create_task(self.__save_sync_token(response.next_batch, dispatched, self.__token_saved))
+
+    async def __save_sync_token(self, next_batch: str, dispatched: List[asyncio.Future], previous: asyncio.Task or None):
+        """Store a sync token after the events of its response have been handled
+
+        Args:
+            next_batch (str): The sync token to store
+
+            dispatched (list[asyncio.Future]): The events of the response queued to be handled by the dispatcher
+
+            previous (asyncio.Task): Storing the token of the previous response, tokens are stored in the order they were received
+        """
+
+        if previous is not None:
+            await previous
+        await asyncio.gather(*dispatched)
+        self.store.save_sync_token(next_batch)
+
+    async def sync_error(self, response: SyncError):
+        """Callback for failed syncs, checks if the homeserver rejected the sync token the bot resumed from"""
+
+        if self.sync_token is None:
+            return
+
+        # Synapse answers an invalid since token with 400 M_UNKNOWN "Invalid stream token", other homeservers use M_INVALID_PARAM
+        status: int = response.transport_response.status if response.transport_response else 0
+        if status == 400 and response.status_code in ["M_UNKNOWN", "M_INVALID_PARAM"]:
+            logger.warning(f"Homeserver rejected sync token {self.sync_token}: {response.message}")
+            self.store.clear_sync_token()
+            self.sync_token = None
+            raise SyncTokenRejectedError(f"Sync token rejected: {response.message}")
@@ -1,21 +1,45 @@
+import asyncio
 import logging
-import math
-import os
-from asyncio import sleep
-from io import StringIO
+import mimetypes
+import re
+from functools import lru_cache
+from io import StringIO, BytesIO
 from html.parser import HTMLParser
-from typing import Union, Optional
+from typing import Union, Optional, List, Tuple, Dict, Any
 
-import aiofiles.os
-from PIL import Image
+from PIL import Image, ImageOps
 import uuid
 import blurhash
 
-from nio import SendRetryError, RoomSendResponse, Event, RoomGetEventResponse, RoomGetEventError, UploadResponse, AsyncClient, RoomSendError
+from nio import SendRetryError, RoomSendResponse, RoomSendError, Event, RoomGetEventResponse, RoomGetEventError, AsyncClient
 import commonmark
+from commonmark.render.html import HtmlRenderer
+
+from core.media_cache import media_cache
+from core.send_queue import send_queue
+from core.sent_events import sent_events
 
 logger = logging.getLogger(__name__)
 
+blurhash_preview_size: int = 64
+"""Maximum width and height of the downscaled copy of an image its blurhash is computed from"""
+thumbnail_size: Tuple[int, int] = (800, 600)
+"""Maximum width and height of thumbnails, larger images are sent with a thumbnail"""
+image_size_budget: int = 1024 * 1024
+"""Size in bytes above which images are re-encoded lossy"""
+jpeg_quality: int = 85
+passthrough_mime_types: Tuple[str, ...] = ("image/png", "image/jpeg", "image/gif", "image/webp")
+"""Formats of encoded images that are sent unchanged"""
+max_image_pixels: int = 40_000_000
+"""Number of pixels above which images are not decoded, to limit memory usage"""
+image_signatures: Tuple[Tuple[bytes, str], ...] = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
 
 class MLStripper(HTMLParser):
     def __init__(self):
@@ -38,12 +62,119 @@ def strip_tags(html):
     return s.get_data()
 
 
+class MarkdownRenderer(HtmlRenderer):
+    """
+    Renders the HTML and the plain-text body of a message in a single walk of the parsed markdown
+    """
+
+    def render(self, ast) -> Tuple[str, str]:
+        self.plain: List[str] = []
+        self.list_counters: List[int or None] = []
+        self.starts: List[int] = []
+        """Positions in plain where the links and block quotes currently rendered start"""
+        html: str = super().render(ast)
+        return re.sub(r"\n{3,}", "\n\n", "".join(self.plain)).strip(), html
+
+    def text(self, node, entering=None):
+        self.plain.append(node.literal)
+        super().text(node, entering)
+
+    def softbreak(self, node=None, entering=None):
+        self.plain.append("\n")
+        super().softbreak(node, entering)
+
+    def linebreak(self, node=None, entering=None):
+        self.plain.append("\n")
+        super().linebreak(node, entering)
+
+    def code(self, node, entering):
+        self.plain.append(node.literal)
+        super().code(node, entering)
+
+    def code_block(self, node, entering):
+        self.plain.append(f"{node.literal}\n")
+        super().code_block(node, entering)
+
+    def html_inline(self, node, entering):
+        self.plain.append(strip_tags(node.literal))
+        super().html_inline(node, entering)
+
+    def html_block(self, node, entering):
+        self.plain.append(f"{strip_tags(node.literal)}\n")
+        super().html_block(node, entering)
+
+    def link(self, node, entering):
+        if entering:
+            self.starts.append(len(self.plain))
+        else:
+            # keep the link target for plain-text clients and bridges
+            text: str = "".join(self.plain[self.starts.pop() :])
+            if node.destination and text not in (node.destination, node.destination.removeprefix("mailto:")):
+                self.plain.append(f" ({node.destination})")
+        super().link(node, entering)
+
+    def block_quote(self, node, entering):
+        if entering:
+            self.starts.append(len(self.plain))
+        else:
+            start: int = self.starts.pop()
+            lines: List[str] = "".join(self.plain[start:]).strip("\n").split("\n")
+            self.plain[start:] = ["\n".join(f"> {line}" if line else ">" for line in lines), "\n\n"]
+        super().block_quote(node, entering)
+
+    def paragraph(self, node, entering):
+        if not entering:
+            grandparent = node.parent.parent
+            tight: bool = grandparent is not None and grandparent.t == "list" and grandparent.list_data["tight"]
+            self.plain.append("\n" if tight else "\n\n")
+        super().paragraph(node, entering)
+
+    def heading(self, node, entering):
+        if not entering:
+            self.plain.append("\n\n")
+        super().heading(node, entering)
+
+    def thematic_break(self, node, entering):
+        self.plain.append("---\n\n")
+        super().thematic_break(node, entering)
+
+    def list(self, node, entering):
+        if entering:
+            self.list_counters.append(node.list_data["start"] if node.list_data["type"] == "ordered" else None)
+        else:
+            self.list_counters.pop()
+            self.plain.append("\n")
+        super().list(node, entering)
+
+    def item(self, node, entering):
+        if entering:
+            counter: int or None = self.list_counters[-1]
+            if counter is None:
+                self.plain.append("  " * (len(self.list_counters) - 1) + "- ")
+            else:
+                self.plain.append("  " * (len(self.list_counters) - 1) + f"{counter}. ")
+                self.list_counters[-1] = counter + 1
+        super().item(node, entering)
+
+
+@lru_cache(maxsize=256)
+def render_markdown(message: str) -> Tuple[str, str]:
+    """
+    Render a markdown message, results are cached to avoid rendering recurring messages again
+    :param message: the message in markdown
+    :return: tuple of the plain-text body and the HTML-formatted body
+    """
+
+    return MarkdownRenderer().render(commonmark.Parser().parse(message))
+
+
 async def room_send(
     client: AsyncClient, room_id: str, message_type: str, content: dict, tx_id: Optional[str] = None, ignore_unverified_devices: bool = False
 ) -> RoomSendResponse:
     """
-    Small wrapper function for client.room_send that implements a simple rate-limit. If more than 8 events are being sent in less than two seconds,
-    all future events are being queued up and sent every two seconds until the queue has cooled down again (e.g. no events sent for more than two seconds)
+    Small wrapper function for client.room_send that queues the event to be sent within the rate-limits of the server.
+    Events are sent in order per room, across rooms messages are prioritised over notices over reactions. If the server rate-limits the bot, sending slows down
+    and failed events are retried using the same transaction ID.
     :param client: (nio.AsyncClient) The client to communicate to matrix with
     :param room_id: (str) The room id of the room where the message should be sent to.
     :param message_type: (str) A string identifying the type of the message.
@@ -54,34 +185,12 @@ async def room_send(
     :return: RoomSendResponse
     """
 
-    send_retries: int = 0
-    max_retries: int = 3
-    send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
-    while isinstance(send_response, RoomSendError) and send_retries <= max_retries:
-        if send_response.status_code == "M_LIMIT_EXCEEDED":
-            # we're being rate-limited, try again after the given time
-            send_retries += 1
-            logger.warning(
-                f"Ratelimit hit with {message_type} to {room_id}! Server is asking us to wait {send_response.retry_after_ms}ms. "
-                f"Sending again in {math.ceil(send_response.retry_after_ms/1000)}s (Retry: {send_retries}/{max_retries})."
-            )
-            await sleep(math.ceil(send_response.retry_after_ms / 1000))
-            send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
+    return await send_queue.send(client, room_id, message_type, content, tx_id, ignore_unverified_devices)
 
-        else:
-            # unknown error, just try again after three seconds
-            send_retries += 1
-            logger.warning(f"Unknown error sending {message_type} to {room_id}. Retrying in 3 sec ({send_retries}/{max_retries}).")
-            await sleep(3)
-            send_response: RoomSendResponse or RoomSendError = await client.room_send(room_id, message_type, content, tx_id, ignore_unverified_devices)
-
-    if send_retries > max_retries:
-        # log message if it could not be sent
-        logger.warning(f"Could not send {message_type} to {room_id} after {send_retries} retries. Giving up. Message {content.get('body')} is lost!")
-    return send_response
 
-
-async def send_text_to_room(client: AsyncClient, room_id: str, message, notice=True, markdown_convert=True) -> RoomSendResponse or None:
+async def send_text_to_room(
+    client: AsyncClient, room_id: str, message, notice=True, markdown_convert=True, formatted_message: str or None = None
+) -> RoomSendResponse or None:
     """
     Send text to a matrix room
     :param client: (nio.AsyncClient) The client to communicate to matrix with
@@ -90,30 +199,36 @@ async def send_text_to_room(client: AsyncClient, room_id: str, message, notice=T
     :param notice: (bool) Whether the message should be sent with an "m.notice" message type (will not ping users)
     :param markdown_convert: (bool) Whether to convert the message content to markdown.
                                     Defaults to true.
+    :param formatted_message: (str) Optional, already formatted HTML body of the message. The message is sent as plain-text body unchanged.
     """
 
     # Determine whether to ping room members or not
     msgtype = "m.notice" if notice else "m.text"
 
-    if markdown_convert:
-        formatted_message: str = commonmark.commonmark(message)
+    body: str
+    if formatted_message is not None:
+        body = message
+    elif markdown_convert:
+        body, formatted_message = render_markdown(message)
     else:
-        formatted_message: str = message
+        body, formatted_message = strip_tags(message), message
 
     content = {
         "msgtype": msgtype,
         # legacy format
-        "body": strip_tags(message),
+        "body": body,
         "format": "org.matrix.custom.html",
         "formatted_body": formatted_message,
         # MSC1767
-        "m.message": [{"mimetype": "text/plain", "body": strip_tags(message)}, {"mimetype": "text/html", "body": formatted_message}],
+        "m.message": [{"mimetype": "text/plain", "body": body}, {"mimetype": "text/html", "body": formatted_message}],
     }
 
     response: RoomSendResponse
 
     try:
         response = await room_send(client, room_id, "m.room.message", content, ignore_unverified_devices=True)
+        if isinstance(response, RoomSendResponse):
+            sent_events.put(response.event_id, room_id, {"body": body, "formatted_body": formatted_message})
         return response
     except SendRetryError:
         logger.exception(f"Unable to send message response to {room_id}")
@@ -141,103 +256,231 @@ async def send_reaction(client, room_id, event_id: str, reaction: str):
     await room_send(client, room_id, "m.reaction", content, ignore_unverified_devices=True)
 
 
-async def send_replace(client, room_id: str, event_id: str, message: str, message_type: str = "m.text") -> str or None:
+async def send_replace(client, room_id: str, event_id: str, message: str, message_type: str = "m.text", formatted_message: str or None = None) -> str or None:
     """
     Send a replacement message (edit a previous message).
-    Gets the event from the server first and compares old content against new content. Only if the content differs, will the m.replace event be sent
+    Compares old content against new content first. Only if the content differs, will the m.replace event be sent.
+    The old content is taken from the cache of events sent by the bot, the event is only fetched from the server if it is not cached.
     :param message_type:
     :param client: (nio.AsyncClient) The client to communicate to matrix with
     :param room_id: (str) room_id to send the edit to
     :param event_id: (str) event_id to react to
     :param message: (str) the new message body
+    :param formatted_message: (str) Optional, already formatted HTML body of the message. The message is sent as plain-text body unchanged.
     :return:    (str) the event-id of the new room-event, if the original event has been replaced or
                 None, if the event has not been edited
     """
 
-    try:
-        original_response: Union[RoomGetEventResponse, RoomGetEventError] = await client.room_get_event(room_id, event_id)
-        original_event: Event = original_response.event
-        original_content = original_event.source["content"]
-    except Exception:
-        return None
+    original_content: Dict[str, Any] or None = sent_events.get(event_id)
+    if original_content is None:
+        try:
+            original_response: Union[RoomGetEventResponse, RoomGetEventError] = await client.room_get_event(room_id, event_id)
+            original_event: Event = original_response.event
+            original_content = original_event.source["content"]
+        except Exception:
+            return None
 
-    if isinstance(original_response, RoomGetEventResponse) and original_content != {}:
+        if not isinstance(original_response, RoomGetEventResponse):
+            return None
+
+    if original_content != {}:
+
+        body: str
+        if formatted_message is None:
+            body, formatted_message = render_markdown(message)
+        else:
+            body = message
 
         new_content = {
             "m.new_content": {
                 "msgtype": message_type,
                 "format": "org.matrix.custom.html",
-                "body": strip_tags(message),
-                "formatted_body": commonmark.commonmark(message),
-                "m.message": [{"mimetype": "text/plain", "body": strip_tags(message)}, {"mimetype": "text/html", "body": commonmark.commonmark(message)}],
+                "body": body,
+                "formatted_body": formatted_message,
+                "m.message": [{"mimetype": "text/plain", "body": body}, {"mimetype": "text/html", "body": formatted_message}],
             },
             "m.relates_to": {"rel_type": "m.replace", "event_id": event_id},
             "msgtype": "m.text",
             "format": "org.matrix.custom.html",
-            "body": strip_tags(message),
-            "formatted_body": commonmark.commonmark(message),
-            "m.message": [{"mimetype": "text/plain", "body": strip_tags(message)}, {"mimetype": "text/html", "body": commonmark.commonmark(message)}],
+            "body": body,
+            "formatted_body": formatted_message,
+            "m.message": [{"mimetype": "text/plain", "body": body}, {"mimetype": "text/html", "body": formatted_message}],
         }
 
         # check if there are any differences in body or formatted_body before actually sending the m.replace-event
-        if new_content["body"] != original_content["body"] or new_content["formatted_body"] != original_content["formatted_body"]:
-            return await room_send(client, room_id, "m.room.message", new_content, ignore_unverified_devices=True)
+        if new_content["body"] != original_content.get("body") or new_content["formatted_body"] != original_content.get("formatted_body"):
+            response: RoomSendResponse or RoomSendError = await room_send(client, room_id, "m.room.message", new_content, ignore_unverified_devices=True)
+            if isinstance(response, RoomSendResponse):
+                sent_events.put(event_id, room_id, {"body": body, "formatted_body": formatted_message})
+            return response
         else:
             return None
     else:
         return None
 
 
-async def send_image(client: AsyncClient, room_id: str, image: Image.Image) -> str or None:
+def sniff_image_type(data: bytes) -> str or None:
+    """
+    Detect the format of encoded image data by its signature
+    :param data: the encoded image data
+    :return:    the mimetype of the image, e.g. "image/png"
+                None, if the format is unknown
+    """
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in image_signatures:
+        if data.startswith(signature):
+            return mime_type
+    return None
+
+
+def decode_image(data: bytes, max_size: Tuple[int, int] or None = None) -> Image.Image:
+    """
+    Decode an image, optionally downscaling it. CPU-heavy, meant to be run in a worker thread.
+    :param data: the encoded image data
+    :param max_size: maximum width and height of the decoded image, None to decode it in its original size
+    :return: the decoded image
+    :raises OSError: if the image could not be decoded
+    :raises ValueError: if the image has more than max_image_pixels pixels
+    """
+
+    image: Image.Image = Image.open(BytesIO(data))
+    if image.width * image.height > max_image_pixels:
+        raise ValueError(f"Image of {image.width}x{image.height} pixels exceeds {max_image_pixels} pixels")
+
+    if max_size is not None:
+        # only decodes the image as large as needed, if supported by the format (e.g. JPEG)
+        image.thumbnail(max_size)
+    else:
+        image.load()
+    return image
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    """
+    Check if an image has transparent areas, which would be lost by encoding it as JPEG
+    :param image:
+    :return:
+    """
+
+    return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def _encode(image: Image.Image, lossy: bool) -> Tuple[bytes, str]:
+    """
+    Encode an image, lossy as JPEG unless it has transparent areas, lossless as PNG otherwise
+    :param image: the image to encode
+    :param lossy: whether lossy encoding is allowed
+    :return: tuple of the encoded image and its mimetype
+    """
+
+    buffer: BytesIO = BytesIO()
+    if lossy and not _has_alpha(image):
+        image.convert("RGB").save(buffer, "JPEG", quality=jpeg_quality, optimize=True)
+        return buffer.getvalue(), "image/jpeg"
+    else:
+        image.save(buffer, "PNG")
+        return buffer.getvalue(), "image/png"
+
+
+def _prepare_image(image: Image.Image or bytes, mime_type: str or None, max_size: int) -> Dict[str, Any]:
     """
-    Uploads the given Image-Object to the matrix-server and sends a new message including the image.
+    Prepare an image for sending. CPU-heavy, meant to be run in a worker thread.
+    Already encoded images in a format clients can display are kept as they are, unless they exceed max_size. Other images are encoded as PNG,
+    images exceeding max_size are re-encoded as JPEG. A thumbnail is generated for large images and the blurhash is computed from a small copy.
+    :param image: the image, either as PIL Image or as encoded image data
+    :param mime_type: the mimetype of encoded image data, detected from the data if not given
+    :param max_size: size in bytes above which images are re-encoded lossy
+    :return: dict of the image data, mimetype, width, height, blurhash and optionally the thumbnail's data, mimetype, width and height
+    """
+
+    data: bytes or None = None
+    if isinstance(image, bytes):
+        data = image
+        image = Image.open(BytesIO(data))
+        mime_type = mime_type or Image.MIME.get(image.format)
+        if mime_type not in passthrough_mime_types:
+            data = None
+
+    (width, height) = image.size  # image.size returns (width,height) tuple
+
+    if data is None:
+        data, mime_type = _encode(image, lossy=False)
+
+    if len(data) > max_size and mime_type != "image/gif":
+        # re-encode large images, keep animated gifs as they are
+        lossy_data, lossy_mime_type = _encode(image, lossy=True)
+        if len(lossy_data) < len(data):
+            data, mime_type = lossy_data, lossy_mime_type
+
+    # only decode the image as large as needed for the thumbnail, if supported by the format (e.g. JPEG)
+    image.draft("RGB", thumbnail_size)
+
+    prepared: Dict[str, Any] = {"data": data, "mime_type": mime_type, "width": width, "height": height}
+    preview: Image.Image = image
+    if width > thumbnail_size[0] or height > thumbnail_size[1]:
+        preview = ImageOps.contain(image, thumbnail_size)
+        prepared["thumbnail_data"], prepared["thumbnail_mime_type"] = _encode(preview, lossy=True)
+        (prepared["thumbnail_width"], prepared["thumbnail_height"]) = preview.size
+
+    # the blurhash only describes a few colour components, computing it from a small copy of the image is sufficient
+    prepared["blurhash"] = blurhash.encode(ImageOps.contain(preview, (blurhash_preview_size, blurhash_preview_size)), x_components=4, y_components=3)
+    return prepared
+
+
+async def send_image(
+    client: AsyncClient, room_id: str, image: Image.Image or bytes, mime_type: str or None = None, max_size: int = image_size_budget
+) -> RoomSendResponse or RoomSendError or None:
+    """
+    Uploads the given image to the matrix-server and sends a new message including the image.
+    Already encoded images (e.g. as fetched from the web) are sent unchanged with their original mimetype, unless they exceed max_size.
+    The image is prepared in memory by a worker thread, so large images don't block the bot.
     :param client:
     :param room_id:
-    :param image:
-    :return:     (str) the event-id of the new room-event
+    :param image: the image, either as PIL Image or as encoded image data
+    :param mime_type: the mimetype of encoded image data, detected from the data if not given
+    :param max_size: size in bytes above which images are re-encoded lossy
+    :return:     RoomSendResponse of the new room-event
                 None if sending image or message failed
     """
 
-    # temporarily save the image to a file
-    temp_filename: str = f"{uuid.uuid4().hex}.png"
     try:
-        image.save(temp_filename, "PNG")
-    except OSError:
+        prepared: Dict[str, Any] = await asyncio.to_thread(_prepare_image, image, mime_type, max_size)
+    except (OSError, ValueError, Image.DecompressionBombError) as err:
+        logger.warning(f"Failed to prepare image: {err}")
         return None
 
-    (width, height) = image.size  # image.size returns (width,height) tuple
-    mime_type: str = "image/png"
+    filename: str = f"{uuid.uuid4().hex}{mimetypes.guess_extension(prepared['mime_type']) or ''}"
 
-    # first do an upload of image, then send URI of upload to room
-    file_stat = await aiofiles.os.stat(temp_filename)
-    image_hash = blurhash.encode(temp_filename, x_components=4, y_components=3)
+    # first do an upload of image (unless it has been uploaded before), then send URI of upload to room
+    content_uri: str or None = await media_cache.upload(client, prepared["data"], prepared["mime_type"], filename)
 
-    try:
-        async with aiofiles.open(temp_filename, "r+b") as f:
-            resp, maybe_keys = await client.upload(
-                f,
-                content_type=mime_type,
-                filename=os.path.basename(temp_filename),
-                filesize=file_stat.st_size,
-            )
-        os.remove(temp_filename)
-    except OSError:
-        logger.warning(f"Failed to remove temporary image file {temp_filename}")
-
-    if isinstance(resp, UploadResponse):
+    if content_uri is not None:
         content = {
-            "body": os.path.basename(temp_filename),  # descriptive title
+            "body": filename,  # descriptive title
             "info": {
-                "size": file_stat.st_size,
-                "mimetype": mime_type,
-                "w": width,  # width in pixel
-                "h": height,  # height in pixel
-                "xyz.amorgan.blurhash": image_hash,
+                "size": len(prepared["data"]),
+                "mimetype": prepared["mime_type"],
+                "w": prepared["width"],  # width in pixel
+                "h": prepared["height"],  # height in pixel
+                "xyz.amorgan.blurhash": prepared["blurhash"],
             },
             "msgtype": "m.image",
-            "url": resp.content_uri,
+            "url": content_uri,
         }
 
+        if "thumbnail_data" in prepared:
+            thumbnail_uri: str or None = await media_cache.upload(client, prepared["thumbnail_data"], prepared["thumbnail_mime_type"], f"thumbnail_{filename}")
+            if thumbnail_uri is not None:
+                content["info"]["thumbnail_url"] = thumbnail_uri
+                content["info"]["thumbnail_info"] = {
+                    "size": len(prepared["thumbnail_data"]),
+                    "mimetype": prepared["thumbnail_mime_type"],
+                    "w": prepared["thumbnail_width"],
+                    "h": prepared["thumbnail_height"],
+                }
+
         try:
             return await room_send(client, room_id, message_type="m.room.message", content=content)
         except Exception:
@@ -0,0 +1,107 @@
+from collections import Counter, OrderedDict
+from typing import Dict, Set
+import logging
+
+from fuzzywuzzy import fuzz
+
+from core.registry import PluginRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class CommandMatcher:
+    def __init__(self, registry: PluginRegistry, min_ratio: int = 60, cache_size: int = 512):
+        """
+        Resolves (possibly misspelled) command names against the commands in the registry.
+        Candidates for fuzzy matching are pruned by an inverted index of the characters of all commands: fuzz.ratio can never exceed
+        2 * (number of shared characters) / (combined length), so commands that can't reach min_ratio are never scored.
+        Results (including misses) are kept in an LRU cache, which is dropped whenever the registry changes.
+        :param registry: the registry holding all commands
+        :param min_ratio: a command matches, if its fuzz.ratio is higher than min_ratio
+        :param cache_size: number of resolved command names to keep
+        """
+
+        self.registry: PluginRegistry = registry
+        self.min_ratio: int = min_ratio
+        self.cache_size: int = cache_size
+        self.cache: OrderedDict[str, str or None] = OrderedDict()
+        self.version: int = -1
+
+        self.__char_index: Dict[str, Set[str]] = {}
+        self.__char_counts: Dict[str, Counter] = {}
+        self.__order: Dict[str, int] = {}
+
+    def __rebuild(self) -> None:
+        """
+        Rebuild the character index from the registry's commands and clear the cache
+        :return:
+        """
+
+        self.__char_index = {}
+        self.__char_counts = {}
+        self.__order = {}
+
+        for position, command in enumerate(self.registry.commands.keys()):
+            self.__order[command] = position
+            self.__char_counts[command] = Counter(command)
+            for char in self.__char_counts[command]:
+                self.__char_index.setdefault(char, set()).add(command)
+
+        self.cache.clear()
+        self.version = self.registry.version
+        logger.debug(f"Rebuilt command matcher for {len(self.__order)} commands")
+
+    def match(self, command: str) -> str or None:
+        """
+        Find the registered command matching the given command name, either exactly or by fuzzy matching
+        :param command: the (lowercase) command name as entered by the user
+        :return:    name of the registered command with the highest match, if any
+                    None, otherwise
+        """
+
+        if command in self.registry.commands:
+            return command
+
+        if self.version != self.registry.version:
+            self.__rebuild()
+
+        if command in self.cache:
+            self.cache.move_to_end(command)
+            return self.cache[command]
+
+        result: str or None = self.__fuzzy_match(command)
+        self.cache[command] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return result
+
+    def __fuzzy_match(self, command: str) -> str or None:
+        """
+        Score all candidates which could possibly exceed min_ratio and return the best match
+        :param command: the command name as entered by the user
+        :return:    name of the best matching command, ties are resolved in registration order
+                    None, if no command matches
+        """
+
+        command_counts: Counter = Counter(command)
+        candidates: Set[str] = set()
+        char: str
+        for char in command_counts:
+            candidates.update(self.__char_index.get(char, ()))
+
+        best_command: str or None = None
+        best_ratio: int = self.min_ratio
+        candidate: str
+        for candidate in sorted(candidates, key=self.__order.get):
+            shared_chars: int = sum((command_counts & self.__char_counts[candidate]).values())
+            if round(200 * shared_chars / (len(command) + len(candidate))) <= best_ratio:
+                # upper bound of the ratio can't beat the current best match
+                continue
+
+            ratio: int = fuzz.ratio(command, candidate)
+            if ratio > best_ratio:
+                best_ratio = ratio
+                best_command = candidate
+
+        return best_command
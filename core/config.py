@@ -44,6 +44,8 @@ class Config(object):
         # Storage setup
         self.database_filepath = self._get_cfg(["storage", "database_filepath"], required=True)
         self.store_filepath = self._get_cfg(["storage", "store_filepath"], required=True)
+        self.sent_events_cache_size: int = self._get_cfg(["storage", "sent_events_cache_size"], required=False, default=1000)
+        self.media_cache_size: int = self._get_cfg(["storage", "media_cache_size"], required=False, default=1000)
 
         # Create the store folder if it doesn't exist
         if not os.path.isdir(self.store_filepath):
@@ -63,12 +65,39 @@ class Config(object):
         self.homeserver_url = self._get_cfg(["matrix", "homeserver_url"], required=True)
         self.enable_encryption = self._get_cfg(["matrix", "enable_encryption"], default=False)
         self.botmasters = self._get_cfg(["matrix", "botmasters"], required=False, default=[])
+        self.resume_sync: bool = self._get_cfg(["matrix", "resume_sync"], required=False, default=True)
+        self.sync_filter_enabled: bool = self._get_cfg(["matrix", "sync_filter", "enabled"], required=False, default=True)
+        self.sync_filter_lazy_load_members: bool = self._get_cfg(["matrix", "sync_filter", "lazy_load_members"], required=False, default=False)
 
         self.command_prefix = self._get_cfg(["command_prefix"], default="!c ")
 
+        # event handling
+        self.event_queue_max_size: int = self._get_cfg(["event_queue", "max_size"], required=False, default=1000)
+        self.event_queue_workers: int = self._get_cfg(["event_queue", "workers"], required=False, default=8)
+
+        # sending events
+        self.send_queue_global_rate: float = self._get_cfg(["send_queue", "global_rate"], required=False, default=4.0)
+        self.send_queue_global_burst: int = self._get_cfg(["send_queue", "global_burst"], required=False, default=8)
+        self.send_queue_room_rate: float = self._get_cfg(["send_queue", "room_rate"], required=False, default=2.0)
+        self.send_queue_room_burst: int = self._get_cfg(["send_queue", "room_burst"], required=False, default=8)
+        self.send_queue_max_retries: int = self._get_cfg(["send_queue", "max_retries"], required=False, default=3)
+
+        # metrics
+        self.metrics_http_enabled: bool = self._get_cfg(["metrics", "http", "enabled"], required=False, default=False)
+        self.metrics_http_host: str = self._get_cfg(["metrics", "http", "host"], required=False, default="127.0.0.1")
+        self.metrics_http_port: int = self._get_cfg(["metrics", "http", "port"], required=False, default=9090)
+
         # plugins
         self.plugins_allowlist = self._get_cfg(["plugins", "allowlist"], required=False, default=[])
         self.plugins_denylist = self._get_cfg(["plugins", "denylist"], required=False, default=[])
+        self.plugins_lazy_loading: bool = self._get_cfg(["plugins", "lazy_loading"], required=False, default=False)
+        self.hooks_max_concurrency: int = self._get_cfg(["plugins", "hooks", "max_concurrency"], required=False, default=8)
+        self.hooks_timeout: float = self._get_cfg(["plugins", "hooks", "timeout"], required=False, default=30)
+        self.http_timeout: float = self._get_cfg(["plugins", "http", "timeout"], required=False, default=30)
+        self.http_limit_per_host: int = self._get_cfg(["plugins", "http", "limit_per_host"], required=False, default=8)
+        self.http_retries: int = self._get_cfg(["plugins", "http", "retries"], required=False, default=2)
+        self.http_cache_size: int = self._get_cfg(["plugins", "http", "cache_size"], required=False, default=16)
+        self.http_cache_persistent: bool = self._get_cfg(["plugins", "http", "cache_persistent"], required=False, default=False)
 
     def _get_cfg(
         self,
@@ -0,0 +1,107 @@
+import asyncio
+from collections import deque
+from typing import Dict, Deque, Set, List, Tuple, Callable, Awaitable, Any
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class EventDispatcher:
+    def __init__(self, max_queue_size: int = 1000, workers: int = 8):
+        """
+        Decouples handling of events from the sync loop.
+        Events are put on a per-room queue and processed by a pool of workers. Events of the same room are handled strictly in order,
+        different rooms are handled in parallel.
+        :param max_queue_size: maximum number of events waiting to be handled, dispatch() blocks if the queue is full
+        :param workers: number of worker tasks, e.g. the number of rooms processed in parallel
+        """
+
+        self.max_queue_size: int = max_queue_size
+        self.workers: int = workers
+        self.room_queues: Dict[str, Deque[Tuple[Callable[..., Awaitable[Any]], tuple, asyncio.Future]]] = {}
+        self.active_rooms: Set[str] = set()
+        self.depth: int = 0
+        """Total number of events waiting to be handled or being handled"""
+
+        self.__capacity: asyncio.Semaphore = asyncio.Semaphore(max_queue_size)
+        self.__ready_rooms: asyncio.Queue = asyncio.Queue()
+        self.__worker_tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """
+        Start the worker tasks, needs to be called from within the running event loop
+        :return:
+        """
+
+        if not self.__worker_tasks:
+            for worker in range(self.workers):
+                self.__worker_tasks.append(asyncio.create_task(self.__worker(), name=f"dispatcher-worker-{worker}"))
+            logger.debug(f"Started {self.workers} dispatcher workers")
+
+    async def stop(self) -> None:
+        """
+        Cancel all worker tasks, events still queued are dropped
+        :return:
+        """
+
+        worker_task: asyncio.Task
+        for worker_task in self.__worker_tasks:
+            worker_task.cancel()
+        await asyncio.gather(*self.__worker_tasks, return_exceptions=True)
+        self.__worker_tasks = []
+
+    async def dispatch(self, room_id: str, method: Callable[..., Awaitable[Any]], *args) -> asyncio.Future:
+        """
+        Queue a coroutine function to be run for a room. Waits if the queue is full.
+        :param room_id: the room the event belongs to, determines the ordering
+        :param method: the coroutine function handling the event
+        :param args: arguments passed to method
+        :return: future resolved once the event has been handled, also if handling it failed. Never resolved if the event is dropped by stop()
+        """
+
+        self.start()
+
+        if self.__capacity.locked():
+            logger.warning(f"Event queue is full ({self.depth} events), waiting for workers to catch up.")
+        await self.__capacity.acquire()
+
+        handled: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.room_queues.setdefault(room_id, deque()).append((method, args, handled))
+        self.depth += 1
+        if room_id not in self.active_rooms:
+            # room is neither queued nor being handled by a worker
+            self.active_rooms.add(room_id)
+            self.__ready_rooms.put_nowait(room_id)
+
+        return handled
+
+    async def __worker(self) -> None:
+        """
+        Take the next room with pending events, handle its oldest event and requeue the room if there are more events left
+        :return:
+        """
+
+        while True:
+            room_id: str = await self.__ready_rooms.get()
+            room_queue: Deque = self.room_queues[room_id]
+            method, args, handled = room_queue.popleft()
+
+            try:
+                await method(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.critical(f"Failed to handle event for {room_id}:")
+                traceback.print_exc()
+            finally:
+                self.depth -= 1
+                self.__capacity.release()
+            handled.set_result(None)
+
+            if room_queue:
+                # requeue the room at the end to let other rooms take turns
+                self.__ready_rooms.put_nowait(room_id)
+            else:
+                del self.room_queues[room_id]
+                self.active_rooms.discard(room_id)
@@ -7,3 +7,14 @@ class ConfigError(RuntimeError):
 
     def __init__(self, msg):
         super(ConfigError, self).__init__("%s" % (msg,))
+
+
+class SyncTokenRejectedError(RuntimeError):
+    """The homeserver rejected the sync token the bot tried to resume syncing from
+
+    Args:
+        msg (str): The message displayed to the user on error
+    """
+
+    def __init__(self, msg):
+        super(SyncTokenRejectedError, self).__init__("%s" % (msg,))
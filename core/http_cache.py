@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from time import time
+from typing import Any, Dict
+
+from multidict import CIMultiDict, CIMultiDictProxy
+
+from core.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    def __init__(self, url: str, status_code: int, headers: CIMultiDictProxy, content: bytes, encoding: str or None, expires: float):
+        """
+        A cached http response
+        :param url: the final url of the response, after redirects
+        :param status_code: the http status code
+        :param headers: the response headers
+        :param content: the response body
+        :param encoding: the charset of the response body, if given by the server
+        :param expires: unix timestamp the response needs to be revalidated after
+        """
+
+        self.url: str = url
+        self.status_code: int = status_code
+        self.headers: CIMultiDictProxy = headers
+        self.content: bytes = content
+        self.encoding: str or None = encoding
+        self.expires: float = expires
+
+    @property
+    def fresh(self) -> bool:
+        return time() < self.expires
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        """
+        Headers of a conditional request to revalidate the response, empty if the server did not send an ETag or Last-Modified header
+        """
+
+        validators: Dict[str, str] = {}
+        if "ETag" in self.headers:
+            validators["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            validators["If-Modified-Since"] = self.headers["Last-Modified"]
+        return validators
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+
+def get_cache_key(method: str, url: str, params: Any = None, headers: Any = None) -> str:
+    """
+    Get the key of a request in the cache
+    :param method: the http method, e.g. "GET"
+    :param url: the requested url
+    :param params: query parameters of the request
+    :param headers: headers of the request
+    :return: a hash of the request
+    """
+
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    if isinstance(headers, dict):
+        headers = sorted(headers.items())
+    return hashlib.sha256(json.dumps([method.upper(), url, params, headers], default=str).encode()).hexdigest()
+
+
+class HttpCache:
+    def __init__(self, max_size: int = 16 * 1024 * 1024):
+        """
+        Size-bounded cache of http responses, keyed by a hash of the request.
+        The least recently used responses are evicted once the cached content exceeds max_size bytes. Responses are optionally
+        persisted to the bot's storage to survive restarts.
+        :param max_size: maximum size of all cached response bodies, in bytes
+        """
+
+        self.max_size: int = max_size
+        self.store: Storage or None = None
+        self.responses: OrderedDict[str, CachedResponse] = OrderedDict()
+        self.size: int = 0
+
+    def configure(self, store: Storage or None, max_size: int) -> None:
+        """
+        Set the storage responses are persisted to and the size of the cache
+        :param store: the bot's storage, None to only keep responses in memory
+        :param max_size: maximum size of all cached response bodies, in bytes
+        :return:
+        """
+
+        self.store = store
+        self.max_size = max_size
+        self.responses = OrderedDict()
+        self.size = 0
+
+    def get(self, cache_key: str) -> CachedResponse or None:
+        """
+        Get a cached response, which may have to be revalidated
+        :param cache_key: key of the request
+        :return:    the cached response
+                    None, if the request is not cached
+        """
+
+        response: CachedResponse or None = self.responses.get(cache_key)
+        if response is None and self.store is not None:
+            try:
+                row: Dict[str, Any] or None = self.store.get_http_response(cache_key)
+            except Exception as err:
+                logger.warning(f"Could not read http response {cache_key} from storage: {err}")
+                row = None
+            if row is not None:
+                response = CachedResponse(
+                    row["url"], row["status_code"], CIMultiDictProxy(CIMultiDict(row["headers"])), row["content"], row["encoding"], row["expires"]
+                )
+                self.__remember(cache_key, response)
+        elif response is not None:
+            self.responses.move_to_end(cache_key)
+
+        return response
+
+    def put(self, cache_key: str, response: CachedResponse) -> None:
+        """
+        Store a response, or update the expiry of a revalidated response
+        :param cache_key: key of the request
+        :param response: the response to cache
+        :return:
+        """
+
+        if response.size > self.max_size:
+            return
+
+        self.__remember(cache_key, response)
+        if self.store is not None:
+            try:
+                self.store.save_http_response(
+                    cache_key,
+                    {
+                        "url": response.url,
+                        "status_code": response.status_code,
+                        "headers": list(response.headers.items()),
+                        "content": response.content,
+                        "encoding": response.encoding,
+                        "expires": response.expires,
+                    },
+                    self.max_size,
+                )
+            except Exception as err:
+                logger.warning(f"Could not persist http response {cache_key}: {err}")
+
+    def __remember(self, cache_key: str, response: CachedResponse) -> None:
+        previous: CachedResponse or None = self.responses.pop(cache_key, None)
+        if previous is not None:
+            self.size -= previous.size
+        self.responses[cache_key] = response
+        self.size += response.size
+        while self.size > self.max_size:
+            evicted: CachedResponse = self.responses.popitem(last=False)[1]
+            self.size -= evicted.size
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+from time import time
+from typing import Any
+
+import aiohttp
+from multidict import CIMultiDictProxy
+
+from core.http_cache import HttpCache, CachedResponse, get_cache_key
+from core.metrics import metrics
+from core.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class HttpStatusError(aiohttp.ClientError):
+    def __init__(self, response: "HttpResponse"):
+        """
+        Raised by HttpResponse.raise_for_status() for responses with an error status
+        :param response: the failed response
+        """
+
+        super().__init__(f"{response.status_code} requesting {response.url}")
+        self.response: HttpResponse = response
+
+
+class HttpSizeError(aiohttp.ClientError):
+    def __init__(self, url: str, max_size: int):
+        """
+        Raised if a response body exceeds the maximum size of a request
+        :param url: the requested url
+        :param max_size: the maximum size of the response body, in bytes
+        """
+
+        super().__init__(f"Response of {url} exceeds {max_size} bytes")
+        self.url: str = url
+        self.max_size: int = max_size
+
+
+class HttpResponse:
+    def __init__(self, url: str, status_code: int, headers: CIMultiDictProxy, content: bytes, encoding: str or None):
+        """
+        A completely read http response, similar to requests.Response
+        :param url: the final url of the response, after redirects
+        :param status_code: the http status code
+        :param headers: the response headers
+        :param content: the response body
+        :param encoding: the charset of the response body, if given by the server
+        """
+
+        self.url: str = url
+        self.status_code: int = status_code
+        self.headers: CIMultiDictProxy = headers
+        self.content: bytes = content
+        self.encoding: str or None = encoding
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        """
+        Raise HttpStatusError if the response has an error status
+        :return:
+        """
+
+        if not self.ok:
+            raise HttpStatusError(self)
+
+
+class HttpClient:
+    def __init__(self, timeout: float = 30, limit: int = 100, limit_per_host: int = 8, retries: int = 2, retry_delay: float = 1.0):
+        """
+        Shared http client for all plugins, keeping connections alive and pooled across requests.
+        Idempotent requests failing due to connection errors, timeouts or server errors are retried with exponential backoff.
+        GET requests sent with a cache_ttl are served from a response cache. Concurrent identical GET requests share a single request.
+        Connection errors and timeouts are raised as aiohttp.ClientError.
+        :param timeout: default timeout of a request, in seconds
+        :param limit: maximum number of open connections
+        :param limit_per_host: maximum number of open connections to a single host
+        :param retries: default number of retries of idempotent requests
+        :param retry_delay: seconds to wait before the first retry, doubled for each further retry
+        """
+
+        self.timeout: float = timeout
+        self.limit: int = limit
+        self.limit_per_host: int = limit_per_host
+        self.retries: int = retries
+        self.retry_delay: float = retry_delay
+        self.session: aiohttp.ClientSession or None = None
+        self.cache: HttpCache = HttpCache()
+        """Responses of requests sent with a cache_ttl"""
+        self.in_flight: SingleFlight = SingleFlight("http")
+        """GET requests currently running"""
+
+    def configure(self, timeout: float, limit_per_host: int, retries: int) -> None:
+        """
+        Apply the configured defaults, only affects sessions created afterwards
+        :param timeout: default timeout of a request, in seconds
+        :param limit_per_host: maximum number of open connections to a single host
+        :param retries: default number of retries of idempotent requests
+        :return:
+        """
+
+        self.timeout = timeout
+        self.limit_per_host = limit_per_host
+        self.retries = retries
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the shared session, created on first use as it needs a running event loop
+        :return:
+        """
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": "nio-smith"},
+            )
+        return self.session
+
+    async def request(self, method: str, url: str, retries: int or None = None, cache_ttl: float = 0, max_size: int or None = None, **kwargs) -> HttpResponse:
+        """
+        Send a request and read the complete response
+        :param method: the http method, e.g. "GET"
+        :param url: the url to request
+        :param retries: number of retries, defaults to the configured number of retries for idempotent methods and 0 otherwise
+        :param cache_ttl: seconds a successful response to a GET request may be served from the cache, 0 disables caching.
+                          Expired responses are revalidated with the server if it sent an ETag or Last-Modified header.
+        :param max_size: maximum size of the response body in bytes, larger responses are aborted while downloading and raise HttpSizeError
+        :param kwargs: further arguments passed to aiohttp.ClientSession.request(), e.g. params, headers, json, ssl or timeout
+        :return: the response, which may have an error status
+        """
+
+        if retries is None:
+            retries = self.retries if method.upper() in ("GET", "HEAD", "OPTIONS", "PUT", "DELETE") else 0
+        if isinstance(kwargs.get("timeout"), (int, float)):
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=kwargs["timeout"])
+
+        if method.upper() != "GET":
+            return await self.__fetch(method, url, retries, max_size, **kwargs)
+
+        cache_key: str = get_cache_key(method, url, kwargs.get("params"), kwargs.get("headers"))
+
+        # concurrent requests only share a result if all other arguments, e.g. ssl, timeout or auth, are the same as well
+        options: tuple = tuple(sorted((name, value) for name, value in kwargs.items() if name not in ("params", "headers")))
+        try:
+            hash(options)
+        except TypeError:
+            # e.g. a request body, which can't be compared cheaply
+            return await self.__get(cache_key, url, retries, cache_ttl, max_size, **kwargs)
+        return await self.in_flight.do((cache_key, max_size, options), self.__get, cache_key, url, retries, cache_ttl, max_size, **kwargs)
+
+    async def __get(self, cache_key: str, url: str, retries: int, cache_ttl: float, max_size: int or None, **kwargs) -> HttpResponse:
+        """
+        Send a GET request, using the cache if a cache_ttl is given
+        :param cache_key: key of the request
+        :param url: the url to request
+        :param retries: number of retries
+        :param cache_ttl: seconds a successful response may be served from the cache, 0 disables caching
+        :param max_size: maximum size of the response body in bytes
+        :param kwargs: further arguments passed to aiohttp.ClientSession.request()
+        :return: the response, which may have an error status
+        """
+
+        if cache_ttl <= 0:
+            return await self.__fetch("GET", url, retries, max_size, **kwargs)
+
+        cached: CachedResponse or None = self.cache.get(cache_key)
+        if cached is not None and cached.fresh:
+            metrics.increment("http_cache", "hit")
+            return HttpResponse(cached.url, cached.status_code, cached.headers, cached.content, cached.encoding)
+
+        if cached is not None and cached.validators:
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), **cached.validators}
+        response: HttpResponse = await self.__fetch("GET", url, retries, max_size, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            metrics.increment("http_cache", "revalidated")
+            cached.expires = time() + cache_ttl
+            self.cache.put(cache_key, cached)
+            return HttpResponse(cached.url, cached.status_code, cached.headers, cached.content, cached.encoding)
+
+        metrics.increment("http_cache", "miss")
+        if response.status_code == 200 and "no-store" not in response.headers.get("Cache-Control", ""):
+            self.cache.put(
+                cache_key, CachedResponse(response.url, response.status_code, response.headers, response.content, response.encoding, time() + cache_ttl)
+            )
+        return response
+
+    async def __fetch(self, method: str, url: str, retries: int, max_size: int or None, **kwargs) -> HttpResponse:
+        """
+        Send a request, retrying on connection errors, timeouts and server errors
+        :param method: the http method, e.g. "GET"
+        :param url: the url to request
+        :param retries: number of retries
+        :param max_size: maximum size of the response body in bytes
+        :param kwargs: further arguments passed to aiohttp.ClientSession.request()
+        :return: the response, which may have an error status
+        """
+
+        attempt: int = 0
+        while True:
+            try:
+                async with self.__get_session().request(method, url, **kwargs) as response:
+                    content: bytes = await self.__read(response, max_size)
+                    http_response: HttpResponse = HttpResponse(str(response.url), response.status, response.headers, content, response.charset)
+                if http_response.status_code < 500 and http_response.status_code != 429 or attempt >= retries:
+                    return http_response
+                logger.debug(f"{http_response.status_code} requesting {url}")
+
+            except asyncio.TimeoutError:
+                if attempt >= retries:
+                    raise aiohttp.ServerTimeoutError(f"Timeout requesting {url}")
+                logger.debug(f"Timeout requesting {url}")
+
+            except aiohttp.ClientConnectionError as err:
+                if attempt >= retries:
+                    raise
+                logger.debug(f"Connection error requesting {url}: {err}")
+
+            await asyncio.sleep(self.retry_delay * 2**attempt)
+            attempt += 1
+
+    @staticmethod
+    async def __read(response: aiohttp.ClientResponse, max_size: int or None) -> bytes:
+        """
+        Read the body of a response, streaming it in chunks if its size is limited
+        :param response: the response to read
+        :param max_size: maximum size of the response body in bytes, None to read it at once
+        :return: the response body
+        :raises HttpSizeError: if the body exceeds max_size
+        """
+
+        if max_size is None:
+            return await response.read()
+
+        if response.content_length is not None and response.content_length > max_size:
+            raise HttpSizeError(str(response.url), max_size)
+
+        content: bytearray = bytearray()
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            content += chunk
+            if len(content) > max_size:
+                raise HttpSizeError(str(response.url), max_size)
+        return bytes(content)
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        """
+        Send a GET request
+        :param url: the url to request
+        :param kwargs: further arguments passed to request()
+        :return: the response, which may have an error status
+        """
+
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        """
+        Send a POST request, which is not retried by default
+        :param url: the url to request
+        :param kwargs: further arguments passed to request()
+        :return: the response, which may have an error status
+        """
+
+        return await self.request("POST", url, **kwargs)
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        """
+        Send a GET request and decode the json response
+        :param url: the url to request
+        :param kwargs: further arguments passed to request()
+        :return: the decoded response
+        :raises HttpStatusError: if the response has an error status
+        """
+
+        response: HttpResponse = await self.get(url, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self) -> None:
+        """
+        Close all connections
+        :return:
+        """
+
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+http: HttpClient = HttpClient()
+"""Http client shared by all plugins"""
@@ -0,0 +1,247 @@
+import datetime
+import json
+import logging
+import os
+from concurrent.futures import Future
+from typing import Any, Dict, List, Callable, Awaitable
+
+from core.plugin import Plugin, PluginCommand, PluginHook
+from core.timer import Timer
+from core.storage import write_file_later
+
+logger = logging.getLogger(__name__)
+
+
+class PluginManifest:
+    def __init__(self, filename: str):
+        """
+        Cache of the commands, hooks and timers of all plugins, used to register plugins without importing them.
+        Each entry is keyed by the modification times of the plugin's source, configuration and state files and only valid as long as
+        none of these files have changed.
+        :param filename: the file the manifest is stored in
+        """
+
+        self.filename: str = filename
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename) as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as err:
+                logger.warning(f"Could not load plugin manifest from {self.filename}, plugins will be imported: {err}")
+
+    def save(self) -> bool:
+        """
+        Save the manifest to disk. The file is written in the background, errors writing it are logged
+        :return:    True, if the manifest is being saved
+                    False, otherwise
+        """
+
+        try:
+            content: str = json.dumps(self.entries)
+        except (TypeError, ValueError) as err:
+            logger.warning(f"Could not encode plugin manifest: {err}")
+            return False
+
+        write_file_later(self.filename, content).add_done_callback(self.__written)
+        return True
+
+    def __written(self, future: Future) -> None:
+        if future.exception() is not None:
+            logger.warning(f"Could not write plugin manifest to {self.filename}: {future.exception()}")
+
+    def get(self, module: str, files: List[str]) -> Dict[str, Any] or None:
+        """
+        Get the manifest entry of a plugin, if it is still valid
+        :param module: name of the plugin's module
+        :param files: the files the entry depends on
+        :return:    the manifest entry, if none of the files have changed
+                    None, otherwise
+        """
+
+        entry: Dict[str, Any] or None = self.entries.get(module)
+        if entry and entry.get("files") == self.__get_mtimes(files):
+            return entry
+        return None
+
+    def update(self, module: str, plugin: Plugin, files: List[str]) -> None:
+        """
+        Create or replace the manifest entry of a loaded plugin
+        :param module: name of the plugin's module
+        :param plugin: the loaded plugin
+        :param files: the files the entry depends on
+        :return:
+        """
+
+        self.entries[module] = {
+            "files": self.__get_mtimes(files),
+            "name": plugin.name,
+            "category": plugin.category,
+            "description": plugin.description,
+            "commands": [
+                {
+                    "command": command.command,
+                    "help_text": command.help_text,
+                    "power_level": command.power_level,
+                    "room_id": command.room_id,
+                    "command_type": command.command_type,
+                }
+                for command in plugin._get_commands().values()
+            ],
+            "hooks": [
+                {
+                    "event_type": event_type,
+                    "method": hook.method.__name__,
+                    "room_id_list": hook.room_id_list,
+                    "event_ids": hook.event_ids,
+                    "hook_type": hook.hook_type,
+                }
+                for event_type, hooks in plugin._get_hooks().items()
+                for hook in hooks
+            ],
+            "timers": [
+                {
+                    "name": timer.name,
+                    "frequency": timer.frequency.total_seconds() if isinstance(timer.frequency, datetime.timedelta) else timer.frequency,
+                    "last_execution": timer.last_execution.isoformat() if timer.last_execution else None,
+                    "timer_type": timer.timer_type,
+                }
+                for timer in plugin._get_timers()
+            ],
+        }
+
+    @staticmethod
+    def __get_mtimes(files: List[str]) -> List[float or None]:
+        """
+        Get the modification times of the given files
+        :param files:
+        :return: list of modification times, None for files that don't exist
+        """
+
+        return [os.path.getmtime(file) if os.path.isfile(file) else None for file in files]
+
+
+class LazyPlugin(Plugin):
+    def __init__(self, entry: Dict[str, Any], import_plugin: Callable[[str], Awaitable[Plugin]]):
+        """
+        Placeholder of a plugin that has not been imported yet, built from its manifest entry.
+        Provides the plugin's commands, hooks and timers, which import the actual plugin on their first use and then call the plugin's methods.
+        :param entry: the manifest entry of the plugin
+        :param import_plugin: coroutine function importing the actual plugin, given the plugin's name
+        """
+
+        super().__init__(entry["name"], entry["category"], entry["description"])
+        self.import_plugin: Callable[[str], Awaitable[Plugin]] = import_plugin
+
+        command: Dict[str, Any]
+        for command in entry["commands"]:
+            self.commands[command["command"]] = PluginCommand(
+                command["command"],
+                self.__proxy(command["command"], self.__resolve_command(command["command"])),
+                command["help_text"],
+                power_level=command["power_level"],
+                room_id=command["room_id"],
+                command_type=command["command_type"],
+            )
+            self.help_texts[command["command"]] = command["help_text"]
+            for room in command["room_id"] or []:
+                if room not in self.rooms:
+                    self.rooms.append(room)
+
+        hook: Dict[str, Any]
+        for hook in entry["hooks"]:
+            self.hooks.setdefault(hook["event_type"], []).append(
+                PluginHook(
+                    hook["event_type"],
+                    self.__proxy(hook["method"], self.__resolve_hook(hook["event_type"], hook["method"])),
+                    room_id_list=hook["room_id_list"],
+                    event_ids=hook["event_ids"],
+                    hook_type=hook["hook_type"],
+                )
+            )
+
+        timer: Dict[str, Any]
+        for timer in entry["timers"]:
+            frequency: str or float or None = timer["frequency"]
+            self.timers.append(
+                Timer(
+                    timer["name"],
+                    self.__proxy(timer["name"].split(".")[-1], self.__resolve_timer(timer["name"])),
+                    frequency=datetime.timedelta(seconds=frequency) if isinstance(frequency, (int, float)) else frequency,
+                    last_execution=datetime.datetime.fromisoformat(timer["last_execution"]) if timer["last_execution"] else None,
+                    timer_type=timer["timer_type"],
+                )
+            )
+
+    def __proxy(self, name: str, resolve: Callable[[Plugin], Callable or None]) -> Callable:
+        """
+        Create a method importing the actual plugin and calling the method resolved from it
+        :param name: name of the proxied method
+        :param resolve: returns the actual method from the imported plugin
+        :return: coroutine function
+        """
+
+        async def proxy(*args):
+            plugin: Plugin = await self.import_plugin(self.name)
+            method: Callable or None = resolve(plugin)
+            if method is None:
+                logger.warning(f"{name} is no longer provided by plugin {self.name}, ignoring call.")
+            else:
+                return await method(*args)
+
+        proxy.__name__ = name
+        return proxy
+
+    @staticmethod
+    def __resolve_command(command: str) -> Callable[[Plugin], Callable or None]:
+        def resolve(plugin: Plugin) -> Callable or None:
+            plugin_command: PluginCommand or None = plugin._get_commands().get(command)
+            return plugin_command.method if plugin_command else None
+
+        return resolve
+
+    @staticmethod
+    def __resolve_hook(event_type: str, method_name: str) -> Callable[[Plugin], Callable or None]:
+        def resolve(plugin: Plugin) -> Callable or None:
+            for plugin_hook in plugin._get_hooks().get(event_type, []):
+                if plugin_hook.method.__name__ == method_name:
+                    return plugin_hook.method
+            return None
+
+        return resolve
+
+    @staticmethod
+    def __resolve_timer(timer_name: str) -> Callable[[Plugin], Callable or None]:
+        def resolve(plugin: Plugin) -> Callable or None:
+            for plugin_timer in plugin._get_timers():
+                if plugin_timer.name == timer_name:
+                    # trigger the actual timer to keep track of its last execution
+                    return plugin_timer.trigger
+            return None
+
+        return resolve
+
+    async def _load_data(self) -> Dict[str, Any]:
+        """
+        Data is loaded when the actual plugin is imported
+        :return:
+        """
+
+        return {}
+
+    def _load_state(self):
+        """
+        The state is loaded when the actual plugin is imported
+        :return:
+        """
+
+        return
+
+    def _save_state(self) -> bool:
+        """
+        The placeholder never writes the plugin's state, this is left to the actual plugin
+        :return:
+        """
+
+        return True
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from io import BytesIO
+
+from nio import AsyncClient, UploadResponse, UploadError
+
+from core.single_flight import SingleFlight
+from core.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCache:
+    def __init__(self, max_entries: int = 1000):
+        """
+        Bounded cache of the mxc:// uris of media uploaded by the bot, keyed by a hash of the uploaded content.
+        Identical media is only uploaded once and referenced by its uri afterwards, also if it is uploaded concurrently, e.g. to
+        several rooms at once. Entries are persisted to the bot's storage, the least recently used entries are evicted.
+        :param max_entries: number of uploads to keep
+        """
+
+        self.max_entries: int = max_entries
+        self.store: Storage or None = None
+        self.uris: OrderedDict[str, str] = OrderedDict()
+        self.in_flight: SingleFlight = SingleFlight("media_upload")
+
+    def configure(self, store: Storage or None, max_entries: int) -> None:
+        """
+        Set the storage entries are persisted to and the number of entries to keep
+        :param store: the bot's storage, None to only keep entries in memory
+        :param max_entries: number of uploads to keep
+        :return:
+        """
+
+        self.store = store
+        self.max_entries = max_entries
+        self.uris = OrderedDict()
+
+    async def upload(self, client: AsyncClient, data: bytes, mime_type: str, filename: str) -> str or None:
+        """
+        Upload media, unless the same content has been uploaded before
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param data: the content to upload
+        :param mime_type: the mimetype of the content
+        :param filename: the filename sent along with the upload
+        :return:    the mxc:// uri of the uploaded content
+                    None, if the upload failed
+        """
+
+        content_hash: str = hashlib.sha256(mime_type.encode() + b"\0" + data).hexdigest()
+        content_uri: str or None = self.get(content_hash)
+        if content_uri is not None:
+            logger.debug(f"Reusing uploaded media {content_uri}")
+            # store again to mark the entry as recently used
+            self.put(content_hash, content_uri)
+            return content_uri
+
+        # concurrent uploads of the same content share a single upload
+        return await self.in_flight.do(content_hash, self.__upload, client, data, mime_type, filename, content_hash)
+
+    async def __upload(self, client: AsyncClient, data: bytes, mime_type: str, filename: str, content_hash: str) -> str or None:
+        """
+        Upload media and remember its uri
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param data: the content to upload
+        :param mime_type: the mimetype of the content
+        :param filename: the filename sent along with the upload
+        :param content_hash: hash of the content
+        :return:    the mxc:// uri of the uploaded content
+                    None, if the upload failed
+        """
+
+        response: UploadResponse or UploadError
+        response, maybe_keys = await client.upload(BytesIO(data), content_type=mime_type, filename=filename, filesize=len(data))
+        if isinstance(response, UploadResponse):
+            self.put(content_hash, response.content_uri)
+            return response.content_uri
+        else:
+            logger.warning(f"Failed to upload {filename}: {response}")
+            return None
+
+    def get(self, content_hash: str) -> str or None:
+        """
+        Get the uri of previously uploaded content
+        :param content_hash: hash of the content
+        :return:    the mxc:// uri of the content
+                    None, if the content is not cached
+        """
+
+        content_uri: str or None = self.uris.get(content_hash)
+        if content_uri is None and self.store is not None:
+            try:
+                content_uri = self.store.get_media_uri(content_hash)
+            except Exception as err:
+                logger.warning(f"Could not read media {content_hash} from storage: {err}")
+
+        return content_uri
+
+    def put(self, content_hash: str, content_uri: str) -> None:
+        """
+        Store the uri of uploaded content
+        :param content_hash: hash of the content
+        :param content_uri: the mxc:// uri of the content
+        :return:
+        """
+
+        if self.max_entries <= 0:
+            return
+
+        self.uris[content_hash] = content_uri
+        self.uris.move_to_end(content_hash)
+        while len(self.uris) > self.max_entries:
+            self.uris.popitem(last=False)
+
+        if self.store is not None:
+            try:
+                self.store.save_media_uri(content_hash, content_uri, self.max_entries)
+            except Exception as err:
+                logger.warning(f"Could not persist media {content_hash}: {err}")
+
+
+media_cache: MediaCache = MediaCache()
+"""Media uploaded by the bot"""
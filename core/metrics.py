@@ -0,0 +1,205 @@
+import bisect
+import logging
+from typing import Dict, List, Tuple, Callable
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+default_buckets: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = default_buckets):
+        """
+        A latency histogram with fixed buckets, using constant memory regardless of the number of observations
+        :param buckets: upper bounds of the buckets in seconds, an additional bucket for all larger values is added automatically
+        """
+
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.count: int = 0
+        self.errors: int = 0
+        self.sum: float = 0.0
+        self.max: float = 0.0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        """
+        Record a single observation
+        :param seconds: duration of the observed execution
+        :param error: True, if the execution raised an error
+        :return:
+        """
+
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def percentile(self, percentile: float) -> float:
+        """
+        Estimate a percentile by linear interpolation within the matching bucket
+        :param percentile: the percentile to estimate, 0..1
+        :return: estimated duration in seconds
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank: float = percentile * self.count
+        cumulative: int = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower: float = self.buckets[index - 1] if index > 0 else 0.0
+                upper: float = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / bucket_count, self.max)
+            cumulative += bucket_count
+
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Collects execution times of commands, hooks, timers and sent events as well as additional counters and gauges
+        """
+
+        self.histograms: Dict[str, Dict[str, Histogram]] = {}
+        """Histograms by kind (e.g. "command", "hook") and name"""
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False) -> None:
+        """
+        Record the execution time of a command, hook, timer or similar
+        :param kind: kind of the execution, e.g. "command", "hook", "timer", "send"
+        :param name: name of the command, hook, ...
+        :param seconds: duration of the execution
+        :param error: True, if the execution failed
+        :return:
+        """
+
+        kind_histograms: Dict[str, Histogram] = self.histograms.setdefault(kind, {})
+        if name not in kind_histograms:
+            kind_histograms[name] = Histogram()
+        kind_histograms[name].observe(seconds, error=error)
+
+    def increment(self, counter: str, name: str, value: int = 1) -> None:
+        """
+        Increment a counter
+        :param counter: name of the counter, e.g. "send_retries"
+        :param name: label of the counter, e.g. the event type
+        :param value: value to add
+        :return:
+        """
+
+        counters: Dict[str, int] = self.counters.setdefault(counter, {})
+        counters[name] = counters.get(name, 0) + value
+
+    def add_gauge(self, name: str, method: Callable[[], float]) -> None:
+        """
+        Register a gauge, which is read whenever the metrics are rendered
+        :param name: name of the gauge
+        :param method: returns the current value of the gauge
+        :return:
+        """
+
+        self.gauges[name] = method
+
+    def render_summary(self) -> str:
+        """
+        Render all histograms as markdown
+        :return: markdown summary of count, errors and p50/p95/p99 for each histogram
+        """
+
+        summary: str = ""
+        for kind, kind_histograms in sorted(self.histograms.items()):
+            summary += f"**{kind}**  \n"
+            name: str
+            histogram: Histogram
+            for name, histogram in sorted(kind_histograms.items(), key=lambda item: item[1].sum, reverse=True):
+                summary += (
+                    f"`{name}`: {histogram.count} calls, {histogram.errors} errors, "
+                    f"p50 {histogram.percentile(0.5) * 1000:.0f}ms, p95 {histogram.percentile(0.95) * 1000:.0f}ms, "
+                    f"p99 {histogram.percentile(0.99) * 1000:.0f}ms, max {histogram.max * 1000:.0f}ms  \n"
+                )
+            summary += "\n"
+
+        for counter, counters in sorted(self.counters.items()):
+            summary += f"**{counter}**: " + ", ".join(f"`{name}`: {value}" for name, value in sorted(counters.items())) + "  \n"
+
+        for name, method in sorted(self.gauges.items()):
+            summary += f"**{name}**: {method()}  \n"
+
+        return summary or "No metrics recorded yet."
+
+    def render_prometheus(self) -> str:
+        """
+        Render all metrics in Prometheus text exposition format
+        :return: metrics as text
+        """
+
+        lines: List[str] = []
+        for kind, kind_histograms in sorted(self.histograms.items()):
+            metric: str = f"niosmith_{kind}_duration_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in sorted(kind_histograms.items()):
+                label: str = escape_label(name)
+                cumulative: int = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{name="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{name="{label}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{name="{label}"}} {histogram.count}')
+
+            lines.append(f"# TYPE niosmith_{kind}_errors_total counter")
+            for name, histogram in sorted(kind_histograms.items()):
+                lines.append(f'niosmith_{kind}_errors_total{{name="{escape_label(name)}"}} {histogram.errors}')
+
+        for counter, counters in sorted(self.counters.items()):
+            lines.append(f"# TYPE niosmith_{counter}_total counter")
+            for name, value in sorted(counters.items()):
+                lines.append(f'niosmith_{counter}_total{{name="{escape_label(name)}"}} {value}')
+
+        for name, method in sorted(self.gauges.items()):
+            lines.append(f"# TYPE niosmith_{name} gauge")
+            lines.append(f"niosmith_{name} {method()}")
+
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value: str) -> str:
+    """
+    Escape a label value for the Prometheus text format
+    :param value:
+    :return:
+    """
+
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+async def start_metrics_server(host: str, port: int):
+    """
+    Serve the collected metrics in Prometheus text format on http://<host>:<port>/metrics
+    :param host: address to bind to, should usually be a local address
+    :param port: port to listen on
+    :return: the aiohttp AppRunner serving the metrics
+    """
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+metrics: Metrics = Metrics()
+"""Metrics collected by the whole bot"""
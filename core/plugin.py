@@ -1,19 +1,25 @@
-import io
 import os.path
 from os import remove, path
 import pickle
-from typing import List, Any, Dict, Callable, Union, Hashable, Tuple
+from typing import List, Any, Dict, Callable, Union, Hashable, Tuple, Set
 import datetime
+from collections import OrderedDict
 
-import requests
+import aiohttp
 import yaml
 from core.chat_functions import (
     send_text_to_room,
     send_reaction,
     send_replace,
     send_image,
+    render_markdown,
+    strip_tags,
+    sniff_image_type,
+    decode_image,
 )
-from asyncio import sleep
+import asyncio
+from asyncio import sleep, wrap_future
+from concurrent.futures import Future
 import logging
 from nio import (
     AsyncClient,
@@ -24,14 +30,28 @@ from nio import (
     MatrixRoom,
 )
 from core.timer import Timer
+from core.http_client import HttpClient, HttpResponse, http
+from core.single_flight import SingleFlight
+from core.read_only import read_only
+from core.storage import Storage, snapshot, write_file_later, write_json_later
+from core.registry import PluginRegistry
 from fuzzywuzzy import fuzz
 import copy
 import jsonpickle
-import commonmark
 from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+max_image_fetch_size: int = 20 * 1024 * 1024
+"""Size in bytes above which fetching an image is aborted"""
+image_fetch_timeout: float = 30
+"""Time in seconds fetching an image may take"""
+thumbnail_cache_size: int = 64
+"""Number of thumbnails fetched by Plugin.fetch_thumbnail_from_url kept in memory"""
+data_write_delay: float = 2.0
+"""Time in seconds changes of plugin data are collected before they are written"""
+thumbnail_cache: OrderedDict[Tuple[str, Tuple[int, int]], Image.Image] = OrderedDict()
+
 
 class Plugin:
     def __init__(self, name: str, category: str, description: str):
@@ -48,6 +68,11 @@ class Plugin:
         self.timers: List[Timer] = []
         self.rooms: List[str] = []
         self.client: AsyncClient or None = None
+        self.registry: PluginRegistry or None = None
+        self.store: Storage or None = None
+        self.http: HttpClient = http
+        """Shared http client, use instead of blocking libraries like requests"""
+        self.__in_flight: SingleFlight = SingleFlight(name)
         if path.isdir(f"plugins/{self.name}"):
             self.is_directory_based: bool = True
             self.basepath: str = f"plugins/{self.name}/{self.name}"
@@ -61,6 +86,9 @@ class Plugin:
         self.config_items_filename: str = f"{self.basepath}.yaml"
 
         self.plugin_data: Dict[str, Any] = {}
+        self.__dirty_data: Set[str] = set()
+        """Names of plugin_data modified since it has last been written"""
+        self.__flush_task: asyncio.Task or None = None
         self.config_items: Dict[str, Any] = {}
         self.configuration: Union[Dict[Hashable, Any], list, None] = self.__load_config()
         logger.debug(f"{self.name}: Configuration loaded from file: {self.configuration}")
@@ -115,6 +143,8 @@ class Plugin:
         if command not in self.commands.keys():
             self.commands[command] = plugin_command
             self.help_texts[command] = help_text
+            if self.registry:
+                self.registry.add_command(plugin_command)
             # Add rooms from command to the rooms the plugin is valid for
             if room_id:
                 for room in room_id:
@@ -138,7 +168,9 @@ class Plugin:
         command: str
         if command in self.commands.keys():
             if self.commands.get(command).command_type == "dynamic":
-                del self.commands[command]
+                plugin_command: PluginCommand = self.commands.pop(command)
+                if self.registry:
+                    self.registry.del_command(plugin_command)
                 self._save_state()
                 return True
             else:
@@ -179,14 +211,13 @@ class Plugin:
         if not self.has_hook(event_type, method, room_id_list=room_id_list):
             # a hook doesn't already exist for the same event_type, method and room_id_list
 
+            hook: PluginHook
             if event_type not in self.hooks.keys():
                 # no hooks for event_type, add an event_type and hook
-                self.hooks[event_type] = [
-                    PluginHook(event_type, method, room_id_list=copy.deepcopy(room_id_list), event_ids=copy.deepcopy(event_ids), hook_type=hook_type)
-                ]
+                hook = PluginHook(event_type, method, room_id_list=copy.deepcopy(room_id_list), event_ids=copy.deepcopy(event_ids), hook_type=hook_type)
+                self.hooks[event_type] = [hook]
 
             else:
-                hook: PluginHook
                 for hook in self.hooks[event_type]:
                     if hook.method == method:
                         # hook exists for same event_type and method, adjust rooms if required
@@ -195,16 +226,17 @@ class Plugin:
                         break
                 else:
                     # no hook for the given method, append a new hook
-                    self.hooks[event_type].append(
-                        PluginHook(
-                            event_type,
-                            method,
-                            room_id_list=room_id_list,
-                            event_ids=event_ids,
-                            hook_type=hook_type,
-                        )
+                    hook = PluginHook(
+                        event_type,
+                        method,
+                        room_id_list=room_id_list,
+                        event_ids=event_ids,
+                        hook_type=hook_type,
                     )
+                    self.hooks[event_type].append(hook)
 
+            if self.registry:
+                self.registry.add_hook(hook)
             if hook_type == "dynamic":
                 self._save_state()
             logger.debug(f"Added hook for event {event_type}, method {method} to rooms {room_id_list}")
@@ -236,6 +268,8 @@ class Plugin:
                         if not room_id_list or all(elem in room_id_list for elem in hook.room_id_list):
                             # completely remove the hook as no rooms have been supplied or all room_ids of the hook are to be removed
                             self.hooks[event_type].remove(hook)
+                            if self.registry:
+                                self.registry.del_hook(hook, removed=True)
                             hook_removed = True
                         else:
                             if not hook.room_id_list:
@@ -246,6 +280,8 @@ class Plugin:
                                 for room_id in room_id_list:
                                     if room_id in hook.room_id_list:
                                         hook.room_id_list.remove(room_id)
+                                if self.registry:
+                                    self.registry.del_hook(hook, removed=False)
 
                                 hook_removed = True
 
@@ -319,6 +355,8 @@ class Plugin:
                 timer_type=timer_type,
             )
         )
+        if self.registry:
+            self.registry.invalidate_timers()
         if timer_type == "dynamic":
             self._save_state()
 
@@ -354,6 +392,8 @@ class Plugin:
             if timer.method == method:
                 if timer.timer_type == "dynamic":
                     self._get_timers().remove(timer)
+                    if self.registry:
+                        self.registry.invalidate_timers()
                     self._save_state()
                     return True
                 else:
@@ -363,18 +403,18 @@ class Plugin:
 
     async def store_data(self, name: str, data: Any) -> bool:
         """
-        Store data in plugins/<pluginname>.dill
+        Store data in the bot's database. The data is written after data_write_delay, collecting further changes in the meantime, and
+        on shutdown.
         :param name: Name of the data to store, used as a reference to retrieve it later
         :param data: data to be stored
-        :return:    True, if data was successfully stored
-                    False, if data could not be stored
+        :return:    True, if data has been stored
         """
 
-        if data != self.plugin_data.get(name):
+        # the stored object itself may have been modified in place
+        if (name in self.plugin_data and data is self.plugin_data[name]) or data != self.plugin_data.get(name):
             self.plugin_data[name] = data
-            return await self.__save_data_to_file()
-        else:
-            return True
+            self.__mark_dirty(name)
+        return True
 
     async def read_data(self, name: str) -> Any:
         """
@@ -388,20 +428,79 @@ class Plugin:
         else:
             return None
 
+    async def view_data(self, name: str) -> Any:
+        """
+        Read data from self.plugin_data without copying it, e.g. to look up values in large data.
+        dicts, lists and sets are returned as read-only views, objects as views preventing attribute assignment. Use read_data to get a copy
+        that may be modified and stored again.
+        :param name: Name of the data to be retrieved
+        :return: a read-only view of the previously stored data
+        """
+
+        if name in self.plugin_data:
+            return read_only(self.plugin_data[name])
+        else:
+            return None
+
     async def clear_data(self, name: str) -> bool:
         """
         Clear a specific field in self.plugin_data
         :param name: name of the field to be cleared
         :return:    True, if successfully cleared
-                    False, if name not contained in self.plugin_data or data could not be saved to disk
+                    False, if name not contained in self.plugin_data
         """
 
         if name in self.plugin_data:
             del self.plugin_data[name]
-            return await self.__save_data_to_file()
+            self.__mark_dirty(name)
+            return True
         else:
             return False
 
+    def __mark_dirty(self, name: str) -> None:
+        """
+        Mark plugin_data as modified and schedule writing it
+        :param name: Name of the modified data
+        :return:
+        """
+
+        self.__dirty_data.add(name)
+        if self.__flush_task is None or self.__flush_task.done():
+            self.__flush_task = asyncio.create_task(self.__flush_data_later(), name=f"flush-{self.name}")
+
+    async def __flush_data_later(self) -> None:
+        await asyncio.sleep(data_write_delay)
+        await self._flush_data()
+
+    async def _flush_data(self) -> bool:
+        """
+        Write all modified plugin_data, called after data_write_delay and on shutdown
+        :return:    True, if all data has been written
+                    False, otherwise
+        """
+
+        if self.store is None:
+            # all data is kept in a single file, write it once for all modified keys
+            names: Set[str] = set(self.__dirty_data)
+            self.__dirty_data.clear()
+            if await self.__save_data_to_file():
+                return True
+            self.__dirty_data |= names
+            return False
+
+        # data modified while being written is marked again by store_data and written once more
+        failed: Set[str] = set()
+        while self.__dirty_data:
+            name: str = self.__dirty_data.pop()
+            if not await self.__save_data(name):
+                failed.add(name)
+
+        if failed:
+            # retried with the next change or on shutdown
+            self.__dirty_data |= failed
+            return False
+        return True
+
     async def backup_data(self) -> bool:
         """
         Create a backup file of the data currently stored by the plugin. This is not executed automatically and needs to be called by the plugin,
@@ -449,6 +548,53 @@ class Plugin:
 
         return data
 
+    async def _load_data(self) -> Dict[str, Any]:
+        """
+        Load plugin_data from the bot's storage, migrating data from the plugin's data files once
+        :return: Data to be loaded into self.plugin_data
+        """
+
+        if self.store is None:
+            return await self._load_data_from_file()
+
+        try:
+            plugin_data: Dict[str, Any] = self.store.get_plugin_data(self.name)
+        except Exception as err:
+            logger.critical(f"Could not load plugin_data for {self.name}: {err}")
+            return {}
+
+        if plugin_data == {}:
+            plugin_data = await self._load_data_from_file()
+            if plugin_data != {}:
+                logger.warning(f"Migrating data for {self.name} to the database. This should only happen once.")
+                try:
+                    for name, data in plugin_data.items():
+                        await self.store.save_plugin_data(self.name, name, data)
+                except Exception as err:
+                    logger.critical(f"Could not migrate plugin_data for {self.name}, keeping data files: {err}")
+                    return plugin_data
+                self.__retire_data_files()
+
+        return plugin_data
+
+    def __retire_data_files(self) -> None:
+        """
+        Rename the plugin's data files after their data has been migrated to the bot's storage, so they are not migrated again
+        :return:
+        """
+
+        data_files: List[str] = [self.plugin_dataj_filename, self.plugin_data_filename]
+        if self.is_directory_based:
+            data_files.append(f"plugins/{self.name}.json")
+
+        for data_file in data_files:
+            if os.path.isfile(data_file):
+                try:
+                    os.rename(data_file, f"{data_file}.migrated")
+                    logger.warning(f"Data of {self.name} has been migrated to the database, {data_file} has been renamed to {data_file}.migrated")
+                except OSError as err:
+                    logger.critical(f"Could not rename {data_file}: {err}")
+
     async def _load_data_from_file(self) -> Dict[str, Any]:
         """
         Load plugin_data from file
@@ -529,13 +675,29 @@ class Plugin:
         """
 
         try:
-            json_data = jsonpickle.encode(data)
-            file = open(filename, "w")
-            file.write(json_data)
-            file.close()
+            # plugin_data may be modified while it is encoded by the file writer
+            await wrap_future(write_json_later(filename, {name: snapshot(value) for name, value in data.items()}))
             return True
         except Exception as err:
-            logger.critical(f"Could not write plugin_data to {self.plugin_data_filename}: {err}")
+            logger.critical(f"Could not write plugin_data to {filename}: {err}")
+            return False
+
+    async def __save_data(self, name: str) -> bool:
+        """
+        Save modified or cleared plugin_data to the bot's storage
+        :param name: Name of the modified data
+        :return:    True, if data stored successfully
+                    False, otherwise
+        """
+
+        try:
+            if name in self.plugin_data:
+                await self.store.save_plugin_data(self.name, name, self.plugin_data[name])
+            else:
+                await self.store.delete_plugin_data(self.name, name)
+            return True
+        except Exception as err:
+            logger.critical(f"Could not write plugin_data {name} of {self.name} to the database: {err}")
             return False
 
     async def __save_data_to_file(self) -> bool:
@@ -568,7 +730,7 @@ class Plugin:
                     logger.critical(f"Could not remove file {self.plugin_dataj_filename}: {err}")
                     return False
 
-    async def __expandable_message_body(self, header: str, body: str) -> str:
+    async def __expandable_message_body(self, header: str, body: str) -> Tuple[str, str]:
         """
         Generate HTML-code for an expandable message body, used e.g. by
         - send_expandable_message
@@ -577,12 +739,12 @@ class Plugin:
         - respond_expandable_notice
         :param header: the part of the message that is always displayed
         :param body: the part of the message that is only displayed after expanding it
-        :return: expandable message
+        :return: tuple of the plain-text body and the HTML-formatted expandable message
         """
 
-        markdown_header: str = commonmark.commonmark(header)
-        markdown_body: str = commonmark.commonmark(body)
-        return f"<details><summary>{markdown_header}</summary><br>{markdown_body}</details>"
+        plain_header, markdown_header = render_markdown(header)
+        plain_body, markdown_body = render_markdown(body)
+        return f"{plain_header}\n\n{plain_body}", f"<details><summary>{markdown_header}</summary><br>{markdown_body}</details>"
 
     async def send_message(
         self,
@@ -612,9 +774,12 @@ class Plugin:
             await sleep(float(delay / 1000))
             await client.room_typing(room_id, typing_state=False)
 
+        formatted_message: str or None = None
         if expanded_message:
-            message = await self.__expandable_message_body(message, expanded_message)
-        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(client, room_id, message, notice=False, markdown_convert=markdown_convert)
+            message, formatted_message = await self.__expandable_message_body(message, expanded_message)
+        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(
+            client, room_id, message, notice=False, markdown_convert=markdown_convert, formatted_message=formatted_message
+        )
 
         if isinstance(event_response, RoomSendResponse):
             return event_response.event_id
@@ -681,9 +846,12 @@ class Plugin:
         :return: the event_id of the sent message or None in case of an error
         """
 
+        formatted_message: str or None = None
         if expanded_message:
-            message = await self.__expandable_message_body(message, expanded_message)
-        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(client, room_id, message, notice=True, markdown_convert=markdown_convert)
+            message, formatted_message = await self.__expandable_message_body(message, expanded_message)
+        event_response: RoomSendResponse or RoomSendError = await send_text_to_room(
+            client, room_id, message, notice=True, markdown_convert=markdown_convert, formatted_message=formatted_message
+        )
 
         if isinstance(event_response, RoomSendResponse):
             return event_response.event_id
@@ -748,9 +916,78 @@ class Plugin:
                     None, if the event has not been edited
         """
 
+        formatted_message: str or None = None
         if expanded_message:
-            message = await self.__expandable_message_body(message, expanded_message)
-        return await send_replace(client, room_id, event_id, message, message_type="m.notice")
+            message, formatted_message = await self.__expandable_message_body(message, expanded_message)
+        return await send_replace(client, room_id, event_id, message, message_type="m.notice", formatted_message=formatted_message)
+
+    async def __broadcast(
+        self, client: AsyncClient, room_ids: List[str], message: str, expanded_message: str, markdown_convert: bool, notice: bool
+    ) -> Dict[str, str or None]:
+        """
+        Send the same message or notice to multiple rooms. The message is rendered once and all sends are queued at once, to be sent as fast as
+        the rate-limits allow
+        :param client: AsyncClient used to send the message
+        :param room_ids: rooms to send the message to
+        :param message: the actual message
+        :param expanded_message: an optional part of the message only visible after expanding the message
+        :param markdown_convert: whether the message should be converted from markdown
+        :param notice: whether to send a notice instead of a message
+        :return: dict of the event_id of the sent message by room_id, None for rooms the message could not be sent to
+        """
+
+        body: str
+        formatted_message: str
+        if expanded_message:
+            body, formatted_message = await self.__expandable_message_body(message, expanded_message)
+        elif markdown_convert:
+            body, formatted_message = render_markdown(message)
+        else:
+            body, formatted_message = strip_tags(message), message
+
+        room_ids = list(dict.fromkeys(room_ids))
+        responses: List[RoomSendResponse or RoomSendError or None] = await asyncio.gather(
+            *[send_text_to_room(client, room_id, body, notice=notice, formatted_message=formatted_message) for room_id in room_ids]
+        )
+
+        event_ids: Dict[str, str or None] = {}
+        for room_id, event_response in zip(room_ids, responses):
+            if isinstance(event_response, RoomSendResponse):
+                event_ids[room_id] = event_response.event_id
+            else:
+                logger.warning(f"Error sending {body} to {room_id}: {event_response}")
+                event_ids[room_id] = None
+        return event_ids
+
+    async def broadcast_message(
+        self, client: AsyncClient, room_ids: List[str], message: str, expanded_message: str = "", markdown_convert: bool = True
+    ) -> Dict[str, str or None]:
+        """
+        Send the same message to multiple rooms at once
+        :param client: AsyncClient used to send the message
+        :param room_ids: rooms to send the message to
+        :param message: the actual message
+        :param expanded_message: an optional part of the message only visible after expanding the message (at least on Element Web)
+        :param markdown_convert: optional flag if content should be converted to markdown, defaults to True
+        :return: dict of the event_id of the sent message by room_id, None for rooms the message could not be sent to
+        """
+
+        return await self.__broadcast(client, room_ids, message, expanded_message, markdown_convert, notice=False)
+
+    async def broadcast_notice(
+        self, client: AsyncClient, room_ids: List[str], message: str, expanded_message: str = "", markdown_convert: bool = True
+    ) -> Dict[str, str or None]:
+        """
+        Send the same notice to multiple rooms at once
+        :param client: AsyncClient used to send the notice
+        :param room_ids: rooms to send the notice to
+        :param message: the actual message
+        :param expanded_message: an optional part of the message only visible after expanding the message (at least on Element Web)
+        :param markdown_convert: optional flag if content should be converted to markdown, defaults to True
+        :return: dict of the event_id of the sent notice by room_id, None for rooms the notice could not be sent to
+        """
+
+        return await self.__broadcast(client, room_ids, message, expanded_message, markdown_convert, notice=True)
 
     async def send_reaction(self, client, room_id: str, event_id: str, reaction: str):
         """
@@ -790,9 +1027,10 @@ class Plugin:
                     None, if the event has not been edited
         """
 
+        formatted_message: str or None = None
         if expanded_message:
-            message = await self.__expandable_message_body(message, expanded_message)
-        return await send_replace(client, room_id, event_id, message, message_type="m.text")
+            message, formatted_message = await self.__expandable_message_body(message, expanded_message)
+        return await send_replace(client, room_id, event_id, message, message_type="m.text", formatted_message=formatted_message)
 
     async def replace(self, client: AsyncClient, room_id: str, event_id: str, message: str) -> str or None:
         """
@@ -827,17 +1065,18 @@ class Plugin:
         logger.warning(f"Deprecated function 'message_delete' used - use 'redact_message' instead")
         await self.redact_message(client, room_id, event_id, reason)
 
-    async def send_image(self, client: AsyncClient, room_id: str, image: Image):
+    async def send_image(self, client: AsyncClient, room_id: str, image: Image or bytes, mime_type: str or None = None):
         """
         Posts an image to the given room
         :param client:
         :param room_id:
-        :param image:
+        :param image: the image, either as PIL Image or as encoded image data (e.g. from fetch_image_data_from_url), which is sent unchanged if possible
+        :param mime_type: optional mimetype of encoded image data, detected from the data if not given
         :return:
         """
 
         if image is not None:
-            event_response: RoomSendResponse or RoomSendError = await send_image(client, room_id, image)
+            event_response: RoomSendResponse or RoomSendError = await send_image(client, room_id, image, mime_type=mime_type)
 
             if isinstance(event_response, RoomSendResponse):
                 return event_response.event_id
@@ -1060,8 +1299,10 @@ class Plugin:
 
     def _save_state(self) -> bool:
         """
-        Save dynamic commands, dynamic hooks and all timers to state file
-        :return:
+        Save dynamic commands, dynamic hooks and all timers to state file.
+        When called from the event loop, the file is written in the background and the registry is notified once it has been written
+        :return:    True, if the state has been saved or is being saved
+                    False, otherwise
         """
 
         dynamic_commands: Dict[str, PluginCommand] = {}
@@ -1091,24 +1332,44 @@ class Plugin:
         if plugin_state != ({}, {}, []):
             # we have an actual state to save
             try:
-                json_data = jsonpickle.encode(plugin_state)
-                file = open(self.plugin_state_filename, "w")
-                file.write(json_data)
-                file.close()
-                return True
+                future: Future = write_file_later(self.plugin_state_filename, jsonpickle.encode(plugin_state))
             except Exception as err:
-                logger.critical(f"Could not write plugin_state to {self.plugin_state_filename}: {err}")
+                logger.critical(f"Could not encode plugin_state of {self.name}: {err}")
                 return False
+
+            try:
+                loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+            except RuntimeError:
+                # not called from the event loop, e.g. while plugins are loaded, waiting for the write doesn't block anything
+                self.__state_written(future)
+                return future.exception() is None
+
+            future.add_done_callback(lambda written: loop.call_soon_threadsafe(self.__state_written, written))
+            return True
         else:
             # state is empty, remove file if it exists
             if os.path.isfile(self.plugin_state_filename):
                 try:
                     remove(self.plugin_state_filename)
+                    if self.registry:
+                        self.registry.state_saved(self)
                     return True
                 except Exception as err:
                     logger.critical(f"Could not remove file {self.plugin_state_filename}: {err}")
                     return False
 
+    def __state_written(self, future: Future) -> None:
+        """
+        Notify the registry about the written state file, or log the error writing it
+        :param future: the write of the state file
+        :return:
+        """
+
+        if future.exception() is not None:
+            logger.critical(f"Could not write plugin_state to {self.plugin_state_filename}: {future.exception()}")
+        elif self.registry:
+            self.registry.state_saved(self)
+
     def _load_state(self):
         """
         Load dynamic commands, dynamic hooks and all timers from state file
@@ -1130,6 +1391,9 @@ class Plugin:
 
         # add dynamic commands
         self.commands.update(dynamic_commands)
+        if self.registry:
+            for plugin_command in dynamic_commands.values():
+                self.registry.add_command(plugin_command)
 
         # add dynamic hooks
         event: str
@@ -1139,6 +1403,8 @@ class Plugin:
                 self._get_hooks()[event] += hooks_list
             else:
                 self.hooks[event] = hooks_list
+        if self.registry:
+            self.registry.invalidate_hooks()
 
         # add last execution for static timers and all dynamic timers
         state_timer: Timer
@@ -1155,6 +1421,63 @@ class Plugin:
                 if state_timer.timer_type == "dynamic":
                     self.timers.append(state_timer)
 
+        if self.registry:
+            self.registry.invalidate_timers()
+
+    async def coalesce(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """
+        Call a coroutine function, unless a call with the same key is already running. Concurrent callers share the result of the running call,
+        e.g. to only look up data once if the same command is run in several rooms at the same time.
+        :param key: identifies calls returning the same result, e.g. ("price", coin)
+        :param func: coroutine function to call
+        :param args: positional arguments passed to func
+        :param kwargs: keyword arguments passed to func
+        :return: the result of the call, shared by all concurrent callers
+        """
+
+        return await self.__in_flight.do(key, func, *args, **kwargs)
+
+    async def __fetch_image_data(self, url: str) -> Tuple[bytes, str] or None:
+        """
+        Fetch encoded image data, aborting the download if it exceeds max_image_fetch_size or takes longer than image_fetch_timeout
+        :param url: a url to an image
+        :return:    tuple of the encoded image data and its mimetype if successfully retrieved,
+                    None otherwise
+        """
+
+        try:
+            response: HttpResponse = await self.http.get(url, max_size=max_image_fetch_size, timeout=image_fetch_timeout)
+            response.raise_for_status()
+        except aiohttp.ClientError as err:
+            logger.warning(f"Could not fetch image {url}: {err}")
+            return None
+
+        # trust the image's signature over the server's content-type, fall back to the content-type for other formats
+        mime_type: str or None = sniff_image_type(response.content)
+        if mime_type is None:
+            mime_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+            if not mime_type.startswith("image/"):
+                logger.warning(f"Could not fetch image {url}: unexpected content-type {mime_type or 'unknown'}")
+                return None
+
+        return response.content, mime_type
+
+    async def __decode_image(self, url: str, data: bytes, max_size: Tuple[int, int] or None) -> Image.Image or None:
+        """
+        Decode an image in a worker thread
+        :param url: the url the image has been fetched from
+        :param data: the encoded image data
+        :param max_size: maximum width and height of the decoded image, None to decode it in its original size
+        :return:    the decoded image if successful,
+                    None otherwise
+        """
+
+        try:
+            return await asyncio.to_thread(decode_image, data, max_size)
+        except (OSError, ValueError, Image.DecompressionBombError) as err:
+            logger.warning(f"Could not decode image {url}: {err}")
+            return None
+
     async def fetch_image_from_url(self, url: str) -> Image or None:
         """
         Try to get an image from the given url
@@ -1163,12 +1486,48 @@ class Plugin:
                     None otherwise
         """
 
-        try:
-            response = requests.get(url)
-            image_bytes = io.BytesIO(response.content)
-            return Image.open(image_bytes)
-        except:
+        fetched: Tuple[bytes, str] or None = await self.__fetch_image_data(url)
+        if fetched is None:
+            return None
+        return await self.__decode_image(url, fetched[0], None)
+
+    async def fetch_image_data_from_url(self, url: str) -> Tuple[bytes, str or None] or None:
+        """
+        Try to get an image from the given url without decoding it, e.g. to send it unchanged by send_image
+        :param url: a url to an image
+        :return:    tuple of the encoded image data and its mimetype if successfully retrieved,
+                    None otherwise
+        """
+
+        return await self.__fetch_image_data(url)
+
+    async def fetch_thumbnail_from_url(self, url: str, max_size: Tuple[int, int] = (320, 320)) -> Image or None:
+        """
+        Try to get a downscaled image from the given url. Recently fetched thumbnails are kept in memory.
+        :param url: a url to an image
+        :param max_size: maximum width and height of the thumbnail
+        :return:    Image-Object if successfully retrieved, which may be modified by the caller
+                    None otherwise
+        """
+
+        key: Tuple[str, Tuple[int, int]] = (url, tuple(max_size))
+        thumbnail: Image.Image or None = thumbnail_cache.get(key)
+        if thumbnail is None:
+            thumbnail = await self.coalesce(("thumbnail", key), self.__fetch_thumbnail, url, key[1])
+            if thumbnail is None:
+                return None
+        thumbnail_cache[key] = thumbnail
+        thumbnail_cache.move_to_end(key)
+        while len(thumbnail_cache) > thumbnail_cache_size:
+            thumbnail_cache.popitem(last=False)
+
+        return thumbnail.copy()
+
+    async def __fetch_thumbnail(self, url: str, max_size: Tuple[int, int]) -> Image.Image or None:
+        fetched: Tuple[bytes, str] or None = await self.__fetch_image_data(url)
+        if fetched is None:
             return None
+        return await self.__decode_image(url, fetched[0], max_size)
 
     async def get_rooms_for_server(self, client: AsyncClient, server_name: str) -> List[str]:
         """
@@ -1241,6 +1600,23 @@ class Plugin:
 
         return home_server_users
 
+    def _set_registry(self, registry: PluginRegistry) -> None:
+        """
+        Attach the plugin to the loader's registry, which is kept up to date on changes of commands from now on
+        :param registry:
+        :return:
+        """
+        self.registry = registry
+        registry.attach_plugin(self)
+
+    def _set_store(self, store: Storage) -> None:
+        """
+        Set the bot's storage, used for the plugin's data
+        :param store:
+        :return:
+        """
+        self.store = store
+
     def _set_client(self, client) -> None:
         """
         Set the bot's client instance
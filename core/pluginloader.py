@@ -1,36 +1,51 @@
-import copy
+import asyncio
 
 from nio import UnknownEvent, RoomMessageText, AsyncClient
 
 from core.chat_functions import send_text_to_room
 from core.plugin import Plugin, PluginCommand, PluginHook
-from core.timer import Timer
+from core.lazy_plugin import LazyPlugin, PluginManifest
+from core.registry import PluginRegistry
+from core.command_matcher import CommandMatcher
+from core.timer import Timer, TimerScheduler
 from core.config import Config
+from core.storage import Storage
+from core.metrics import metrics
 from sys import modules
 from re import match
-from time import time
-import operator
-from typing import List, Dict
+from typing import List, Dict, Sequence, Set, FrozenSet
 import glob
 from os.path import basename, isfile, isdir
 import importlib
-from fuzzywuzzy import fuzz
 import logging
 import traceback
+from time import perf_counter
 
 logger = logging.getLogger(__name__)
 
 
 class PluginLoader:
-    def __init__(self, config: Config, client: AsyncClient, plugins_dir: str = "plugins"):
+    def __init__(self, config: Config, client: AsyncClient, store: Storage, plugins_dir: str = "plugins"):
         """
         Handles importing and running plugins
         :param config (Config): Bot configuration parameters
         :param client (AsyncClient): the bot's client instance
+        :param store (Storage): the bot's storage, used for the plugins' data
         :param plugins_dir: (str) Directory containing the plugins
         """
 
         self.config: Config = config
+        self.client: AsyncClient = client
+        self.store: Storage = store
+        self.plugins_dir: str = plugins_dir
+
+        # cached manifest of commands, hooks and timers of all plugins, allowing plugins to be imported on their first use
+        self.manifest: PluginManifest or None = None
+        if self.config.plugins_lazy_loading:
+            self.manifest = PluginManifest(f"{self.config.store_filepath}/plugin_manifest.json")
+        lazy_entries: Dict[str, Dict] = {}
+        self.__import_locks: Dict[str, asyncio.Lock] = {}
+
         # import all plugins
         module_all = glob.glob(f"{plugins_dir}/*")
         module_all.sort()
@@ -44,6 +59,10 @@ class PluginLoader:
 
         for module in module_dirs:
             if self.is_allowed_plugin(module):
+                if self.manifest and (entry := self.manifest.get(module, self.__get_plugin_files(module))):
+                    # plugin hasn't changed since it has last been imported, import it on first use
+                    lazy_entries[module] = entry
+                    continue
                 try:
                     globals()[module] = importlib.import_module(f"plugins.{module}.{module}")
                 except ModuleNotFoundError:
@@ -70,18 +89,40 @@ class PluginLoader:
 
         # get all loaded plugins from sys.modules and make them available as plugin_list
         self.__plugin_list: Dict[str, Plugin] = {}
+        self.__plugin_modules: Dict[str, str] = {}
+        self.registry: PluginRegistry = PluginRegistry()
+        self.registry.on_state_saved = self.__update_manifest
+        self.command_matcher: CommandMatcher = CommandMatcher(self.registry)
+        self.hook_semaphore: asyncio.Semaphore = asyncio.Semaphore(self.config.hooks_max_concurrency)
+        self.timer_scheduler: TimerScheduler or None = None
 
         for key in modules.keys():
             if match(r"^plugins\.\w*(\.\w*)?", key):
                 if hasattr(modules[key], "plugin") and isinstance(modules[key].plugin, Plugin):
                     self.__plugin_list[modules[key].plugin.name] = modules[key].plugin
+                    if key.count(".") == 2:
+                        # directory-based plugins may be loaded lazily
+                        self.__plugin_modules[modules[key].plugin.name] = key.split(".")[1]
+
+        for module, entry in lazy_entries.items():
+            self.__plugin_list[entry["name"]] = LazyPlugin(entry, self.import_plugin)
+            self.__plugin_modules[entry["name"]] = module
 
         for plugin in self.__plugin_list.values():
             """Set the bot's client instance"""
             plugin._set_client(client)
 
+            """Set the storage for the plugin's data"""
+            plugin._set_store(store)
+
+            """Attach the plugin to the central registry"""
+            plugin._set_registry(self.registry)
+
             """Display details about the loaded plugins, this does nothing else"""
-            logger.info(f"Loaded plugin {plugin.name}:")
+            if isinstance(plugin, LazyPlugin):
+                logger.info(f"Registered plugin {plugin.name} (will be imported on first use):")
+            else:
+                logger.info(f"Loaded plugin {plugin.name}:")
             if plugin._get_commands() != {}:
                 logger.info(f"  Commands: {', '.join([*plugin._get_commands().keys()])}")
             if plugin._get_hooks() != {}:
@@ -92,6 +133,59 @@ class PluginLoader:
                     timers.append(f"{timer.name} ({timer.frequency})")
                 logger.info(f"  Timers:   {', '.join(timers)}")
 
+    def __get_plugin_files(self, module: str) -> List[str]:
+        """
+        Get all files the manifest entry of a plugin depends on: its python sources, configuration and state
+        :param module: name of the plugin's module
+        :return: list of filenames
+        """
+
+        sources: List[str] = sorted(glob.glob(f"{self.plugins_dir}/{module}/*.py"))
+        return sources + [f"{self.plugins_dir}/{module}/{module}.yaml", f"{self.plugins_dir}/{module}/{module}_state.json"]
+
+    def __update_manifest(self, plugin: Plugin, save: bool = True) -> None:
+        """
+        Update the manifest entry of an imported plugin
+        :param plugin: the plugin
+        :param save: save the manifest to disk
+        :return:
+        """
+
+        if self.manifest and not isinstance(plugin, LazyPlugin) and plugin.name in self.__plugin_modules:
+            self.manifest.update(self.__plugin_modules[plugin.name], plugin, self.__get_plugin_files(self.__plugin_modules[plugin.name]))
+            if save:
+                self.manifest.save()
+
+    async def import_plugin(self, name: str) -> Plugin:
+        """
+        Import a lazily loaded plugin and replace its placeholder. Does nothing if the plugin has already been imported.
+        :param name: name of the plugin
+        :return: the imported plugin
+        """
+
+        lock: asyncio.Lock = self.__import_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            placeholder: Plugin = self.__plugin_list[name]
+            if not isinstance(placeholder, LazyPlugin):
+                return placeholder
+
+            module: str = self.__plugin_modules[name]
+            logger.info(f"Importing plugin {name} on first use")
+            start_time: float = perf_counter()
+            plugin: Plugin = importlib.import_module(f"plugins.{module}.{module}").plugin
+            plugin._set_client(self.client)
+            plugin._set_store(self.store)
+            plugin.plugin_data = await plugin._load_data()
+            plugin._load_state()
+
+            self.__plugin_list[name] = plugin
+            self.registry.replace_plugin(placeholder, plugin)
+            plugin._set_registry(self.registry)
+            self.__update_manifest(plugin)
+            logger.info(f"Imported plugin {name} in {perf_counter() - start_time:.2f}s")
+
+            return plugin
+
     def is_allowed_plugin(self, plugin: str):
         """
         Check if a given plugin is allowed to be loaded
@@ -106,7 +200,16 @@ class PluginLoader:
     async def load_plugin_data(self):
 
         for plugin in self.__plugin_list.values():
-            plugin.plugin_data = await plugin._load_data_from_file()
+            plugin.plugin_data = await plugin._load_data()
+
+    async def flush_plugin_data(self):
+        """
+        Write the plugins' modified data, e.g. before shutting down
+        :return:
+        """
+
+        for plugin in self.__plugin_list.values():
+            await plugin._flush_data()
 
     async def load_plugin_state(self):
         """
@@ -117,6 +220,12 @@ class PluginLoader:
         for plugin in self.get_plugins().values():
             plugin._load_state()
 
+        # all plugins are fully loaded, store their manifest to allow importing them on first use next time
+        if self.manifest:
+            for plugin in self.get_plugins().values():
+                self.__update_manifest(plugin, save=False)
+            self.manifest.save()
+
     def get_plugins(self) -> Dict[str, Plugin]:
 
         return self.__plugin_list
@@ -140,27 +249,17 @@ class PluginLoader:
 
         for plugin in self.get_plugins().values():
             for event_type, current_plugin_hooks in plugin._get_hooks().items():
-                if event_type in all_plugin_hooks.keys():
-                    for plugin_hook in current_plugin_hooks:
-                        all_plugin_hooks[event_type].append(plugin_hook)
-                else:
-                    all_plugin_hooks[event_type] = copy.deepcopy(current_plugin_hooks)
+                all_plugin_hooks.setdefault(event_type, []).extend(current_plugin_hooks)
 
         return all_plugin_hooks
 
     def get_commands(self) -> Dict[str, PluginCommand]:
         """
         Get all commands curently registered by all plugins
-        :return: Dict of command-string and the corresponding PluginCommand
+        :return: Dict of command-string and the corresponding PluginCommand, maintained by the registry. Do not modify.
         """
 
-        plugin_commands: Dict[str, PluginCommand] = {}
-        plugin: Plugin
-
-        for plugin in self.get_plugins().values():
-            plugin_commands.update(plugin._get_commands())
-
-        return plugin_commands
+        return self.registry.commands
 
     def get_timers(self) -> List[Timer]:
         """
@@ -188,35 +287,29 @@ class PluginLoader:
         logger.debug(f"Running Command {command.command} with args {command.args}")
 
         command_start = command.command.split()[0].lower()
-        run_command: str = ""
+        plugin_commands: Dict[str, PluginCommand] = self.get_commands()
 
-        if command_start in self.get_commands().keys():
-            run_command = command_start
-
-        # Command not found, try fuzzy matching
-        else:
-            ratios: Dict[str, int] = {}
-            for key in self.get_commands().keys():
-                if fuzz.ratio(command_start, key) > 60:
-                    ratios[key] = fuzz.ratio(command_start, key)
-
-            # Sort matching commands by match percentage and get the highest match
-            if ratios != {}:
-                run_command = sorted(ratios.items(), key=operator.itemgetter(1), reverse=True)[0][0]
+        # look up the command, try fuzzy matching if not found
+        run_command: str = self.command_matcher.match(command_start) or ""
 
         # check if we did actually find a matching command
         if run_command != "":
-            if not self.get_commands()[run_command].room_id or command.room.room_id in self.get_commands()[run_command].room_id:
+            plugin_command: PluginCommand = plugin_commands[run_command]
+            if not plugin_command.room_id or command.room.room_id in plugin_command.room_id:
 
                 # check if the user's power_level matches the command's requirement
-                if command.room.power_levels.get_user_level(command.event.sender) >= self.get_commands()[run_command].power_level:
+                if command.room.power_levels.get_user_level(command.event.sender) >= plugin_command.power_level:
 
                     # Make sure, exceptions raised by plugins do not kill the bot
+                    start_time: float = perf_counter()
+                    failed: bool = False
                     try:
-                        await self.get_commands()[run_command].method(command)
+                        await plugin_command.method(command)
                     except Exception:
+                        failed = True
                         logger.critical(f"Plugin failed to catch exception caused by {command_start}:")
                         traceback.print_exc()
+                    metrics.observe("command", run_command, perf_counter() - start_time, error=failed)
                     return 0
                 else:
                     await send_text_to_room(
@@ -230,7 +323,7 @@ class PluginLoader:
 
     async def run_hooks(self, client, event_type: str, room, event: UnknownEvent or RoomMessageText):
         """
-        Run all applicable hooks for the event_type
+        Run all applicable hooks for the event_type concurrently, wait for all of them to finish or time out
         :param client:
         :param event_type:
         :param room:
@@ -238,56 +331,74 @@ class PluginLoader:
         :return:
         """
 
-        if event_type in self.get_hooks().keys():
-
-            plugin_hooks: List[PluginHook] = self.get_hooks()[event_type]
-            plugin_hook: PluginHook
-
-            for plugin_hook in plugin_hooks:
-                if (not plugin_hook.room_id_list or room.room_id in plugin_hook.room_id_list) and (
-                    not plugin_hook.event_ids or event.source["content"]["m.relates_to"]["event_id"] in plugin_hook.event_ids
-                ):
-                    # plugin_hook is valid for room of the current event and
-                    # event relates to a specified event_id
-
-                    # Make sure, exceptions raised by plugins do not kill the bot
-                    try:
-                        await plugin_hook.method(client, room.room_id, event)
-                    except Exception as err:
-                        logger.critical(f"Plugin failed to catch exception caused by hook {plugin_hook.method} on {room} for {event}:")
-                        traceback.print_exc()
-
-    async def run_timers(self, client, timestamp: float) -> float:
+        plugin_hooks: Sequence[PluginHook] = self.registry.get_hooks(event_type, room.room_id)
+        if not plugin_hooks:
+            return
+
+        plugin_hook: PluginHook
+        hook_tasks: List[asyncio.Task] = []
+        related_hooks: Set[PluginHook] or FrozenSet or None = None
+        for plugin_hook in plugin_hooks:
+            if plugin_hook.event_ids:
+                # hook is restricted to events relating to specific event_ids, look up hooks for the related event only once
+                if related_hooks is None:
+                    related_event_id: str or None = event.source.get("content", {}).get("m.relates_to", {}).get("event_id")
+                    related_hooks = self.registry.get_event_id_hooks(related_event_id)
+                if plugin_hook not in related_hooks:
+                    continue
+
+            # plugin_hook is valid for room of the current event (ensured by the registry) and
+            # event relates to a specified event_id
+            hook_tasks.append(asyncio.create_task(self.__run_hook(plugin_hook, client, room, event)))
+
+        if hook_tasks:
+            await asyncio.gather(*hook_tasks)
+
+    async def __run_hook(self, plugin_hook: PluginHook, client, room, event: UnknownEvent or RoomMessageText):
         """
-        Checks all timers if their execution is due and executes them
+        Run a single hook, limited by the configured concurrency and timeout
+        :param plugin_hook: the hook to run
         :param client:
-        :param timestamp: timestamp of last execution to make sure we're not running more than once every 30s
+        :param room:
+        :param event:
         :return:
         """
 
-        """Do not run timers more often than every 30s"""
-        if time() >= timestamp + 30:
+        async with self.hook_semaphore:
+            # Make sure, exceptions raised by plugins do not kill the bot
+            start_time: float = perf_counter()
+            failed: bool = True
+            try:
+                await asyncio.wait_for(plugin_hook.method(client, room.room_id, event), timeout=self.config.hooks_timeout or None)
+                failed = False
+            except asyncio.TimeoutError:
+                logger.error(f"Hook {plugin_hook.method} on {room} timed out after {self.config.hooks_timeout}s and has been cancelled.")
+            except Exception:
+                logger.critical(f"Plugin failed to catch exception caused by hook {plugin_hook.method} on {room} for {event}:")
+                traceback.print_exc()
+            metrics.observe(
+                "hook", f"{plugin_hook.event_type}:{plugin_hook.method.__module__}.{plugin_hook.method.__name__}", perf_counter() - start_time, error=failed
+            )
+
+    def start_timers(self, client: AsyncClient) -> None:
+        """
+        Start the scheduler running all timers as its own task. Does nothing if the scheduler is already running.
+        :param client: the bot's client instance, passed to the timers
+        :return:
+        """
 
-            timer: Timer
-            affected_plugins: List[str] = []
+        if self.timer_scheduler is None:
+            self.timer_scheduler = TimerScheduler(client, self.get_timers, self.__timer_triggered)
+            self.registry.on_timers_changed = self.timer_scheduler.reschedule
+        self.timer_scheduler.start()
 
-            # check all timers for execution
-            for timer in self.get_timers():
-                try:
-                    if await timer.trigger(client):
-                        logger.debug(f"Timer {timer.name} triggered")
-                        affected_plugins.append(timer.name.split(".")[0])
-                except Exception:
-                    logger.critical(f"Plugin failed to catch exception caused by timer {timer.name}:")
-                    traceback.print_exc()
-
-            # save state of a plugin if it's timer has triggered
-            if affected_plugins:
-                plugin: Plugin
-                for plugin in self.get_plugins().values():
-                    if plugin.name in affected_plugins:
-                        plugin._save_state()
-
-            return time()
-        else:
-            return timestamp
+    def __timer_triggered(self, timer: Timer) -> None:
+        """
+        Save the state of the plugin whose timer has been triggered
+        :param timer: the triggered timer
+        :return:
+        """
+
+        plugin: Plugin or None
+        if plugin := self.get_plugin_by_name(timer.name.split(".")[0]):
+            plugin._save_state()
@@ -0,0 +1,154 @@
+from collections.abc import Mapping, Sequence, Set
+from types import MethodType
+from typing import Any, Iterator
+
+immutable_types: tuple = (str, bytes, int, float, complex, bool, type(None), frozenset, range)
+
+
+def read_only(value: Any) -> Any:
+    """
+    Get a read-only view of a value without copying it.
+    dicts, lists, tuples and sets are wrapped in read-only views, objects are wrapped in a view preventing attribute assignment.
+    Values contained in views are wrapped when they are accessed, so the cost of a view does not depend on the size of the viewed data.
+    Methods of viewed objects are called on the view, so they can read the object but fail with a TypeError when modifying it.
+    :param value: the value to view
+    :return: the value itself if it is immutable or callable, a read-only view of it otherwise
+    """
+
+    if isinstance(value, immutable_types) or isinstance(value, (ReadOnlyDict, ReadOnlyList, ReadOnlySet, ReadOnlyObject)):
+        return value
+    elif isinstance(value, dict):
+        return ReadOnlyDict(value)
+    elif isinstance(value, (list, tuple)):
+        return ReadOnlyList(value)
+    elif isinstance(value, (set, frozenset)):
+        return ReadOnlySet(value)
+    elif callable(value) or not hasattr(value, "__dict__"):
+        return value
+    else:
+        return ReadOnlyObject(value)
+
+
+class ReadOnlyDict(Mapping):
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict):
+        """
+        Read-only view of a dict
+        :param data: the viewed dict
+        """
+
+        self._data: dict = data
+
+    def __getitem__(self, key: Any) -> Any:
+        return read_only(self._data[key])
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._data
+
+    def __eq__(self, other: Any) -> bool:
+        return self._data == (other._data if isinstance(other, ReadOnlyDict) else other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self._data)
+
+
+class ReadOnlyList(Sequence):
+    __slots__ = ("_data",)
+
+    def __init__(self, data: list or tuple):
+        """
+        Read-only view of a list or tuple
+        :param data: the viewed list or tuple
+        """
+
+        self._data: list or tuple = data
+
+    def __getitem__(self, index: int or slice) -> Any:
+        if isinstance(index, slice):
+            return ReadOnlyList(self._data[index])
+        return read_only(self._data[index])
+
+    def __iter__(self) -> Iterator:
+        for value in self._data:
+            yield read_only(value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, value: Any) -> bool:
+        return value in self._data
+
+    def __eq__(self, other: Any) -> bool:
+        return self._data == (other._data if isinstance(other, ReadOnlyList) else other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self._data)
+
+
+class ReadOnlySet(Set):
+    __slots__ = ("_data",)
+
+    def __init__(self, data: set or frozenset):
+        """
+        Read-only view of a set
+        :param data: the viewed set
+        """
+
+        self._data: set or frozenset = data
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, value: Any) -> bool:
+        return value in self._data
+
+    def __repr__(self) -> str:
+        return repr(self._data)
+
+
+class ReadOnlyObject:
+    __slots__ = ("_data",)
+
+    def __init__(self, data: Any):
+        """
+        View of an object, preventing assignment of its attributes and wrapping their values in read-only views.
+        Methods of the object are bound to the view instead of the object, so they only see read-only views as well
+        :param data: the viewed object
+        """
+
+        object.__setattr__(self, "_data", data)
+
+    def __getattr__(self, name: str) -> Any:
+        value: Any = getattr(self._data, name)
+        if isinstance(value, MethodType) and value.__self__ is self._data:
+            return MethodType(value.__func__, self)
+        return read_only(value)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise TypeError(f"Cannot set attribute {name} of a read-only {type(self._data).__name__}")
+
+    def __delattr__(self, name: str) -> None:
+        raise TypeError(f"Cannot delete attribute {name} of a read-only {type(self._data).__name__}")
+
+    def __eq__(self, other: Any) -> bool:
+        return self._data == (other._data if isinstance(other, ReadOnlyObject) else other)
+
+    def __hash__(self) -> int:
+        return hash(self._data)
+
+    def __repr__(self) -> str:
+        return repr(self._data)
@@ -0,0 +1,267 @@
+from typing import List, Dict, Tuple, Sequence, Set, FrozenSet, Callable, TYPE_CHECKING
+import logging
+
+if TYPE_CHECKING:
+    from core.plugin import Plugin, PluginCommand, PluginHook
+
+logger = logging.getLogger(__name__)
+
+
+class PluginRegistry:
+    def __init__(self):
+        """
+        Central, incrementally maintained index of everything registered by the loaded plugins.
+        Plugins update the registry in place when adding or removing commands, so looking up a command is a single dict lookup.
+        Hooks are indexed by (event_type, room_id) and by the event_ids they are restricted to. Plugins adding or removing a hook only update
+        the entries of its event_type and its event_ids, attaching or replacing plugins invalidates the whole index.
+        """
+
+        self.plugins: List["Plugin"] = []
+        self.commands: Dict[str, "PluginCommand"] = {}
+        self.version: int = 0
+        """Incremented on every change of the registry, allows consumers to cheaply detect if derived data is outdated"""
+
+        self.room_hooks: Dict[Tuple[str, str], List["PluginHook"]] = {}
+        """Dispatch table of (event_type, room_id) to all hooks applicable for the room, including global hooks"""
+        self.global_hooks: Dict[str, List["PluginHook"]] = {}
+        """Hooks valid for all rooms, by event_type. Used for rooms without any room-specific hooks"""
+        self.event_id_hooks: Dict[str, Set["PluginHook"]] = {}
+        """Map of event_ids to the hooks restricted to events relating to them (e.g. reactions to a specific message)"""
+        self.hook_rooms: Dict[str, List[str]] = {}
+        """Rooms with room-specific hooks, by event_type"""
+        self.hooks_valid: bool = False
+
+        self.on_timers_changed: Callable[[], None] or None = None
+        """Called whenever timers are added or removed, e.g. to wake up the timer scheduler"""
+        self.on_state_saved: Callable[["Plugin"], None] or None = None
+        """Called whenever a plugin has saved its state, e.g. to update the plugin manifest"""
+
+    def attach_plugin(self, plugin: "Plugin") -> None:
+        """
+        Register a plugin and all of its currently known commands and hooks
+        :param plugin: the plugin to register
+        :return:
+        """
+
+        if plugin not in self.plugins:
+            self.plugins.append(plugin)
+
+        command: PluginCommand
+        for command in plugin._get_commands().values():
+            self.commands[command.command] = command
+        self.invalidate_hooks()
+
+    def replace_plugin(self, old_plugin: "Plugin", new_plugin: "Plugin") -> None:
+        """
+        Replace a registered plugin by another one (e.g. a placeholder by the actual plugin), keeping its position.
+        Commands, hooks and timers of the old plugin are removed, the new plugin still needs to be attached by attach_plugin().
+        :param old_plugin: the plugin currently registered
+        :param new_plugin: the plugin replacing it
+        :return:
+        """
+
+        self.plugins[self.plugins.index(old_plugin)] = new_plugin
+        command: PluginCommand
+        for command in old_plugin._get_commands().values():
+            if self.commands.get(command.command) is command:
+                del self.commands[command.command]
+        self.invalidate_hooks()
+        self.invalidate_timers()
+
+    def state_saved(self, plugin: "Plugin") -> None:
+        """
+        Notify about a plugin having saved its state
+        :param plugin: the plugin
+        :return:
+        """
+
+        if self.on_state_saved:
+            self.on_state_saved(plugin)
+
+    def add_command(self, plugin_command: "PluginCommand") -> None:
+        """
+        Add a command to the registry. Commands with the same name are overwritten, matching the order plugins are loaded in.
+        :param plugin_command: the command to add
+        :return:
+        """
+
+        self.commands[plugin_command.command] = plugin_command
+        self.version += 1
+
+    def del_command(self, plugin_command: "PluginCommand") -> None:
+        """
+        Remove a command from the registry. If another plugin provides a command of the same name, it takes over.
+        :param plugin_command: the command to remove
+        :return:
+        """
+
+        if self.commands.get(plugin_command.command) is not plugin_command:
+            return
+
+        del self.commands[plugin_command.command]
+        plugin: Plugin
+        for plugin in reversed(self.plugins):
+            if fallback := plugin._get_commands().get(plugin_command.command):
+                self.commands[plugin_command.command] = fallback
+                break
+        self.version += 1
+
+    def get_command(self, command: str) -> "PluginCommand" or None:
+        """
+        Look up a command by its name
+        :param command: name of the command
+        :return:    the PluginCommand, if found
+                    None, otherwise
+        """
+
+        return self.commands.get(command)
+
+    def invalidate_hooks(self) -> None:
+        """
+        Mark the hook dispatch table as outdated, it will be rebuilt on the next lookup.
+        Needs to be called whenever hooks are added, removed or their rooms are changed.
+        :return:
+        """
+
+        self.hooks_valid = False
+        self.version += 1
+
+    def add_hook(self, hook: "PluginHook") -> None:
+        """
+        Update the index after a plugin added a hook or added rooms to an existing hook
+        :param hook: the added or changed hook
+        :return:
+        """
+
+        self.version += 1
+        if not self.hooks_valid:
+            # the whole index is rebuilt on the next lookup anyway
+            return
+
+        event_id: str
+        for event_id in hook.event_ids or []:
+            self.event_id_hooks.setdefault(event_id, set()).add(hook)
+        self.__build_event_type_index(hook.event_type)
+
+    def del_hook(self, hook: "PluginHook", removed: bool) -> None:
+        """
+        Update the index after a plugin removed a hook or removed rooms from a hook
+        :param hook: the removed or changed hook
+        :param removed: True, if the hook has been removed completely
+        :return:
+        """
+
+        self.version += 1
+        if not self.hooks_valid:
+            return
+
+        if removed:
+            event_id: str
+            for event_id in hook.event_ids or []:
+                if event_id in self.event_id_hooks:
+                    self.event_id_hooks[event_id].discard(hook)
+                    if not self.event_id_hooks[event_id]:
+                        del self.event_id_hooks[event_id]
+        self.__build_event_type_index(hook.event_type)
+
+    def invalidate_timers(self) -> None:
+        """
+        Notify about added or removed timers
+        :return:
+        """
+
+        self.version += 1
+        if self.on_timers_changed:
+            self.on_timers_changed()
+
+    def get_hooks(self, event_type: str, room_id: str) -> Sequence["PluginHook"]:
+        """
+        Get all hooks applicable for an event_type in a room, in the order the hooks have been registered
+        :param event_type: the event_type to look up
+        :param room_id: the room_id the event has been received in
+        :return: sequence of PluginHooks, must not be modified
+        """
+
+        if not self.hooks_valid:
+            self.__build_hook_index()
+
+        hooks: List[PluginHook] or None = self.room_hooks.get((event_type, room_id))
+        if hooks is None:
+            return self.global_hooks.get(event_type, ())
+        return hooks
+
+    def get_event_id_hooks(self, event_id: str) -> Set["PluginHook"] or FrozenSet:
+        """
+        Get all hooks restricted to events relating to the given event_id
+        :param event_id: the event_id the received event relates to
+        :return: set of PluginHooks, must not be modified
+        """
+
+        if not self.hooks_valid:
+            self.__build_hook_index()
+
+        return self.event_id_hooks.get(event_id, frozenset())
+
+    def __build_hook_index(self) -> None:
+        """
+        Rebuild the dispatch table of hooks from all attached plugins
+        :return:
+        """
+
+        event_types: Set[str] = set()
+        event_id_hooks: Dict[str, Set[PluginHook]] = {}
+
+        plugin: Plugin
+        for plugin in self.plugins:
+            for event_type, plugin_hooks in plugin._get_hooks().items():
+                event_types.add(event_type)
+                hook: PluginHook
+                for hook in plugin_hooks:
+                    for event_id in hook.event_ids or []:
+                        event_id_hooks.setdefault(event_id, set()).add(hook)
+
+        self.room_hooks = {}
+        self.global_hooks = {}
+        self.hook_rooms = {}
+        for event_type in event_types:
+            self.__build_event_type_index(event_type)
+        self.event_id_hooks = event_id_hooks
+        self.hooks_valid = True
+
+    def __build_event_type_index(self, event_type: str) -> None:
+        """
+        Rebuild the dispatch table entries of a single event_type from all attached plugins
+        :param event_type: the event_type to rebuild the entries of
+        :return:
+        """
+
+        for room_id in self.hook_rooms.pop(event_type, []):
+            del self.room_hooks[(event_type, room_id)]
+        self.global_hooks.pop(event_type, None)
+
+        ordered_hooks: List[PluginHook] = [hook for plugin in self.plugins for hook in plugin._get_hooks().get(event_type, [])]
+        room_hooks: Dict[str, List[PluginHook]] = {}
+        global_hooks: List[PluginHook] = []
+
+        hook: PluginHook
+        for hook in ordered_hooks:
+            for room_id in hook.room_id_list or []:
+                room_hooks.setdefault(room_id, [])
+
+        for hook in ordered_hooks:
+            if not hook.room_id_list:
+                # global hooks are valid for rooms with specific hooks as well
+                global_hooks.append(hook)
+                for room_hook_list in room_hooks.values():
+                    room_hook_list.append(hook)
+            else:
+                for room_id in hook.room_id_list:
+                    if hook not in room_hooks[room_id]:
+                        room_hooks[room_id].append(hook)
+
+        if global_hooks:
+            self.global_hooks[event_type] = global_hooks
+        if room_hooks:
+            self.hook_rooms[event_type] = list(room_hooks.keys())
+            for room_id, room_hook_list in room_hooks.items():
+                self.room_hooks[(event_type, room_id)] = room_hook_list
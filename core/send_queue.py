@@ -0,0 +1,367 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import uuid
+from time import monotonic, perf_counter
+from typing import Dict, List, Set, Tuple, Iterator
+
+from nio import AsyncClient, RoomSendResponse, RoomSendError
+
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_MESSAGE: int = 0
+PRIORITY_NOTICE: int = 1
+PRIORITY_REACTION: int = 2
+
+
+def get_priority(message_type: str, content: dict) -> int:
+    """
+    Get the priority class of an event, lower values are sent first
+    :param message_type: type of the event, e.g. "m.room.message"
+    :param content: content of the event
+    :return: PRIORITY_MESSAGE, PRIORITY_NOTICE or PRIORITY_REACTION
+    """
+
+    if message_type == "m.reaction":
+        return PRIORITY_REACTION
+    elif content.get("msgtype") == "m.notice":
+        return PRIORITY_NOTICE
+    else:
+        return PRIORITY_MESSAGE
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        """
+        A token bucket allowing bursts of up to `burst` events and `rate` events per second on average
+        :param rate: tokens added per second
+        :param burst: maximum number of tokens
+        """
+
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = burst
+        self.updated: float = monotonic()
+
+    def __refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Get the time until a token is available
+        :param now: current monotonic time
+        :return: seconds to wait, 0 if a token is available
+        """
+
+        self.__refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        """
+        Take a token from the bucket
+        :param now: current monotonic time
+        :return:
+        """
+
+        self.__refill(now)
+        self.tokens -= 1
+
+    def drain(self) -> None:
+        """
+        Remove all tokens, e.g. after being rate-limited by the server
+        :return:
+        """
+
+        self.tokens = 0
+
+
+class SendRequest:
+    def __init__(
+        self, client: AsyncClient, room_id: str, message_type: str, content: dict, tx_id: str, ignore_unverified_devices: bool, priority: int, sequence: int
+    ):
+        """
+        An event waiting to be sent
+        """
+
+        self.client: AsyncClient = client
+        self.room_id: str = room_id
+        self.message_type: str = message_type
+        self.content: dict = content
+        self.tx_id: str = tx_id
+        self.ignore_unverified_devices: bool = ignore_unverified_devices
+        self.priority: int = priority
+        self.sequence: int = sequence
+        self.retries: int = 0
+        self.not_before: float = 0.0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class SendQueue:
+    def __init__(
+        self,
+        global_rate: float = 4.0,
+        global_burst: int = 8,
+        room_rate: float = 2.0,
+        room_burst: int = 8,
+        max_retries: int = 3,
+        min_rate: float = 0.2,
+        rate_increase: float = 0.1,
+        retry_delay: float = 3.0,
+    ):
+        """
+        Queue for outbound events, limiting the rate of sent events by a global token bucket and one token bucket per room.
+        Queued events are sent strictly in order per room, with different rooms being sent to in parallel. Across rooms, events are
+        sent by priority (messages before notices before reactions), so a room's oldest event competes with the other rooms' by its priority.
+        The global rate adapts to the server's rate-limits: it is halved whenever the server responds with M_LIMIT_EXCEEDED and
+        increased slowly with every successfully sent event, up to the configured rate.
+        Retries reuse the event's transaction id, so the server will not duplicate events that have been sent already.
+        :param global_rate: maximum events per second for all rooms
+        :param global_burst: number of events that may be sent at once for all rooms
+        :param room_rate: maximum events per second per room
+        :param room_burst: number of events that may be sent at once per room
+        :param max_retries: number of retries before giving up on an event
+        :param min_rate: lower bound of the global rate when being rate-limited
+        :param rate_increase: events per second the global rate is increased by with every event sent successfully
+        :param retry_delay: seconds to wait before retrying an event that failed for other reasons than rate-limiting
+        """
+
+        self.max_rate: float = global_rate
+        self.global_bucket: TokenBucket = TokenBucket(global_rate, global_burst)
+        self.room_rate: float = room_rate
+        self.room_burst: int = room_burst
+        self.room_buckets: Dict[str, TokenBucket] = {}
+        self.max_retries: int = max_retries
+        self.min_rate: float = min_rate
+        self.rate_increase: float = rate_increase
+        self.retry_delay: float = retry_delay
+
+        self.queue: List[Tuple[int, int, SendRequest]] = []
+        self.sending_rooms: Set[str] = set()
+        self.paused_until: float = 0.0
+        self.sequence: Iterator[int] = itertools.count()
+        self.changed: asyncio.Event or None = None
+        self.task: asyncio.Task or None = None
+        self.send_tasks: Set[asyncio.Task] = set()
+        """Events currently being sent, referenced to keep the tasks from being garbage-collected"""
+
+    def configure(self, global_rate: float, global_burst: int, room_rate: float, room_burst: int, max_retries: int) -> None:
+        """
+        Apply the configured rate-limits
+        :param global_rate: maximum events per second for all rooms
+        :param global_burst: number of events that may be sent at once for all rooms
+        :param room_rate: maximum events per second per room
+        :param room_burst: number of events that may be sent at once per room
+        :param max_retries: number of retries before giving up on an event
+        :return:
+        """
+
+        self.max_rate = global_rate
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.room_buckets = {}
+        self.max_retries = max_retries
+
+    @property
+    def depth(self) -> int:
+        """
+        Number of events waiting to be sent
+        """
+
+        return len(self.queue)
+
+    async def send(
+        self, client: AsyncClient, room_id: str, message_type: str, content: dict, tx_id: str or None = None, ignore_unverified_devices: bool = False
+    ) -> RoomSendResponse or RoomSendError:
+        """
+        Queue an event and wait for it to be sent
+        :param client: (nio.AsyncClient) The client to communicate to matrix with
+        :param room_id: (str) The room id of the room where the message should be sent to.
+        :param message_type: (str) A string identifying the type of the message.
+        :param content: (dict) A dictionary containing the content of the message.
+        :param tx_id: (str) The transaction ID of this event, generated if not given
+        :param ignore_unverified_devices: (bool) If the room is encrypted and contains unverified devices, the devices can be marked as ignored here.
+        :return:    RoomSendResponse, if the event has been sent
+                    RoomSendError, if the event could not be sent after all retries
+        """
+
+        self.__start()
+        sequence: int = next(self.sequence)
+        request: SendRequest = SendRequest(
+            client, room_id, message_type, content, tx_id or str(uuid.uuid4()), ignore_unverified_devices, get_priority(message_type, content), sequence
+        )
+        heapq.heappush(self.queue, (request.priority, sequence, request))
+        self.changed.set()
+        return await request.future
+
+    def __start(self) -> None:
+        """
+        Start the queue's task, if it is not running already
+        :return:
+        """
+
+        if self.task is None or self.task.done():
+            self.changed = asyncio.Event()
+            self.task = asyncio.create_task(self.__run(), name="send-queue")
+
+    def __get_room_bucket(self, room_id: str) -> TokenBucket:
+        if room_id not in self.room_buckets:
+            self.room_buckets[room_id] = TokenBucket(self.room_rate, self.room_burst)
+        return self.room_buckets[room_id]
+
+    async def __run(self) -> None:
+        """
+        Main loop of the queue, sending events whenever tokens are available
+        :return:
+        """
+
+        while True:
+            self.changed.clear()
+            delay: float or None = self.__dispatch(monotonic())
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def __dispatch(self, now: float) -> float or None:
+        """
+        Start sending all events that can be sent right now
+        :param now: current monotonic time
+        :return:    seconds until the next event may be sent
+                    None, if no event is waiting for tokens
+        """
+
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        # only the oldest queued event of a room may be sent, keeping events of the same room in order regardless of their priority
+        room_heads: Dict[str, int] = {}
+        entry: Tuple[int, int, SendRequest]
+        for entry in self.queue:
+            if not entry[2].future.done() and entry[1] < room_heads.get(entry[2].room_id, entry[1] + 1):
+                room_heads[entry[2].room_id] = entry[1]
+
+        delay: float or None = None
+        deferred: List[Tuple[int, int, SendRequest]] = []
+        blocked_rooms: Set[str] = set(self.sending_rooms)
+
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            request: SendRequest = entry[2]
+
+            if request.future.done():
+                # caller has been cancelled
+                continue
+
+            if request.room_id in blocked_rooms or request.sequence != room_heads[request.room_id]:
+                # keep events of the same room in order
+                deferred.append(entry)
+                continue
+
+            wait: float = max(request.not_before - now, self.__get_room_bucket(request.room_id).delay(now))
+            if wait > 0:
+                deferred.append(entry)
+                blocked_rooms.add(request.room_id)
+                delay = wait if delay is None else min(delay, wait)
+                continue
+
+            wait = self.global_bucket.delay(now)
+            if wait > 0:
+                # no more events can be sent to any room
+                deferred.append(entry)
+                delay = wait if delay is None else min(delay, wait)
+                break
+
+            self.global_bucket.consume(now)
+            self.__get_room_bucket(request.room_id).consume(now)
+            self.sending_rooms.add(request.room_id)
+            blocked_rooms.add(request.room_id)
+            send_task: asyncio.Task = asyncio.create_task(self.__send(request), name=f"send-{request.tx_id}")
+            self.send_tasks.add(send_task)
+            send_task.add_done_callback(self.send_tasks.discard)
+
+        for entry in deferred:
+            heapq.heappush(self.queue, entry)
+        return delay
+
+    async def __send(self, request: SendRequest) -> None:
+        """
+        Send a single event, queueing it again if it failed
+        :param request: the event to send
+        :return:
+        """
+
+        try:
+            start_time: float = perf_counter()
+            response: RoomSendResponse or RoomSendError = await request.client.room_send(
+                request.room_id, request.message_type, request.content, request.tx_id, request.ignore_unverified_devices
+            )
+            metrics.observe("send", request.message_type, perf_counter() - start_time, error=isinstance(response, RoomSendError))
+        except Exception as err:
+            if not request.future.done():
+                request.future.set_exception(err)
+            return
+        finally:
+            self.sending_rooms.discard(request.room_id)
+            self.changed.set()
+
+        if not isinstance(response, RoomSendError):
+            self.__increase_rate()
+            if not request.future.done():
+                request.future.set_result(response)
+            return
+
+        metrics.increment("send_retries", request.message_type)
+        if request.retries >= self.max_retries:
+            # log message if it could not be sent
+            logger.warning(
+                f"Could not send {request.message_type} to {request.room_id} after {request.retries} retries. Giving up. "
+                f"Message {request.content.get('body')} is lost!"
+            )
+            if not request.future.done():
+                request.future.set_result(response)
+            return
+
+        request.retries += 1
+        if response.status_code == "M_LIMIT_EXCEEDED":
+            # we're being rate-limited, pause all sending for the given time and slow down
+            retry_after: float = (response.retry_after_ms or 1000) / 1000
+            self.paused_until = max(self.paused_until, monotonic() + retry_after)
+            self.__decrease_rate()
+            logger.warning(
+                f"Ratelimit hit with {request.message_type} to {request.room_id}! Server is asking us to wait {retry_after}s, "
+                f"reducing rate to {self.global_bucket.rate:.2f} events/s (Retry: {request.retries}/{self.max_retries})."
+            )
+        else:
+            # unknown error, just try again after a short delay
+            request.not_before = monotonic() + self.retry_delay
+            logger.warning(
+                f"Unknown error sending {request.message_type} to {request.room_id}. Retrying in {self.retry_delay}s ({request.retries}/{self.max_retries})."
+            )
+
+        heapq.heappush(self.queue, (request.priority, request.sequence, request))
+
+    def __decrease_rate(self) -> None:
+        """
+        Halve the global rate and drop all tokens
+        :return:
+        """
+
+        self.global_bucket.rate = max(self.min_rate, self.global_bucket.rate / 2)
+        self.global_bucket.drain()
+
+    def __increase_rate(self) -> None:
+        """
+        Increase the global rate, up to the configured rate
+        :return:
+        """
+
+        self.global_bucket.rate = min(self.max_rate, self.global_bucket.rate + self.rate_increase)
+
+
+send_queue: SendQueue = SendQueue()
+"""Queue for all events sent by the bot"""
@@ -0,0 +1,83 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, Any
+
+from core.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class SentEventCache:
+    def __init__(self, max_events: int = 1000):
+        """
+        Bounded cache of the current content of events sent by the bot, keyed by event_id.
+        Recently used events are kept in memory, all cached events are persisted to the bot's storage to survive restarts.
+        Used to check whether an edit actually changes an event without fetching the event from the homeserver.
+        :param max_events: number of events to keep
+        """
+
+        self.max_events: int = max_events
+        self.store: Storage or None = None
+        self.events: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+
+    def configure(self, store: Storage or None, max_events: int) -> None:
+        """
+        Set the storage events are persisted to and the number of events to keep
+        :param store: the bot's storage, None to only keep events in memory
+        :param max_events: number of events to keep
+        :return:
+        """
+
+        self.store = store
+        self.max_events = max_events
+        self.events = OrderedDict()
+
+    def get(self, event_id: str) -> Dict[str, Any] or None:
+        """
+        Get the current content of an event sent by the bot
+        :param event_id: the event_id of the sent event
+        :return:    the content of the event
+                    None, if the event is not cached
+        """
+
+        content: Dict[str, Any] or None = self.events.get(event_id)
+        if content is None and self.store is not None:
+            try:
+                content = self.store.get_sent_event_content(event_id)
+            except Exception as err:
+                logger.warning(f"Could not read sent event {event_id} from storage: {err}")
+            if content is not None:
+                self.__remember(event_id, content)
+        elif content is not None:
+            self.events.move_to_end(event_id)
+
+        return content
+
+    def put(self, event_id: str, room_id: str, content: Dict[str, Any]) -> None:
+        """
+        Store the current content of an event sent or edited by the bot
+        :param event_id: the event_id of the sent event, for edits the event_id of the original event
+        :param room_id: the room the event has been sent to
+        :param content: the event's current content
+        :return:
+        """
+
+        if self.max_events <= 0:
+            return
+
+        self.__remember(event_id, content)
+        if self.store is not None:
+            try:
+                self.store.save_sent_event_content(event_id, room_id, content, self.max_events)
+            except Exception as err:
+                logger.warning(f"Could not persist sent event {event_id}: {err}")
+
+    def __remember(self, event_id: str, content: Dict[str, Any]) -> None:
+        self.events[event_id] = content
+        self.events.move_to_end(event_id)
+        while len(self.events) > self.max_events:
+            self.events.popitem(last=False)
+
+
+sent_events: SentEventCache = SentEventCache()
+"""Content of the events recently sent by the bot"""
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        Deduplicates concurrent calls: callers asking for the same key while a call for it is still running share the running call's result
+        instead of starting their own. Results are not kept after the call has finished.
+        :param name: name of the calls, used as label of the "coalesced" counter
+        """
+
+        self.name: str = name
+        self.calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Await func(*args, **kwargs), or the running call for the same key
+        :param key: identifies calls returning the same result
+        :param func: coroutine function to call
+        :param args: positional arguments passed to func
+        :param kwargs: keyword arguments passed to func
+        :return: the result of the call
+        :raises: any exception raised by the call
+        """
+
+        task: asyncio.Task or None = self.calls.get(key)
+        if task is None:
+            task = asyncio.create_task(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda done_task: self.__finished(key, done_task))
+        else:
+            metrics.increment("coalesced", self.name)
+
+        # the call keeps running for the other callers if this caller is cancelled
+        return await asyncio.shield(task)
+
+    def __finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            # retrieve the exception, all callers may have been cancelled
+            logger.debug(f"Call {key} of {self.name} failed: {task.exception()}")
@@ -1,18 +1,101 @@
+import atexit
+import copy
+import json
+import queue
 import sqlite3
+import os
 import os.path
 import logging
+import threading
+from asyncio import wrap_future
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+import jsonpickle
 
 latest_db_version = 0
 
 logger = logging.getLogger(__name__)
 
 
+def write_file_atomic(filename: str, content: str):
+    """Write a file via a temporary file that is synced to disk and renamed, so the file is either replaced completely
+    or left unchanged, e.g. if the bot crashes while writing
+
+    Args:
+        filename (str): The name of the file to write
+
+        content (str): The content of the file
+    """
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "w") as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filename, filename)
+
+    if hasattr(os, "O_DIRECTORY"):
+        # persist the rename itself
+        directory = os.open(os.path.dirname(filename) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+# a single thread, so writes of the same file are executed in the order they were requested
+file_writer: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-writer")
+
+
+def write_file_later(filename: str, content: str) -> Future:
+    """Write a file atomically on the file writer thread, without blocking the caller
+
+    Args:
+        filename (str): The name of the file to write
+
+        content (str): The content of the file
+
+    Returns:
+        Future: Resolved once the file has been written, or with the error writing it
+    """
+    return file_writer.submit(write_file_atomic, filename, content)
+
+
+def write_json_later(filename: str, data: Any) -> Future:
+    """Encode data with jsonpickle and write it atomically on the file writer thread, without blocking the caller.
+    The data should be a snapshot taken with snapshot(), as it is encoded while the caller continues
+
+    Args:
+        filename (str): The name of the file to write
+
+        data: The data to encode and write
+
+    Returns:
+        Future: Resolved once the file has been written, or with the error encoding or writing it
+    """
+    return file_writer.submit(lambda: write_file_atomic(filename, jsonpickle.encode(data)))
+
+
+def snapshot(value: Any) -> Any:
+    """Take a cheap snapshot of data to be encoded on another thread: dicts, lists and sets are copied shallowly, so items added
+    or removed meanwhile don't break encoding. Contained objects are not copied
+
+    Args:
+        value: The data to take a snapshot of
+
+    Returns:
+        A shallow copy of containers, the value itself otherwise
+    """
+    return copy.copy(value) if isinstance(value, (dict, list, set)) else value
+
+
 class Storage(object):
     def __init__(self, db_path):
         """Setup the database
 
         Runs an initial setup or migrations depending on whether a database file has already
-        been created
+        been created. The database is used in WAL mode: reads are done on the calling thread,
+        all writes are done in order by a single writer thread.
 
         Args:
             db_path (str): The name of the database file
@@ -25,6 +108,15 @@ class Storage(object):
         else:
             self._initial_setup()
 
+        # readers don't block the writer and vice versa
+        # fetch the result, the statement keeps the database locked otherwise
+        self.cursor.execute("PRAGMA journal_mode=WAL").fetchone()
+
+        self.writes: queue.Queue = queue.Queue()
+        self.writer: threading.Thread = threading.Thread(target=self._run_writer, name="storage-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
     def _initial_setup(self):
         """Initial setup of the database"""
         logger.info("Performing initial database setup...")
@@ -36,6 +128,31 @@ class Storage(object):
         # Sync token table
         self.cursor.execute("CREATE TABLE sync_token (" "dedupe_id INTEGER PRIMARY KEY, " "token TEXT NOT NULL" ")")
 
+        # Uploaded sync filters
+        self.cursor.execute("CREATE TABLE sync_filter (" "filter_hash TEXT PRIMARY KEY, " "filter_id TEXT NOT NULL" ")")
+
+        # Content of events sent by the bot
+        self.cursor.execute("CREATE TABLE sent_events (" "event_id TEXT PRIMARY KEY, " "room_id TEXT NOT NULL, " "content TEXT NOT NULL" ")")
+
+        # Uploaded media
+        self.cursor.execute("CREATE TABLE media (" "content_hash TEXT PRIMARY KEY, " "content_uri TEXT NOT NULL" ")")
+
+        # Data stored by plugins, one row per key
+        self.cursor.execute("CREATE TABLE plugin_data (" "plugin TEXT NOT NULL, " "key TEXT NOT NULL, " "value TEXT NOT NULL, " "PRIMARY KEY (plugin, key)" ")")
+
+        # Cached http responses
+        self.cursor.execute(
+            "CREATE TABLE http_cache ("
+            "cache_key TEXT PRIMARY KEY, "
+            "url TEXT NOT NULL, "
+            "status_code INTEGER NOT NULL, "
+            "headers TEXT NOT NULL, "
+            "content BLOB NOT NULL, "
+            "encoding TEXT, "
+            "expires REAL NOT NULL"
+            ")"
+        )
+
         logger.info("Database setup complete")
 
     def _run_migrations(self):
@@ -43,3 +160,290 @@ class Storage(object):
         # Initialize a connection to the database
         self.conn = sqlite3.connect(self.db_path)
         self.cursor = self.conn.cursor()
+
+        # Uploaded sync filters, added after the initial version of the database
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS sync_filter (" "filter_hash TEXT PRIMARY KEY, " "filter_id TEXT NOT NULL" ")")
+
+        # Content of events sent by the bot, added after the initial version of the database
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS sent_events (" "event_id TEXT PRIMARY KEY, " "room_id TEXT NOT NULL, " "content TEXT NOT NULL" ")")
+
+        # Uploaded media, added after the initial version of the database
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS media (" "content_hash TEXT PRIMARY KEY, " "content_uri TEXT NOT NULL" ")")
+
+        # Data stored by plugins, added after the initial version of the database
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS plugin_data (" "plugin TEXT NOT NULL, " "key TEXT NOT NULL, " "value TEXT NOT NULL, " "PRIMARY KEY (plugin, key)" ")"
+        )
+
+        # Cached http responses, added after the initial version of the database
+        self.cursor.execute(
+            "CREATE TABLE IF NOT EXISTS http_cache ("
+            "cache_key TEXT PRIMARY KEY, "
+            "url TEXT NOT NULL, "
+            "status_code INTEGER NOT NULL, "
+            "headers TEXT NOT NULL, "
+            "content BLOB NOT NULL, "
+            "encoding TEXT, "
+            "expires REAL NOT NULL"
+            ")"
+        )
+
+    def _run_writer(self):
+        """Execute queued writes in order, each in its own transaction, until None is queued.
+        If the database cannot be opened, all writes fail with the error instead of waiting forever."""
+        conn = None
+        connect_error = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error as err:
+            logger.critical(f"Could not open {self.db_path} for writing, data will not be stored: {err}")
+            if conn is not None:
+                conn.close()
+            conn = None
+            connect_error = err
+
+        while True:
+            write = self.writes.get()
+            if write is None:
+                break
+            statements, future = write
+            if conn is None:
+                future.set_exception(connect_error)
+                continue
+            try:
+                with conn:
+                    for statement, parameters in statements():
+                        conn.execute(statement, parameters)
+                future.set_result(None)
+            except Exception as err:
+                future.set_exception(err)
+
+        if conn is not None:
+            conn.close()
+
+    def _write(self, statements: Callable[[], List[Tuple[str, tuple]]]) -> Future:
+        """Queue a write to be executed by the writer thread
+
+        Args:
+            statements (callable): Returns the statements to execute in a single transaction as tuples of sql and parameters,
+                called by the writer thread
+
+        Returns:
+            Future: Completed once the statements have been committed
+        """
+        future = Future()
+        self.writes.put((statements, future))
+        return future
+
+    def _write_later(self, statements: Callable[[], List[Tuple[str, tuple]]]):
+        """Queue a write without waiting for it, failures are logged
+
+        Args:
+            statements (callable): Returns the statements to execute in a single transaction as tuples of sql and parameters
+        """
+
+        def log_error(future: Future):
+            if future.exception() is not None:
+                logger.warning(f"Could not write to database: {future.exception()}")
+
+        self._write(statements).add_done_callback(log_error)
+
+    def close(self):
+        """Execute all queued writes and stop the writer thread"""
+        if self.writer.is_alive():
+            self.writes.put(None)
+            self.writer.join()
+
+    def get_sync_token(self) -> Optional[str]:
+        """Get the sync token (next_batch) of the last successful sync
+
+        Returns:
+            str: The stored sync token or None, if no token has been stored yet
+        """
+        self.cursor.execute("SELECT token FROM sync_token WHERE dedupe_id = 1")
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def save_sync_token(self, token: str):
+        """Store the sync token (next_batch) to resume syncing from it after restarts
+
+        Args:
+            token (str): The sync token to store
+        """
+        self._write_later(lambda: [("INSERT OR REPLACE INTO sync_token (dedupe_id, token) VALUES (1, ?)", (token,))])
+
+    def clear_sync_token(self):
+        """Remove the stored sync token, e.g. because it has been rejected by the homeserver"""
+        self._write_later(lambda: [("DELETE FROM sync_token", ())])
+
+    def get_sync_filter_id(self, filter_hash: str) -> Optional[str]:
+        """Get the id of a previously uploaded sync filter
+
+        Args:
+            filter_hash (str): Hash of the filter definition
+
+        Returns:
+            str: The filter id returned by the homeserver or None, if the filter has not been uploaded yet
+        """
+        self.cursor.execute("SELECT filter_id FROM sync_filter WHERE filter_hash = ?", (filter_hash,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def save_sync_filter_id(self, filter_hash: str, filter_id: str):
+        """Store the id of an uploaded sync filter
+
+        Args:
+            filter_hash (str): Hash of the filter definition
+
+            filter_id (str): The filter id returned by the homeserver
+        """
+        self._write_later(lambda: [("INSERT OR REPLACE INTO sync_filter (filter_hash, filter_id) VALUES (?, ?)", (filter_hash, filter_id))])
+
+    def get_sent_event_content(self, event_id: str) -> Optional[Dict[str, Any]]:
+        """Get the content of an event sent by the bot
+
+        Args:
+            event_id (str): The event id of the sent event
+
+        Returns:
+            dict: The stored content of the event or None, if the event is unknown
+        """
+        self.cursor.execute("SELECT content FROM sent_events WHERE event_id = ?", (event_id,))
+        row = self.cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_sent_event_content(self, event_id: str, room_id: str, content: Dict[str, Any], max_events: int):
+        """Store the content of an event sent by the bot, only keeping the most recently stored events
+
+        Args:
+            event_id (str): The event id of the sent event
+
+            room_id (str): The room the event has been sent to
+
+            content (dict): The current content of the event
+
+            max_events (int): The number of events to keep
+        """
+        # replaced rows get a new rowid, so the rowid reflects the order events have been stored in
+        self._write_later(
+            lambda: [
+                ("INSERT OR REPLACE INTO sent_events (event_id, room_id, content) VALUES (?, ?, ?)", (event_id, room_id, json.dumps(content))),
+                ("DELETE FROM sent_events WHERE rowid <= (SELECT MAX(rowid) FROM sent_events) - ?", (max_events,)),
+            ]
+        )
+
+    def get_media_uri(self, content_hash: str) -> Optional[str]:
+        """Get the content uri of previously uploaded media
+
+        Args:
+            content_hash (str): Hash of the uploaded content
+
+        Returns:
+            str: The mxc:// uri of the uploaded media or None, if the content has not been uploaded yet
+        """
+        self.cursor.execute("SELECT content_uri FROM media WHERE content_hash = ?", (content_hash,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def save_media_uri(self, content_hash: str, content_uri: str, max_entries: int):
+        """Store the content uri of uploaded media, only keeping the most recently stored entries
+
+        Args:
+            content_hash (str): Hash of the uploaded content
+
+            content_uri (str): The mxc:// uri of the uploaded media
+
+            max_entries (int): The number of entries to keep
+        """
+        self._write_later(
+            lambda: [
+                ("INSERT OR REPLACE INTO media (content_hash, content_uri) VALUES (?, ?)", (content_hash, content_uri)),
+                ("DELETE FROM media WHERE rowid <= (SELECT MAX(rowid) FROM media) - ?", (max_entries,)),
+            ]
+        )
+
+    def get_http_response(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Get a cached http response
+
+        Args:
+            cache_key (str): Hash of the request
+
+        Returns:
+            dict: The cached response's url, status_code, headers, content, encoding and expiry or None, if the request is not cached
+        """
+        self.cursor.execute("SELECT url, status_code, headers, content, encoding, expires FROM http_cache WHERE cache_key = ?", (cache_key,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        return {"url": row[0], "status_code": row[1], "headers": json.loads(row[2]), "content": row[3], "encoding": row[4], "expires": row[5]}
+
+    def save_http_response(self, cache_key: str, response: Dict[str, Any], max_size: int):
+        """Store an http response, only keeping the most recently stored responses up to a total size
+
+        Args:
+            cache_key (str): Hash of the request
+
+            response (dict): The response's url, status_code, headers, content, encoding and expiry
+
+            max_size (int): The maximum size of all stored response bodies in bytes
+        """
+        values = (
+            cache_key,
+            response["url"],
+            response["status_code"],
+            json.dumps(response["headers"]),
+            response["content"],
+            response["encoding"],
+            response["expires"],
+        )
+        # drop the oldest responses exceeding the total size, replaced rows get a new rowid
+        self._write_later(
+            lambda: [
+                ("INSERT OR REPLACE INTO http_cache (cache_key, url, status_code, headers, content, encoding, expires) VALUES (?, ?, ?, ?, ?, ?, ?)", values),
+                (
+                    "DELETE FROM http_cache WHERE rowid IN ("
+                    "SELECT rowid FROM (SELECT rowid, SUM(LENGTH(content)) OVER (ORDER BY rowid DESC) AS total FROM http_cache) WHERE total > ?"
+                    ")",
+                    (max_size,),
+                ),
+            ]
+        )
+
+    def get_plugin_data(self, plugin: str) -> Dict[str, Any]:
+        """Get all data stored by a plugin
+
+        Args:
+            plugin (str): The name of the plugin
+
+        Returns:
+            dict: The decoded data by key, empty if the plugin has not stored any data
+        """
+        self.cursor.execute("SELECT key, value FROM plugin_data WHERE plugin = ?", (plugin,))
+        return {key: jsonpickle.decode(value) for key, value in self.cursor.fetchall()}
+
+    async def save_plugin_data(self, plugin: str, key: str, value: Any):
+        """Store data of a plugin, replacing previously stored data of the same key.
+        A snapshot of the value is taken on the calling thread and encoded by the writer thread, off the event loop.
+
+        Args:
+            plugin (str): The name of the plugin
+
+            key (str): The name of the data
+
+            value: The data to store, encoded by jsonpickle
+        """
+        value = snapshot(value)
+        await wrap_future(
+            self._write(lambda: [("INSERT OR REPLACE INTO plugin_data (plugin, key, value) VALUES (?, ?, ?)", (plugin, key, jsonpickle.encode(value)))])
+        )
+
+    async def delete_plugin_data(self, plugin: str, key: str):
+        """Remove data of a plugin
+
+        Args:
+            plugin (str): The name of the plugin
+
+            key (str): The name of the data
+        """
+        await wrap_future(self._write(lambda: [("DELETE FROM plugin_data WHERE plugin = ? AND key = ?", (plugin, key))]))
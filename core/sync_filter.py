@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Set
+
+from nio import AsyncClient, UploadFilterResponse
+
+from core.config import Config
+from core.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+state_event_types: List[str] = [
+    "m.room.create",
+    "m.room.member",
+    "m.room.power_levels",
+    "m.room.join_rules",
+    "m.room.history_visibility",
+    "m.room.guest_access",
+    "m.room.name",
+    "m.room.topic",
+    "m.room.avatar",
+    "m.room.canonical_alias",
+    "m.room.encryption",
+    "m.room.tombstone",
+    "m.space.parent",
+]
+"""State events are always included in the timeline to keep the client's room state up to date"""
+
+hookable_event_types: List[str] = [
+    "m.room.message",
+    "m.reaction",
+]
+"""Event types commands and hooks are run for. Always included, so hooks added at runtime don't miss events synced before"""
+
+
+class SyncFilter:
+    def __init__(self, config: Config, store: Storage):
+        """
+        Builds a server-side sync filter only including the events the bot actually handles: the event types commands and hooks are run for
+        and state events. Typing notifications, receipts and presence are filtered out.
+        :param config: Bot configuration parameters
+        :param store: Bot storage, used to keep track of uploaded filters
+        """
+
+        self.config: Config = config
+        self.store: Storage = store
+        self.definition: Dict[str, Any] = {}
+
+    def build(self) -> Dict[str, Any]:
+        """
+        Build the filter definition
+        :return: the filter definition
+        """
+
+        event_types: Set[str] = set(hookable_event_types)
+        event_types.update(state_event_types)
+        if self.config.enable_encryption:
+            event_types.add("m.room.encrypted")
+
+        return {
+            "presence": {"not_types": ["*"]},
+            "room": {
+                "timeline": {"types": sorted(event_types)},
+                "state": {"lazy_load_members": self.config.sync_filter_lazy_load_members},
+                "ephemeral": {"not_types": ["*"]},
+            },
+        }
+
+    async def get_filter_id(self, client: AsyncClient) -> str or None:
+        """
+        Build the filter and get its id, uploading the filter if it hasn't been uploaded before
+        :param client: the bot's client instance
+        :return:    the filter id
+                    None, if the filter could not be uploaded
+        """
+
+        self.definition = self.build()
+        filter_hash: str = hashlib.sha256(f"{self.config.user_id}:{json.dumps(self.definition, sort_keys=True)}".encode()).hexdigest()
+
+        filter_id: str or None = self.store.get_sync_filter_id(filter_hash)
+        if filter_id is None:
+            response = await client.upload_filter(
+                presence=self.definition["presence"],
+                room=self.definition["room"],
+            )
+            if isinstance(response, UploadFilterResponse):
+                filter_id = response.filter_id
+                self.store.save_sync_filter_id(filter_hash, filter_id)
+                logger.info(f"Uploaded sync filter {filter_id} for {self.definition['room']['timeline']['types']}")
+            else:
+                logger.warning(f"Could not upload sync filter, syncing without filter: {response}")
+
+        return filter_id
@@ -1,5 +1,14 @@
+import asyncio
 import datetime
-from typing import List, Callable
+import heapq
+import logging
+import traceback
+from time import perf_counter
+from typing import List, Callable, Dict, Set, Tuple
+
+from core.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class Timer:
@@ -15,7 +24,7 @@ class Timer:
         A class for storing timers that call a specific method in a specified interval
         :param name: the name of a timer, usually derived from the plugin that added it and the name of the method that is being called
         :param method: the method called when the timer is triggered
-        :param frequency: the frequency in which the timer is allowed to trigger, None will allow the timer to trigger every time it is being called
+        :param frequency: the frequency in which the timer is allowed to trigger, None will allow the timer to trigger about every thirty seconds
         :param last_execution: timestamp of the timer's last execution
         :param timer_type: type of the timer, either static (default) or dynamic
         """
@@ -32,51 +41,51 @@ class Timer:
         else:
             raise Exception
 
-    async def should_trigger(self) -> bool:
+    def next_due(self) -> datetime.datetime:
         """
-        Check if the timer should trigger, e.g. because the last_execution is further in the past than the defined frequency
+        Calculate the time the timer is due to trigger next, based on its last_execution and frequency
 
-        :return (bool): True if the conditions for triggering the timer are met. A timer that has never been triggered will always return True.
-                        False if the conditions are not met.
+        :return (datetime.datetime): the point in time the timer should trigger at. A timer that has never been triggered is due immediately.
         """
 
-        # no frequency, always trigger
+        # timer has never been executed, due now
+        if self.last_execution is None:
+            return datetime.datetime.now()
+
+        # no frequency, trigger about every thirty seconds
         if self.frequency is None:
-            return True
+            return self.last_execution + datetime.timedelta(seconds=30)
 
-        else:
-            # timer has never been executed, always trigger
-            if self.last_execution is None:
-                return True
+        # check hardcoded intervals
+        elif isinstance(self.frequency, str):
+            last_execution_hour: datetime.datetime = self.last_execution.replace(minute=0, second=0, microsecond=0)
+            last_execution_day: datetime.datetime = last_execution_hour.replace(hour=0)
+
+            if self.frequency == "weekly":
+                # next Monday, 00:00
+                return last_execution_day + datetime.timedelta(days=7 - last_execution_day.weekday())
+
+            elif self.frequency == "daily":
+                # next midnight
+                return last_execution_day + datetime.timedelta(days=1)
 
             else:
-                # check hardcoded intervals
-                if isinstance(self.frequency, str):
-                    last_execution_date: datetime.date = self.last_execution.date()
-                    last_execution_week: int = last_execution_date.isocalendar()[1]
-                    last_execution_hour: int = self.last_execution.time().hour
-                    current_week: int = datetime.datetime.today().isocalendar()[1]
-                    current_hour: int = datetime.datetime.now().hour
-
-                    if self.frequency == "weekly":
-                        # triggers if week_numbers differ
-                        if last_execution_week != current_week:
-                            return True
-
-                    elif self.frequency == "daily":
-                        # triggers if day of month differs
-                        if last_execution_date.day != datetime.datetime.today().day:
-                            return True
-
-                    elif self.frequency == "hourly":
-                        # triggers if hour or day differ
-                        if last_execution_hour != current_hour or last_execution_date.day != datetime.datetime.today().day:
-                            return True
-
-                # check timedelta intervals
-                elif isinstance(self.frequency, datetime.timedelta):
-                    if datetime.datetime.now() - self.last_execution > self.frequency:
-                        return True
+                # start of the next hour
+                return last_execution_hour + datetime.timedelta(hours=1)
+
+        # timedelta intervals
+        else:
+            return self.last_execution + self.frequency
+
+    async def should_trigger(self) -> bool:
+        """
+        Check if the timer should trigger, e.g. because the last_execution is further in the past than the defined frequency
+
+        :return (bool): True if the conditions for triggering the timer are met. A timer that has never been triggered will always return True.
+                        False if the conditions are not met.
+        """
+
+        return datetime.datetime.now() >= self.next_due()
 
     async def trigger(self, client) -> bool:
         """
@@ -93,3 +102,124 @@ class Timer:
 
         else:
             return False
+
+
+class TimerScheduler:
+    def __init__(self, client, get_timers: Callable[[], List[Timer]], on_trigger: Callable[[Timer], None], retry_delay: int = 30):
+        """
+        Runs timers as their own asyncio task, independent of the sync loop.
+        All timers are kept in a min-heap by their next due time, the scheduler sleeps until the earliest timer is due and launches
+        due timers as independent tasks.
+        :param client: (nio.AsyncClient) the bot's matrix client, passed to the timers
+        :param get_timers: returns the list of all currently active timers
+        :param on_trigger: called after a timer has been triggered successfully, e.g. to save the plugin's state
+        :param retry_delay: seconds to wait before retrying a timer that raised an exception
+        """
+
+        self.client = client
+        self.get_timers: Callable[[], List[Timer]] = get_timers
+        self.on_trigger: Callable[[Timer], None] = on_trigger
+        self.retry_delay: int = retry_delay
+
+        self.heap: List[Tuple[datetime.datetime, int, Timer]] = []
+        self.running: Set[Timer] = set()
+        self.retry_at: Dict[Timer, datetime.datetime] = {}
+        self.changed: asyncio.Event = asyncio.Event()
+        self.task: asyncio.Task or None = None
+
+    def start(self) -> None:
+        """
+        Start the scheduler task, if it is not running already
+        :return:
+        """
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.__run(), name="timer-scheduler")
+            logger.debug("Timer scheduler started")
+
+    def stop(self) -> None:
+        """
+        Stop the scheduler task, timers already running are not cancelled
+        :return:
+        """
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def reschedule(self) -> None:
+        """
+        Notify the scheduler that timers have been added, removed or changed
+        :return:
+        """
+
+        self.changed.set()
+
+    def __rebuild(self) -> None:
+        """
+        Rebuild the heap from all active timers not currently running
+        :return:
+        """
+
+        self.heap = []
+        timer: Timer
+        for sequence, timer in enumerate(self.get_timers()):
+            if timer not in self.running:
+                next_due: datetime.datetime = timer.next_due()
+                if timer in self.retry_at:
+                    next_due = max(next_due, self.retry_at[timer])
+                self.heap.append((next_due, sequence, timer))
+        heapq.heapify(self.heap)
+
+    async def __run(self) -> None:
+        """
+        Main loop of the scheduler
+        :return:
+        """
+
+        self.changed.set()
+        while True:
+            if self.changed.is_set():
+                self.changed.clear()
+                self.__rebuild()
+
+            if not self.heap:
+                await self.changed.wait()
+                continue
+
+            next_due, sequence, timer = self.heap[0]
+            delay: float = (next_due - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                # wait for the next timer to become due or timers to change, re-check at least every minute to follow changes of the clock
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=min(delay, 60))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.heap)
+            self.running.add(timer)
+            self.retry_at.pop(timer, None)
+            asyncio.create_task(self.__run_timer(timer), name=f"timer-{timer.name}")
+
+    async def __run_timer(self, timer: Timer) -> None:
+        """
+        Trigger a single timer and schedule it again afterwards
+        :param timer: the timer to trigger
+        :return:
+        """
+
+        start_time: float = perf_counter()
+        try:
+            if await timer.trigger(self.client):
+                logger.debug(f"Timer {timer.name} triggered")
+                metrics.observe("timer", timer.name, perf_counter() - start_time)
+                self.on_trigger(timer)
+        except Exception:
+            logger.critical(f"Plugin failed to catch exception caused by timer {timer.name}:")
+            traceback.print_exc()
+            metrics.observe("timer", timer.name, perf_counter() - start_time, error=True)
+            self.retry_at[timer] = datetime.datetime.now() + datetime.timedelta(seconds=self.retry_delay)
+        finally:
+            self.running.discard(timer)
+            self.reschedule()
@@ -3,9 +3,9 @@
 import logging
 import asyncio
 import os
+import signal
 import sys
 import traceback
-from time import time
 from asyncio import sleep
 from nio import (
     AsyncClient,
@@ -15,10 +15,20 @@ from nio import (
     LocalProtocolError,
     LoginError,
     UnknownEvent,
+    SyncResponse,
+    SyncError,
 )
 from core.callbacks import Callbacks
 from core.config import Config
+from core.errors import SyncTokenRejectedError
+from core.sync_filter import SyncFilter
 from core.storage import Storage
+from core.dispatcher import EventDispatcher
+from core.metrics import metrics, start_metrics_server
+from core.send_queue import send_queue
+from core.sent_events import sent_events
+from core.media_cache import media_cache
+from core.http_client import http
 from aiohttp.client_exceptions import ServerDisconnectedError, ClientConnectionError, ClientConnectorError
 
 from core.pluginloader import PluginLoader
@@ -32,17 +42,17 @@ except ModuleNotFoundError:
     logger.info("not using uvloop, falling back to asyncio event loop")
 
 client: AsyncClient
-plugin_loader: PluginLoader
-timestamp: float = time()
+plugin_loader: PluginLoader or None = None
+dispatcher: EventDispatcher or None = None
 
 
-async def run_plugins(response):
+async def start_timers(response: SyncResponse):
+    """Start running the plugins' timers once the first sync has completed"""
 
     global plugin_loader
     global client
-    global timestamp
 
-    timestamp = await plugin_loader.run_timers(client, timestamp)
+    plugin_loader.start_timers(client)
 
 
 async def main():
@@ -51,6 +61,7 @@ async def main():
     # probably using https://docs.python.org/3.8/library/functools.html#functools.partial
     global client
     global plugin_loader
+    global dispatcher
 
     # Read user-configured options from a config file.
     # A different config file path can be specified as the first command line argument
@@ -76,6 +87,10 @@ async def main():
 
     # Configure the database
     store = Storage(config.database_filepath)
+    sent_events.configure(store, config.sent_events_cache_size)
+    media_cache.configure(store, config.media_cache_size)
+    http.configure(config.http_timeout, config.http_limit_per_host, config.http_retries)
+    http.cache.configure(store if config.http_cache_persistent else None, config.http_cache_size * 1024 * 1024)
 
     # Configuration options for the AsyncClient
     client_config = AsyncClientConfig(
@@ -95,16 +110,40 @@ async def main():
     )
 
     # instantiate the pluginLoader
-    plugin_loader = PluginLoader(config, client, plugins_dir=plugin_dir)
+    plugin_loader = PluginLoader(config, client, store, plugins_dir=plugin_dir)
     await plugin_loader.load_plugin_data()
     await plugin_loader.load_plugin_state()
 
+    # Set up the queue for handling events outside of the sync loop
+    dispatcher = EventDispatcher(max_queue_size=config.event_queue_max_size, workers=config.event_queue_workers)
+    dispatcher.start()
+    metrics.add_gauge("event_queue_depth", lambda: dispatcher.depth)
+
+    # Set up rate-limiting of sent events
+    send_queue.configure(
+        config.send_queue_global_rate, config.send_queue_global_burst, config.send_queue_room_rate, config.send_queue_room_burst, config.send_queue_max_retries
+    )
+    metrics.add_gauge("send_queue_depth", lambda: send_queue.depth)
+    metrics.add_gauge("send_rate", lambda: send_queue.global_bucket.rate)
+    metrics.add_gauge("http_cache_size", lambda: http.cache.size)
+
+    # Optionally serve metrics via http
+    if config.metrics_http_enabled:
+        await start_metrics_server(config.metrics_http_host, config.metrics_http_port)
+
     # Set up event callbacks
-    callbacks = Callbacks(client, store, config, plugin_loader)
+    callbacks = Callbacks(client, store, config, plugin_loader, dispatcher)
     client.add_event_callback(callbacks.message, (RoomMessageText,))
     client.add_event_callback(callbacks.invite, (InviteEvent,))
     client.add_event_callback(callbacks.event_unknown, (UnknownEvent,))
-    client.add_response_callback(run_plugins)
+    client.add_response_callback(start_timers, SyncResponse)
+    client.add_response_callback(callbacks.sync, SyncResponse)
+    client.add_response_callback(callbacks.sync_error, SyncError)
+
+    # Only sync events actually used by the plugins
+    sync_filter: SyncFilter or None = None
+    if config.sync_filter_enabled:
+        sync_filter = SyncFilter(config, store)
 
     # Keep trying to reconnect on failure (with some time in-between)
     error_retries: int = 0
@@ -154,7 +193,22 @@ async def main():
                 await client.keys_upload()
 
             logger.info(f"Logged in as {config.user_id}")
-            await client.sync_forever(timeout=30000, full_state=True)
+
+            # Resume syncing from the last known sync token, only request the full state if there is none
+            sync_token: str or None = (client.next_batch or store.get_sync_token()) if config.resume_sync else None
+            if sync_token:
+                logger.info(f"Resuming sync from {sync_token}")
+            else:
+                logger.info("No sync token found, requesting full state")
+            callbacks.sync_token = sync_token
+
+            sync_filter_id: str or None = await sync_filter.get_filter_id(client) if sync_filter else None
+            await client.sync_forever(timeout=30000, sync_filter=sync_filter_id, since=sync_token, full_state=None if sync_token else True)
+
+        except SyncTokenRejectedError:
+            # Sync again requesting the full state
+            client.next_batch = None
+            client.loaded_sync_token = None
 
         except (ClientConnectionError, ServerDisconnectedError, AttributeError, asyncio.TimeoutError, ClientConnectorError) as err:
             logger.debug(err)
@@ -168,4 +222,29 @@ async def main():
             await client.close()
 
 
-asyncio.new_event_loop().run_until_complete(main())
+async def run():
+    """Run the bot until it is stopped, writing the plugins' modified data before exiting"""
+
+    main_task: asyncio.Task = asyncio.current_task()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(stop_signal, main_task.cancel)
+        except NotImplementedError:
+            # not supported on Windows
+            pass
+
+    try:
+        await main()
+    except asyncio.CancelledError:
+        logger.info("Shutting down")
+    finally:
+        if dispatcher is not None:
+            # stop handling events before writing the data they may modify
+            await dispatcher.stop()
+        if plugin_loader is not None:
+            await plugin_loader.flush_plugin_data()
+        # the plugins' http session is kept across reconnects to the homeserver
+        await http.close()
+
+
+asyncio.new_event_loop().run_until_complete(run())
@@ -1,8 +1,7 @@
 from core.plugin import Plugin
 import logging
 from core.bot_commands import Command
-
-from pycoingecko import CoinGeckoAPI
+from typing import Any
 
 logger = logging.getLogger(__name__)
 
@@ -31,18 +30,29 @@ class VersusCurrencyNotFound(BaseException):
 class Coingecko:
     def __init__(self):
         plugin.add_config(config_item="default_versus_currency", default_value="eur")
-        self.api = CoinGeckoAPI()
+        self.api_base: str = "https://api.coingecko.com/api/v3"
         self.default_versus_currency = plugin.read_config(config_item="default_versus_currency")
 
+    async def __api(self, api_path: str, cache_ttl: float = 0, **params) -> Any:
+        """
+        Query the coingecko API
+        :param api_path: path of the API endpoint, e.g. "/coins/list"
+        :param cache_ttl: seconds the response may be reused for
+        :param params: query parameters
+        :return: the decoded response
+        """
+
+        return await plugin.http.get_json(self.api_base + api_path, params=params, cache_ttl=cache_ttl)
+
     async def validate_coin(self, coin: str, retry: bool = True) -> str:
         """
         validates/normalizes the coin to the corresponding coingecko coin_id and returns it\n
         recursively tries to find valid coin in local store before sending a new api request\n
         raises CoinNotFound
         """
-        available_coins_list = await plugin.read_data("available_coins_list")
+        available_coins_list = await plugin.view_data("available_coins_list")
         if not available_coins_list:
-            available_coins_list = self.api.get_coins_list()
+            available_coins_list = await self.__api("/coins/list")
             await plugin.store_data("available_coins_list", available_coins_list)
             retry = False
         # available_coins_list = list(filter(lambda coin: not "binance-peg" in coin["id"], available_coins_list))
@@ -51,7 +61,7 @@ class Coingecko:
             if coin not in [coin["name"].lower() for coin in available_coins_list]:
                 if coin not in [coin["symbol"].lower() for coin in available_coins_list]:
                     if retry:
-                        await plugin.store_data("available_coins_list", self.api.get_coins_list())
+                        await plugin.store_data("available_coins_list", await self.__api("/coins/list"))
                         return await self.validate_coin(coin, False)
                     else:
                         raise CoinNotFound(f"Coin '{coin}' not found.")
@@ -67,14 +77,14 @@ class Coingecko:
         recursively tries to find valid versus_currency in local store before sending a new api request\n
         raises VersusCurrencyNotFound
         """
-        available_versus_currencies = await plugin.read_data("available_versus_currencies")
+        available_versus_currencies = await plugin.view_data("available_versus_currencies")
         if not available_versus_currencies:
-            available_versus_currencies = self.api.get_supported_vs_currencies()
+            available_versus_currencies = await self.__api("/simple/supported_vs_currencies")
             await plugin.store_data("available_versus_currencies", available_versus_currencies)
             retry = False
         if versus_currency not in available_versus_currencies:
             if retry:
-                await plugin.store_data("available_versus_currencies", self.api.get_supported_vs_currencies())
+                await plugin.store_data("available_versus_currencies", await self.__api("/simple/supported_vs_currencies"))
                 return await self.validate_versus_currency(versus_currency, False)
             else:
                 raise VersusCurrencyNotFound(f"versus currency '{versus_currency}' not found")
@@ -83,11 +93,11 @@ class Coingecko:
     async def get_price_for_coin(self, coin: str, versus_currency: str) -> float:
         coin = await self.validate_coin(coin)
         versus_currency = await self.validate_versus_currency(versus_currency)
-        return self.api.get_price(coin, versus_currency)[coin][versus_currency]
+        return (await self.__api("/simple/price", cache_ttl=60, ids=coin, vs_currencies=versus_currency))[coin][versus_currency]
 
     async def get_chart_for_coin(self, coin: str) -> str:
         coin = await self.validate_coin(coin)
-        coin_infos: dict = self.api.get_coin_by_id(coin)
+        coin_infos: dict = await self.__api(f"/coins/{coin}", cache_ttl=300)
         coin_name = coin_infos["name"]
         coin_symbol = coin_infos["symbol"]
         coin_rank = coin_infos["market_cap_rank"]
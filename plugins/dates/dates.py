@@ -9,7 +9,6 @@ import datetime
 from shlex import split
 import logging
 from dateparser import parse
-from asyncio import sleep
 
 logger = logging.getLogger(__name__)
 plugin = Plugin("dates", "General", "Stores dates and birthdays, posts reminders")
@@ -449,8 +448,6 @@ async def post_reminders(client):
                 emoji: str
                 for emoji in emoji_list:
                     await plugin.send_reaction(client, store_date.mx_room, message_id, emoji)
-                # sleep for 15 seconds to avoid being ratelimited if there's multiple birthdays
-                await sleep(15)
 
             elif store_date.date_type == "date":
                 if datetime.datetime.now() < store_date.date:
@@ -1,14 +1,16 @@
 # -*- coding: utf8 -*-
+import asyncio
 import datetime
 import random
 import ssl
 import socket
 from typing import Dict, List, Tuple
 import pytz
-import requests
+from aiohttp import ClientError
 from nio import AsyncClient
 
 from core.bot_commands import Command
+from core.http_client import HttpResponse
 from core.plugin import Plugin
 import logging
 
@@ -57,7 +59,7 @@ class Server:
         self.software: str or None = None
         self.version: str or None = None
 
-        self.federation_test()
+        # call federation_test() to get the server's initial status
         self.currently_alive: bool = self.is_alive()
 
     def is_alive(self) -> bool:
@@ -140,7 +142,7 @@ class Server:
                     return True
             return False
 
-    def federation_test(self):
+    async def federation_test(self):
         """
         Do a federation_test for the given server
         :return:   Tuple of:    last_update: timestamp of the last successful update,
@@ -152,11 +154,11 @@ class Server:
         logger.debug(f"Updating {self.server_name}")
 
         try:
-            response: requests.Response = requests.get(
+            response: HttpResponse = await plugin.http.get(
                 plugin.read_config("federation_tester_url") + "/api/report",
                 params=api_parameters,
             )
-        except requests.exceptions.ConnectionError as err:
+        except ClientError as err:
             logger.warning(f"Connection to federation-tester failed: {err}")
             return
 
@@ -185,7 +187,7 @@ class Server:
             min_expire_date: datetime.datetime = datetime.datetime(year=2500, month=1, day=1)
             for host, port in hosts:
                 try:
-                    expire_date: datetime.datetime or None = ssl_expiry_datetime(host, port)
+                    expire_date: datetime.datetime or None = await asyncio.to_thread(ssl_expiry_datetime, host, port)
                 except (ssl.SSLCertVerificationError, ConnectionRefusedError):
                     expire_date = None
                 if expire_date:
@@ -255,6 +257,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
         # get initial server status and save it
         for server_name in shared_servers:
             server_list_new[server_name] = Server(server_name)
+            await server_list_new[server_name].federation_test()
         await plugin.store_data("server_list", server_list_new)
 
     else:
@@ -270,6 +273,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
         for server_name in shared_servers:
             if server_name not in server_names_saved:
                 server_list_saved[server_name] = Server(server_name)
+                await server_list_saved[server_name].federation_test()
         del server_names_saved
 
         # check for changes
@@ -289,7 +293,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
         server_list_new: Dict[str, Server] = server_list_saved
         for server in server_list_new.values():
             if forced_update or await server.needs_update():
-                server.federation_test()
+                await server.federation_test()
                 data_changed = True
                 if server.currently_alive and server.server_name not in previously_alive_servers:
                     new_alive_servers.append(server.server_name)
@@ -306,7 +310,7 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
         if not room_list:
             room_list = [x for x in client.rooms]
 
-        for room_id in room_list:
+        async def announce_changes(room_id: str):
             if plugin.read_config("report_connectivity_changes"):
                 for server in new_dead_servers:
                     if server not in plugin.read_config("server_ignore_list"):
@@ -344,6 +348,9 @@ async def update_federation_status(client_or_command: AsyncClient or Command):
                     except KeyError:
                         pass
 
+        # announce to all rooms at once, the messages are sent as fast as the rate-limits allow
+        await asyncio.gather(*[announce_changes(room_id) for room_id in room_list])
+
         if data_changed:
             await plugin.store_data("server_list", server_list_new)
 
@@ -1,5 +1,6 @@
 from nio import AsyncClient, MatrixRoom
 from core.plugin import Plugin
+from core.metrics import metrics
 
 plugin = Plugin("manage_bot", "General", "Provide functions to manage the bot from an admin-room")
 
@@ -28,6 +29,13 @@ def setup():
         plugin.read_config("manage_bot_rooms"),
         plugin.read_config("manage_bot_power_level"),
     )
+    plugin.add_command(
+        "bot_metrics",
+        bot_metrics,
+        "Display execution times of commands, hooks, timers and sent events",
+        plugin.read_config("manage_bot_rooms"),
+        plugin.read_config("manage_bot_power_level"),
+    )
 
 
 async def bot_rooms_list(command):
@@ -93,4 +101,14 @@ async def bot_leave_room(command):
         await plugin.respond_notice(command, f"Usage: `bot_leave_room <room_id>`")
 
 
+async def bot_metrics(command):
+    """
+    Display the metrics collected by the bot
+    :param command:
+    :return:
+    """
+
+    await plugin.respond_notice(command, metrics.render_summary())
+
+
 setup()
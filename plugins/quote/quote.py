@@ -181,7 +181,7 @@ class Quote:
 
     async def set_id(self) -> str:
 
-        quotes = await plugin.read_data("quotes")
+        quotes = await plugin.view_data("quotes")
         quote_id: str
         if quotes:
             quote_id = str(max(list(map(int, quotes.keys()))) + 1)
@@ -415,7 +415,7 @@ async def quote_command(command):
 
     """Load all active (quote.deleted == False) quotes"""
     try:
-        quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+        quotes: Dict[str, Quote] = await plugin.view_data("quotes")
         quotes = dict(filter(lambda item: not item[1].deleted, quotes.items()))
         if not quotes:
             await plugin.respond_notice(command, "Error: no quotes stored")
@@ -591,13 +591,13 @@ async def quote_replace_command(command):
     :return:
     """
 
-    if len(command.args) > 2 and re.match(r"\d+", command.args[0]) and command.args[0] in (await plugin.read_data("quotes")).keys():
+    if len(command.args) > 2 and re.match(r"\d+", command.args[0]) and command.args[0] in (await plugin.view_data("quotes")).keys():
 
         if not await plugin.backup_data():
             await plugin.respond_notice(command, f"Error creating backup file, quote not replaced.")
             return
 
-        old_quote_text: str = await (await plugin.read_data("quotes"))[command.args[0]].display_text(command)
+        old_quote_text: str = await (await plugin.view_data("quotes"))[command.args[0]].display_text(command)
         quote: Quote = await quote_add_or_replace(command, command.args[0])
         await plugin.respond_notice(
             command,
@@ -740,7 +740,7 @@ async def quote_del_annotations_command(command):
     if len(command.args) == 1 and command.args[0].isdigit():
         quote_id: str = str(command.args[0])
         try:
-            old_quote_text: str = await (await plugin.read_data("quotes"))[quote_id].display_text(command)
+            old_quote_text: str = await (await plugin.view_data("quotes"))[quote_id].display_text(command)
             await quotes[quote_id].del_annotations()
             await plugin.store_data("quotes", quotes)
             await plugin.respond_notice(command, f"{await quotes[quote_id].display_text(command)}", expanded_message=f"**Old:**  \n{old_quote_text}  \n\n")
@@ -792,7 +792,7 @@ async def quote_stats_command(command):
     :return:
     """
 
-    quotes: Dict[str, Quote] = await plugin.read_data("quotes")
+    quotes: Dict[str, Quote] = await plugin.view_data("quotes")
     if not quotes:
         quotes = {}
 
@@ -442,9 +442,9 @@ async def sample_fetch_image(command: Command):
     """
 
     if len(command.args) == 0:
-        image = await plugin.fetch_image_from_url("https://avatars.githubusercontent.com/u/1785173?s=120&v=4")
+        image = await plugin.fetch_image_data_from_url("https://avatars.githubusercontent.com/u/1785173?s=120&v=4")
         if image is not None:
-            await plugin.send_image(command.client, command.room.room_id, image)
+            await plugin.send_image(command.client, command.room.room_id, image[0], mime_type=image[1])
         else:
             await plugin.respond_notice(command, "Error fetching image")
 
@@ -1,14 +1,18 @@
 # -*- coding: utf8 -*-
 from __future__ import annotations
+import asyncio
 import datetime
+import functools
+import ssl
 from dateutil.parser import isoparse
 import logging
 from typing import Dict, List, Tuple
-import requests
+from aiohttp import ClientError
 from humanize import naturalsize
 from nio import AsyncClient
 
 from core.bot_commands import Command
+from core.http_client import HttpResponse
 from core.plugin import Plugin
 
 logger = logging.getLogger(__name__)
@@ -460,6 +464,34 @@ async def print_diff(name: str, old_value: int or str, new_value: int or str) ->
     return f"<li>{name}: {old_value} {sign} {new_value}</li>"
 
 
+def get_ssl() -> ssl.SSLContext or bool or None:
+    """
+    Get the ssl parameter of requests to sonarr according to the tls_verify setting
+    :return:    False, if certificates should not be verified
+                an ssl context verifying certificates against the CA bundle, if tls_verify is the path to one
+                None, to verify certificates (default)
+    """
+
+    tls_verify: bool or str = plugin.read_config("tls_verify")
+    if tls_verify is False:
+        return False
+    elif isinstance(tls_verify, str):
+        return get_ssl_context(tls_verify)
+    else:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_ssl_context(cafile: str) -> ssl.SSLContext:
+    """
+    Get an ssl context verifying certificates against a CA bundle, created only once as loading the bundle is expensive
+    :param cafile: path to the CA bundle
+    :return: the ssl context
+    """
+
+    return ssl.create_default_context(cafile=cafile)
+
+
 async def fetch_sonarr_api(api_path: str) -> List[str] or None:
     """
 
@@ -469,10 +501,8 @@ async def fetch_sonarr_api(api_path: str) -> List[str] or None:
     api_parameters = {"apikey": plugin.read_config("api_key")}
 
     try:
-        response: requests.Response = requests.get(
-            plugin.read_config("api_base") + f"/{api_path}", params=api_parameters, verify=plugin.read_config("tls_verify")
-        )
-    except requests.exceptions.ConnectionError as err:
+        response: HttpResponse = await plugin.http.get(plugin.read_config("api_base") + f"/{api_path}", params=api_parameters, ssl=get_ssl())
+    except (ClientError, OSError) as err:
         logger.warning(f"Connection to sonarr failed: {err}")
         return None
 
@@ -488,13 +518,14 @@ async def fetch_sonarr_data() -> Dict[str, List[Dict[str, any]]] or None:
     :return: (str) sorted JSON of currently tracked series
     """
 
-    series_json: List[Dict[str, any]] = sorted(await fetch_sonarr_api("series"), key=lambda i: i["sortTitle"])
-    tags_json: List[Dict[str, any]] = await fetch_sonarr_api("tag")
-    qualityprofiles_json: List[Dict[str, any]] = await fetch_sonarr_api("qualityprofile")
+    series_json: List[Dict[str, any]]
+    tags_json: List[Dict[str, any]]
+    qualityprofiles_json: List[Dict[str, any]]
+    series_json, tags_json, qualityprofiles_json = await asyncio.gather(fetch_sonarr_api("series"), fetch_sonarr_api("tag"), fetch_sonarr_api("qualityprofile"))
 
     if series_json and tags_json and qualityprofiles_json:
         return {
-            "series_json": series_json,
+            "series_json": sorted(series_json, key=lambda i: i["sortTitle"]),
             "tags_json": tags_json,
             "qualityprofiles_json": qualityprofiles_json,
         }
@@ -603,8 +634,8 @@ async def get_calendar_episodes(start_date: str, end_date: str) -> list or None:
         "end": end_date,
     }
     try:
-        response: requests.Response = requests.get(plugin.read_config("api_base") + api_path, params=api_parameters, verify=plugin.read_config("tls_verify"))
-    except requests.exceptions.ConnectionError as err:
+        response: HttpResponse = await plugin.http.get(plugin.read_config("api_base") + api_path, params=api_parameters, ssl=get_ssl())
+    except (ClientError, OSError) as err:
         logger.warning(f"Connection to sonarr failed: {err}")
         return None
 
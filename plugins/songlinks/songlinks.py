@@ -2,11 +2,11 @@ import asyncio
 import re
 from yarl import URL
 from urlextract import URLExtract
-import requests
-from urllib.parse import quote
+from aiohttp import ClientError
 
 from nio import AsyncClient, RoomMessageText
 from core.bot_commands import Command
+from core.http_client import HttpResponse
 from core.plugin import Plugin
 import logging
 
@@ -57,7 +57,11 @@ async def songlinks_message(client: AsyncClient, room_id: str, event: RoomMessag
             compiled_pattern = re.compile(pattern)
             if compiled_pattern.match(parsed_url.path):
                 # fetch songlinks-link
-                r = requests.get(f"https://api.song.link/v1-alpha.1/links?url={quote(url)}")
+                try:
+                    r: HttpResponse = await plugin.http.get("https://api.song.link/v1-alpha.1/links", params={"url": url}, cache_ttl=86400)
+                except ClientError as err:
+                    logger.warning(f"Connection to song.link failed: {err}")
+                    continue
                 if r.status_code == 200:
                     # post songlinks-link
                     json = r.json()
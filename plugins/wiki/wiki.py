@@ -1,7 +1,11 @@
 # -*- coding: utf8 -*-
+import asyncio
 import logging
+from typing import Tuple, Set
 
 import wikipedia
+from aiohttp import ClientError
+from requests import RequestException
 from urllib3.exceptions import NewConnectionError
 
 from core.bot_commands import Command
@@ -9,6 +13,7 @@ from core.plugin import Plugin
 
 logger = logging.getLogger(__name__)
 plugin = Plugin("wiki", "Lookup", "Lookup keywords in various online encyclopedias")
+wiki_lock: asyncio.Lock = asyncio.Lock()
 
 
 def setup():
@@ -26,6 +31,31 @@ def setup():
     )
 
 
+async def get_languages() -> Set[str]:
+    """
+    Get the language codes of all available wikipedias
+    :return: set of language codes, e.g. {"en", "de"}
+    """
+
+    response: dict = await plugin.http.get_json(
+        "https://en.wikipedia.org/w/api.php", params={"action": "query", "meta": "siteinfo", "siprop": "languages", "format": "json"}, cache_ttl=86400
+    )
+    return {language["code"] for language in response["query"]["languages"]}
+
+
+def fetch_article(lang: str, query: str) -> Tuple[str, str, str]:
+    """
+    Lookup the keyword(s) in wikipedia. Blocking, meant to be run in a worker thread
+    :param lang: language of wikipedia to do the lookup in
+    :param query: the keyword(s) to lookup
+    :return: tuple of the article's title, url and summary
+    """
+
+    wikipedia.set_lang(lang)
+    page: wikipedia.WikipediaPage = wikipedia.page(query)
+    return page.title, page.url, wikipedia.summary(query, sentences=3)
+
+
 async def lookup_wikipedia(command: Command, lang: str or None = None):
     """
     Check if an optional language has been provided, lookup the keyword(s) and post the results to the room.
@@ -34,7 +64,6 @@ async def lookup_wikipedia(command: Command, lang: str or None = None):
     :return:
     """
 
-    wiki: wikipedia = wikipedia
     if not lang and len(command.args) > 1 and len(command.args[0]) == 2:
         lang: str = command.args[0]
         query: str = " ".join(command.args[1:])
@@ -44,25 +73,25 @@ async def lookup_wikipedia(command: Command, lang: str or None = None):
         lang: str = plugin.read_config("default_lang")
         query: str = " ".join(command.args)
 
-    if lang in wiki.languages():
-        wiki.set_lang(lang)
-    else:
-        wiki.set_lang(plugin.read_config("default_lang"))
-        await plugin.respond_notice(command, f"Warning: invalid language specified, defaulting to {plugin.read_config('default_lang')}.")
-
-    try:
-        page: wikipedia.WikipediaPage = wiki.page(query)
-    except wikipedia.exceptions.DisambiguationError as e:
-        await plugin.respond_notice(command, f"Error: Disambiguation. You may want to try {' | '.join(e.options[:10])}. ")
-        return
-    except wikipedia.exceptions.PageError:
-        await plugin.respond_notice(command, "Error: No article found.")
-        return
-    except (NewConnectionError, ConnectionError):
-        await plugin.respond_notice(command, "Error: Error connecting to wikipedia.")
-        return
-
-    await plugin.respond_notice(command, f"[{page.title}]({page.url}): {wiki.summary(query, sentences=3)}")
+    # the wikipedia library is blocking and keeps the language globally, run lookups one at a time in a worker thread
+    async with wiki_lock:
+        try:
+            if lang not in await get_languages():
+                lang = plugin.read_config("default_lang")
+                await plugin.respond_notice(command, f"Warning: invalid language specified, defaulting to {plugin.read_config('default_lang')}.")
+
+            title, url, summary = await asyncio.to_thread(fetch_article, lang, query)
+        except wikipedia.exceptions.DisambiguationError as e:
+            await plugin.respond_notice(command, f"Error: Disambiguation. You may want to try {' | '.join(e.options[:10])}. ")
+            return
+        except wikipedia.exceptions.PageError:
+            await plugin.respond_notice(command, "Error: No article found.")
+            return
+        except (NewConnectionError, ConnectionError, RequestException, ClientError):
+            await plugin.respond_notice(command, "Error: Error connecting to wikipedia.")
+            return
+
+    await plugin.respond_notice(command, f"[{title}]({url}): {summary}")
 
 
 async def lookup_wikipedia_en(command: Command):
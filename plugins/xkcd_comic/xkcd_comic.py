@@ -1,14 +1,14 @@
 # -*- coding: utf8 -*-
+import asyncio
 import datetime
-from typing import List
+from typing import List, Tuple, Dict
 
-from PIL import Image
+from aiohttp import ClientError
 from nio import AsyncClient, UnknownEvent
 
 from core.bot_commands import Command
 from core.plugin import Plugin
 import logging
-import xkcd
 
 logger = logging.getLogger(__name__)
 plugin = Plugin("xkcd_comic", "General", "Fetch an xkcd-comic and post it to the room")
@@ -27,15 +27,30 @@ def setup():
     plugin.add_timer(xkcd_check, datetime.timedelta(hours=1))
 
 
-async def format_message(comic: xkcd.Comic, link_comic: bool = False) -> str:
+class Comic:
+    def __init__(self, comic_data: Dict[str, any]):
+        """
+        An xkcd-comic, as returned by xkcd's JSON API
+        :param comic_data: the comic's info.0.json
+        """
+
+        self.number: int = comic_data["num"]
+        self.title: str = comic_data["safe_title"]
+        self.alt_text: str = comic_data["alt"]
+        self.image_link: str = comic_data["img"]
+        self.link: str = f"https://www.xkcd.com/{self.number}"
+        self.explanation: str = f"https://explainxkcd.com/{self.number}"
+
+
+async def format_message(comic: Comic, link_comic: bool = False) -> str:
     """
     Format a message posting xkcd Comic number, title, alt-text and link to the explanation
-    :param comic: the xkcd.Comic Object
+    :param comic: the Comic Object
     :param link_comic: whether to include the link to the comic in the message
     :return:
     """
 
-    message: str = f"xkcd {comic.number}:  {comic.getTitle()}  \n{comic.altText}  \nExplanation: {comic.getExplanation()}"
+    message: str = f"xkcd {comic.number}:  {comic.title}  \n{comic.alt_text}  \nExplanation: {comic.explanation}"
 
     if link_comic:
         message = message.replace(f"xkcd {comic.number}", f"[xkcd {comic.number}]({comic.link})")
@@ -43,43 +58,47 @@ async def format_message(comic: xkcd.Comic, link_comic: bool = False) -> str:
     return message
 
 
-async def get_comic(comic_id: int or None = None) -> xkcd.Comic or None:
+async def get_comic(comic_id: int or None = None) -> Comic or None:
     """
     Retrieve the most recent or a specified xkcd-Comic
-    :return:    xkcd.Comic if successfully retrieved,
+    :return:    Comic if successfully retrieved,
                 None otherwise
     """
 
-    comic: xkcd.Comic
+    # published comics don't change, the most recent one is checked for updates regularly
+    if comic_id is None:
+        url: str = "https://xkcd.com/info.0.json"
+        cache_ttl: int = 300
+    else:
+        url: str = f"https://xkcd.com/{comic_id}/info.0.json"
+        cache_ttl: int = 7 * 86400
     try:
-        if comic_id is None:
-            return xkcd.getLatestComic()
-        else:
-            return xkcd.getComic(comic_id)
-    except:
+        return Comic(await plugin.http.get_json(url, cache_ttl=cache_ttl))
+    except (ClientError, ValueError, KeyError) as err:
+        logger.warning(f"Unable to get xkcd-Comic {comic_id or ''}: {err}")
         return None
 
 
-async def post_xkcd(client: AsyncClient, room_id: str, comic: xkcd.Comic):
+async def post_xkcd(client: AsyncClient, room_ids: List[str], comic: Comic):
     """
-    Post an xkcd-comic to a room
+    Post an xkcd-comic to one or more rooms
     :param client:
-    :param room_id:
+    :param room_ids:
     :param comic:
     :return:
     """
 
     if plugin.read_config("url_only") == False:
-        image: Image.Image = await plugin.fetch_image_from_url(comic.imageLink)
+        image: Tuple[bytes, str or None] or None = await plugin.fetch_image_data_from_url(comic.image_link)
         if image is not None:
-            await plugin.send_image(client, room_id, image)
-            await plugin.send_message(client, room_id, await format_message(comic))
+            await asyncio.gather(*[plugin.send_image(client, room_id, image[0], mime_type=image[1]) for room_id in room_ids])
+            await plugin.broadcast_message(client, room_ids, await format_message(comic))
         else:
             # error retrieving the actual image, fall back to posting the url
-            await plugin.send_message(client, room_id, await format_message(comic, link_comic=True))
+            await plugin.broadcast_message(client, room_ids, await format_message(comic, link_comic=True))
 
     else:
-        await plugin.send_message(client, room_id, await format_message(comic, link_comic=True))
+        await plugin.broadcast_message(client, room_ids, await format_message(comic, link_comic=True))
 
 
 async def xkcd_command(command: Command):
@@ -89,7 +108,7 @@ async def xkcd_command(command: Command):
     :return:
     """
 
-    comic: xkcd.Comic
+    comic: Comic
 
     if len(command.args) == 0:
         # post most recent xkcd_comic
@@ -106,7 +125,7 @@ async def xkcd_command(command: Command):
     if comic is None:
         await plugin.respond_notice(command, "Error fetching comic.")
     else:
-        await post_xkcd(command.client, command.room.room_id, comic)
+        await post_xkcd(command.client, [command.room.room_id], comic)
 
 
 async def xkcd_react(client: AsyncClient, room_id: str, event: UnknownEvent):
@@ -119,9 +138,9 @@ async def xkcd_react(client: AsyncClient, room_id: str, event: UnknownEvent):
     """
 
     if plugin.has_hook("m.reaction", xkcd_react, [room_id]):
-        comic: xkcd.Comic = await get_comic()
+        comic: Comic = await get_comic()
         if comic is not None:
-            await post_xkcd(client, room_id, comic)
+            await post_xkcd(client, [room_id], comic)
         plugin.del_hook("m.reaction", xkcd_react, [room_id])
 
 
@@ -138,28 +157,25 @@ async def xkcd_check(client):
         if known_recent is None:
             known_recent = 0
 
-        try:
-            comic: xkcd.Comic = xkcd.getLatestComic()
-        except:
-            logger.warning(f"Unable to get latest xkcd-Comic.")
+        comic: Comic or None = await get_comic()
+        if comic is None:
             return
         if comic.number > known_recent:
             if plugin.read_config("notification_only") == True:
                 # notification_only is set, only post a notification about a new comic
                 plugin.del_hook("m.reaction", xkcd_react)
-                message_ids: List[str] = []
-                for room_id in room_list:
-                    message_id: str or None = await plugin.send_notice(
-                        client, room_id, f"New xkcd-Comic: [{comic.title} ({comic.number})]({comic.link}). `!xkcd` or 👀 to display."
-                    )
-                    await plugin.send_reaction(client, room_id, message_id, "👀")
-                    message_ids.append(message_id)
+                sent_notices: Dict[str, str or None] = await plugin.broadcast_notice(
+                    client, room_list, f"New xkcd-Comic: [{comic.title} ({comic.number})]({comic.link}). `!xkcd` or 👀 to display."
+                )
+                message_ids: List[str] = [message_id for message_id in sent_notices.values() if message_id is not None]
+                await asyncio.gather(
+                    *[plugin.send_reaction(client, room_id, message_id, "👀") for room_id, message_id in sent_notices.items() if message_id is not None]
+                )
                 if message_ids:
                     plugin.add_hook("m.reaction", xkcd_react, room_list, message_ids, hook_type="dynamic")
 
             else:
-                for room_id in room_list:
-                    await post_xkcd(client, room_id, comic)
+                await post_xkcd(client, room_list, comic)
             await plugin.store_data("known_recent", comic.number)
 
 
@@ -1,10 +1,11 @@
 from typing import Dict
 
-import requests
+from aiohttp import ClientError
 from nio import AsyncClient, RoomMessageText
 from urlextract import URLExtract
 
 from core.bot_commands import Command
+from core.http_client import HttpResponse
 from core.plugin import Plugin
 import logging
 import re
@@ -111,17 +112,19 @@ async def youtube_message(client: AsyncClient, room_id: str, event: RoomMessageT
             return
 
         youtube_error = False
-        youtube_response: requests.Response = requests.Response()
+        youtube_response: HttpResponse or None = None
 
         try:
-            youtube_response: requests.Response = requests.get(
-                f'https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={plugin.read_config("api_key")}&fields={fields}&part={parts}'
+            youtube_response = await plugin.http.get(
+                "https://www.googleapis.com/youtube/v3/videos",
+                params={"id": video_id, "key": plugin.read_config("api_key"), "fields": fields, "part": parts},
+                cache_ttl=3600,
             )
 
-        except requests.exceptions.ConnectionError as err:
+        except ClientError as err:
             logger.warning(f"Connection to youtube-API failed: {err}")
 
-        if youtube_response.status_code == 200:
+        if youtube_response is not None and youtube_response.status_code == 200:
             response_json: Dict[str, any] = youtube_response.json()
             video = response_json.get("items")[0]
             video_title: str = video.get("snippet").get("title")
@@ -137,19 +140,19 @@ async def youtube_message(client: AsyncClient, room_id: str, event: RoomMessageT
             youtube_likes: int = int(video.get("statistics").get("likeCount"))
 
         else:
-            logger.warning(f"Error in youtube API response: {youtube_response.status_code}")
+            logger.warning(f"Error in youtube API response: {youtube_response.status_code if youtube_response else None}")
             youtube_error = True
 
         if plugin.read_config("enable_dislikes"):
             youtube_dislike_error = False
-            youtube_dislike_response: requests.Response = requests.Response()
+            youtube_dislike_response: HttpResponse or None = None
 
             try:
-                youtube_dislike_response: requests.Response = requests.get(f"https://returnyoutubedislikeapi.com/Votes?videoId={video_id}")
-            except requests.exceptions.ConnectionError as err:
+                youtube_dislike_response = await plugin.http.get("https://returnyoutubedislikeapi.com/Votes", params={"videoId": video_id}, cache_ttl=3600)
+            except ClientError as err:
                 logger.warning(f"Connection to youtube-dislike-API failed: {err}")
 
-            if youtube_dislike_response.status_code == 200:
+            if youtube_dislike_response is not None and youtube_dislike_response.status_code == 200:
                 response_json: Dict[str, any] = youtube_dislike_response.json()
                 youtube_dislike_likes: int = response_json.get("likes")
                 youtube_dislike_rawlikes: int = response_json.get("rawLikes")
@@ -160,7 +163,7 @@ async def youtube_message(client: AsyncClient, room_id: str, event: RoomMessageT
                     youtube_dislike_error = True
 
             else:
-                logger.warning(f"Error in youtube-dislike API response: {youtube_dislike_response.status_code}")
+                logger.warning(f"Error in youtube-dislike API response: {youtube_dislike_response.status_code if youtube_dislike_response else None}")
                 youtube_dislike_error = True
 
         if not youtube_error:
@@ -0,0 +1,64 @@
+import operator
+import random
+import string
+from typing import Dict
+
+from fuzzywuzzy import fuzz
+
+from core.command_matcher import CommandMatcher
+from core.registry import PluginRegistry
+
+
+def brute_force_match(commands: Dict[str, None], command: str) -> str or None:
+    """
+    Fuzzy matching as done before the command matcher: score every command, highest ratio wins, ties in registration order
+    """
+
+    ratios: Dict[str, int] = {}
+    for key in commands.keys():
+        if fuzz.ratio(command, key) > 60:
+            ratios[key] = fuzz.ratio(command, key)
+
+    if ratios != {}:
+        return sorted(ratios.items(), key=operator.itemgetter(1), reverse=True)[0][0]
+    return None
+
+
+def make_registry(commands: Dict[str, None]) -> PluginRegistry:
+    registry: PluginRegistry = PluginRegistry()
+    registry.commands = commands
+    registry.version += 1
+    return registry
+
+
+def test_pruned_match_equals_brute_force():
+    rng: random.Random = random.Random(42)
+    alphabet: str = string.ascii_lowercase[:10] + "_"
+    commands: Dict[str, None] = {"".join(rng.choices(alphabet, k=rng.randint(2, 12))): None for _ in range(300)}
+    matcher: CommandMatcher = CommandMatcher(make_registry(commands))
+
+    for _ in range(2000):
+        typed: str = "".join(rng.choices(alphabet, k=rng.randint(1, 12)))
+        assert matcher.match(typed) == brute_force_match(commands, typed), typed
+
+
+def test_misspelled_command():
+    commands: Dict[str, None] = {"help": None, "quote": None, "quote_add": None, "xkcd": None}
+    matcher: CommandMatcher = CommandMatcher(make_registry(commands))
+
+    assert matcher.match("quote") == "quote"
+    assert matcher.match("qoute") == brute_force_match(commands, "qoute") == "quote"
+    assert matcher.match("hepl") == brute_force_match(commands, "hepl")
+    assert matcher.match("zzz") is None
+
+
+def test_cache_dropped_on_registry_change():
+    commands: Dict[str, None] = {"quote": None}
+    registry: PluginRegistry = make_registry(commands)
+    matcher: CommandMatcher = CommandMatcher(registry)
+
+    assert matcher.match("xkdc") is None
+
+    registry.commands["xkcd"] = None
+    registry.version += 1
+    assert matcher.match("xkdc") == "xkcd"
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+from typing import Any, List, Tuple
+
+import pytest
+
+import core.plugin
+from core.plugin import Plugin
+from core.storage import Storage
+
+
+class RecordingStorage(Storage):
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.saved: List[Tuple[str, str, Any]] = []
+
+    async def save_plugin_data(self, plugin: str, key: str, value: Any):
+        self.saved.append((plugin, key, value))
+        await super().save_plugin_data(plugin, key, value)
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch) -> Plugin:
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(core.plugin, "data_write_delay", 0.2)
+    os.mkdir("plugins")
+    return Plugin("sample", "General", "Plugin data tests")
+
+
+def test_writes_are_debounced(plugin):
+    store: RecordingStorage = RecordingStorage("bot.db")
+    plugin.store = store
+
+    async def run():
+        for counter in range(5):
+            await plugin.store_data("counter", counter)
+        await plugin.store_data("name", "sample")
+        await asyncio.sleep(0.1)
+        assert store.saved == []
+
+        await asyncio.sleep(0.3)
+
+    asyncio.run(run())
+    assert sorted(store.saved) == [("sample", "counter", 4), ("sample", "name", "sample")]
+    assert store.get_plugin_data("sample") == {"counter": 4, "name": "sample"}
+    store.close()
+
+
+def test_flush_writes_pending_data(plugin):
+    store: RecordingStorage = RecordingStorage("bot.db")
+    plugin.store = store
+
+    async def run():
+        quotes: dict = {"1": "hello"}
+        await plugin.store_data("quotes", quotes)
+        # modified in place and stored again
+        quotes["2"] = "world"
+        await plugin.store_data("quotes", quotes)
+        await plugin.clear_data("missing")
+        assert await plugin._flush_data()
+
+    asyncio.run(run())
+    assert store.saved == [("sample", "quotes", {"1": "hello", "2": "world"})]
+    assert store.get_plugin_data("sample") == {"quotes": {"1": "hello", "2": "world"}}
+    store.close()
+
+
+def test_file_written_once_per_flush(plugin, monkeypatch):
+    writes: List[str] = []
+    write_json_later = core.plugin.write_json_later
+
+    def record_write(filename: str, data: Any):
+        writes.append(filename)
+        return write_json_later(filename, data)
+
+    monkeypatch.setattr(core.plugin, "write_json_later", record_write)
+
+    async def run():
+        await plugin.store_data("a", 1)
+        await plugin.store_data("b", 2)
+        await plugin.store_data("c", 3)
+        assert await plugin._flush_data()
+
+    asyncio.run(run())
+    assert writes == [plugin.plugin_dataj_filename]
+    with open(plugin.plugin_dataj_filename) as file:
+        assert json.load(file) == {"a": 1, "b": 2, "c": 3}
+
+
+def test_snapshot_taken_when_writing(tmp_path):
+    store: Storage = Storage(os.path.join(tmp_path, "bot.db"))
+    data: dict = {"1": "hello"}
+
+    async def write():
+        saved: asyncio.Task = asyncio.create_task(store.save_plugin_data("quote", "quotes", data))
+        await asyncio.sleep(0)
+        # keys added while the write is pending are not part of it
+        data["2"] = "world"
+        await saved
+
+    asyncio.run(write())
+    assert store.get_plugin_data("quote") == {"quotes": {"1": "hello"}}
+    store.close()
@@ -0,0 +1,73 @@
+import pytest
+
+from core.read_only import read_only, ReadOnlyDict, ReadOnlyList, ReadOnlyObject, ReadOnlySet
+
+
+class Quote:
+    def __init__(self, text: str):
+        self.text: str = text
+        self.reactions: dict = {}
+
+    def display_text(self) -> str:
+        return f"Quote: {self.text}"
+
+    def add_reaction(self, reaction: str) -> None:
+        self.reactions[reaction] = self.reactions.get(reaction, 0) + 1
+
+    def set_text(self, text: str) -> None:
+        self.text = text
+
+
+def test_views_without_copying():
+    data: dict = {"quotes": [Quote("hello")], "tags": {"a", "b"}, "count": 1}
+    view = read_only(data)
+
+    assert isinstance(view, ReadOnlyDict)
+    assert isinstance(view["quotes"], ReadOnlyList)
+    assert isinstance(view["quotes"][0], ReadOnlyObject)
+    assert isinstance(view["tags"], ReadOnlySet)
+    assert view["count"] == 1
+    assert view == data
+
+    # changes of the data are visible through the view
+    data["count"] = 2
+    assert view["count"] == 2
+
+
+def test_mutating_containers_raises():
+    view = read_only({"list": [1, 2], "dict": {"a": 1}, "set": {1}})
+
+    with pytest.raises(TypeError):
+        view["new"] = 1
+    with pytest.raises(TypeError):
+        del view["list"]
+    with pytest.raises(TypeError):
+        view["list"][0] = 3
+    with pytest.raises(AttributeError):
+        view["list"].append(3)
+    with pytest.raises(TypeError):
+        view["dict"]["a"] = 2
+    with pytest.raises(AttributeError):
+        view["set"].add(2)
+
+
+def test_mutating_objects_raises():
+    quote: Quote = Quote("hello")
+    view = read_only(quote)
+
+    with pytest.raises(TypeError):
+        view.text = "changed"
+    with pytest.raises(TypeError):
+        del view.text
+    with pytest.raises(TypeError):
+        view.reactions["+1"] = 1
+
+    # methods may read the object, but not modify it
+    assert view.display_text() == "Quote: hello"
+    with pytest.raises(TypeError):
+        view.add_reaction("+1")
+    with pytest.raises(TypeError):
+        view.set_text("changed")
+
+    assert quote.text == "hello"
+    assert quote.reactions == {}
@@ -0,0 +1,67 @@
+import asyncio
+from time import monotonic
+from typing import List, Tuple
+
+from nio import RoomSendError, RoomSendResponse
+
+from core.send_queue import SendQueue, TokenBucket
+
+
+class RateLimitedClient:
+    def __init__(self, rate_limited: int, retry_after_ms: int):
+        """
+        Fake client answering the first `rate_limited` events with M_LIMIT_EXCEEDED
+        """
+
+        self.rate_limited: int = rate_limited
+        self.retry_after_ms: int = retry_after_ms
+        self.sent: List[Tuple[float, str, str]] = []
+
+    async def room_send(self, room_id: str, message_type: str, content: dict, tx_id: str, ignore_unverified_devices: bool):
+        self.sent.append((monotonic(), room_id, tx_id))
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            return RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", self.retry_after_ms)
+        return RoomSendResponse(f"$event{len(self.sent)}", room_id)
+
+
+def test_token_bucket():
+    bucket: TokenBucket = TokenBucket(rate=2.0, burst=2)
+    now: float = bucket.updated
+
+    bucket.consume(now)
+    bucket.consume(now)
+    assert bucket.delay(now) == 0.5
+    assert bucket.delay(now + 0.5) == 0.0
+
+    bucket.drain()
+    assert bucket.delay(now + 0.5) == 0.5
+
+
+def test_rate_limit_pauses_and_halves_rate():
+    client: RateLimitedClient = RateLimitedClient(rate_limited=1, retry_after_ms=200)
+
+    async def run() -> Tuple[list, float, float]:
+        send_queue: SendQueue = SendQueue(global_rate=8.0, global_burst=8, room_rate=8.0, room_burst=8, rate_increase=0.5)
+        first: asyncio.Task = asyncio.create_task(send_queue.send(client, "!a:example.org", "m.room.message", {"msgtype": "m.text", "body": "a"}))
+        await asyncio.sleep(0.05)
+        rate_after_limit: float = send_queue.global_bucket.rate
+
+        # events of other rooms are paused as well
+        second: asyncio.Task = asyncio.create_task(send_queue.send(client, "!b:example.org", "m.room.message", {"msgtype": "m.text", "body": "b"}))
+        responses: list = await asyncio.gather(first, second)
+        return responses, rate_after_limit, send_queue.global_bucket.rate
+
+    responses, rate_after_limit, final_rate = asyncio.run(run())
+
+    assert all(isinstance(response, RoomSendResponse) for response in responses)
+    assert rate_after_limit == 4.0
+    # increased again by every event sent successfully
+    assert final_rate == 5.0
+
+    assert len(client.sent) == 3
+    limited_at, room_id, tx_id = client.sent[0]
+    assert [sent[1] for sent in client.sent[1:]].count(room_id) == 1
+    assert all(sent_at - limited_at >= 0.2 for sent_at, _, _ in client.sent[1:])
+    # the retry reuses the transaction id
+    assert [sent[2] for sent in client.sent].count(tx_id) == 2
@@ -0,0 +1,28 @@
+import asyncio
+import os
+
+from core.storage import Storage
+
+
+def test_plugin_data_per_key(tmp_path):
+    db_path: str = os.path.join(tmp_path, "bot.db")
+
+    async def write(store: Storage):
+        await store.save_plugin_data("quote", "quotes", {"1": "hello"})
+        await store.save_plugin_data("quote", "store_version", 2)
+        await store.save_plugin_data("dates", "reminders", [1, 2])
+        # replaces the previously stored value of the key
+        await store.save_plugin_data("quote", "quotes", {"1": "hello", "2": "world"})
+        await store.delete_plugin_data("quote", "store_version")
+
+    store: Storage = Storage(db_path)
+    asyncio.run(write(store))
+    assert store.get_plugin_data("quote") == {"quotes": {"1": "hello", "2": "world"}}
+    assert store.get_plugin_data("dates") == {"reminders": [1, 2]}
+    assert store.get_plugin_data("unknown") == {}
+    store.close()
+
+    # persisted across restarts
+    store = Storage(db_path)
+    assert store.get_plugin_data("quote") == {"quotes": {"1": "hello", "2": "world"}}
+    store.close()
@@ -0,0 +1,58 @@
+import asyncio
+import datetime
+from time import monotonic
+from typing import List
+
+from core.timer import Timer, TimerScheduler
+
+
+def make_timer(name: str, calls: List[str], due_in: float) -> Timer:
+    """
+    Create a timer running every minute, due `due_in` seconds from now
+    """
+
+    async def method(client):
+        calls.append(name)
+
+    frequency: datetime.timedelta = datetime.timedelta(minutes=1)
+    return Timer(name, method, frequency, last_execution=datetime.datetime.now() - frequency + datetime.timedelta(seconds=due_in))
+
+
+def test_due_timers_run_in_order_of_due_time():
+    calls: List[str] = []
+    triggered: List[str] = []
+    timers: List[Timer] = [make_timer("late", calls, -3), make_timer("future", calls, 3600), make_timer("oldest", calls, -10), make_timer("recent", calls, -1)]
+
+    async def run():
+        scheduler: TimerScheduler = TimerScheduler(None, lambda: timers, lambda timer: triggered.append(timer.name))
+        scheduler.start()
+        await asyncio.sleep(0.1)
+        scheduler.stop()
+
+    asyncio.run(run())
+    assert calls == ["oldest", "late", "recent"]
+    assert sorted(triggered) == ["late", "oldest", "recent"]
+
+
+def test_failed_timer_is_retried_after_delay():
+    call_times: List[float] = []
+    triggered: List[str] = []
+
+    async def method(client):
+        call_times.append(monotonic())
+        if len(call_times) == 1:
+            raise RuntimeError("first call fails")
+
+    timer: Timer = Timer("flaky", method, datetime.timedelta(minutes=1))
+
+    async def run():
+        scheduler: TimerScheduler = TimerScheduler(None, lambda: [timer], lambda triggered_timer: triggered.append(triggered_timer.name), retry_delay=0.2)
+        scheduler.start()
+        await asyncio.sleep(0.5)
+        scheduler.stop()
+
+    asyncio.run(run())
+    assert len(call_times) == 2
+    assert call_times[1] - call_times[0] >= 0.2
+    assert triggered == ["flaky"]
+    assert timer.last_execution is not None